@@ -1,32 +1,64 @@
 import os
 from argparse import ArgumentParser
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
-from text_utils import EngToIPAMode, SymbolFormat
+from text_utils import EngToIPAMode, Language, SymbolFormat
 
-from speech_dataset_preprocessing.app.ds import (preprocess_arctic,
+from speech_dataset_preprocessing.app.combined import preprocess_to_final_ds
+from speech_dataset_preprocessing.app.ds import (filter_ds, preprocess_arctic,
                                                  preprocess_generic,
                                                  preprocess_libritts,
                                                  preprocess_ljs,
                                                  preprocess_mailabs,
                                                  preprocess_thchs,
                                                  preprocess_thchs_kaldi)
-from speech_dataset_preprocessing.app.final import merge_to_final_ds
-from speech_dataset_preprocessing.app.mel import preprocess_mels
+from speech_dataset_preprocessing.app.export import export_final_ds
+from speech_dataset_preprocessing.app.filtering import (filter_final_ds,
+                                                        filter_text,
+                                                        filter_wavs)
+from speech_dataset_preprocessing.app.final import (combine_final_ds,
+                                                    merge_to_final_ds)
+from speech_dataset_preprocessing.app.mel import mels_merge, preprocess_mels
+from speech_dataset_preprocessing.app.pipeline import (load_pipeline_stages,
+                                                       run_pipeline)
 from speech_dataset_preprocessing.app.plots import plot_mels
 from speech_dataset_preprocessing.app.text import (preprocess_text,
                                                    text_change_ipa,
                                                    text_change_text,
                                                    text_convert_to_ipa,
                                                    text_map_to_ipa,
-                                                   text_normalize)
+                                                   text_normalize, text_stats)
 from speech_dataset_preprocessing.app.tools import remove_silence_plot
+from speech_dataset_preprocessing.app.validation import (
+    load_excluded_entry_ids, validate_wavs)
 from speech_dataset_preprocessing.app.wav import (preprocess_wavs,
+                                                  wavs_convert, wavs_merge,
                                                   wavs_normalize,
                                                   wavs_remove_silence,
-                                                  wavs_resample, wavs_stats,
+                                                  wavs_resample,
+                                                  wavs_resample_benchmark,
+                                                  wavs_segment, wavs_stats,
                                                   wavs_stereo_to_mono)
+from speech_dataset_preprocessing.core.export import DEFAULT_SHARD_FRAMES
+from speech_dataset_preprocessing.core.features import (DEFAULT_F0_MAX,
+                                                        DEFAULT_F0_MIN)
+from speech_dataset_preprocessing.core.filtering import EntryFilter
+from speech_dataset_preprocessing.core.mel import (DEFAULT_BLOCK_FRAMES,
+                                                   MelEncoding,
+                                                   MelProcessingMode)
+from speech_dataset_preprocessing.core.packed import PACKED_DTYPES
+from speech_dataset_preprocessing.core.pipeline import (DEFAULT_PIPELINE_JOBS,
+                                                        PipelineStage)
+from speech_dataset_preprocessing.core.pipelined import (
+    DEFAULT_IO_JOBS, DEFAULT_READ_QUEUE_SIZE, DEFAULT_WRITE_QUEUE_SIZE)
+from speech_dataset_preprocessing.core.resample import ResampleMode
+from speech_dataset_preprocessing.core.validation import (
+    DEFAULT_MAX_CLIPPING_RATE, DEFAULT_MAX_DC_OFFSET)
+from speech_dataset_preprocessing.core.work_queue import (DEFAULT_BATCH_SIZE,
+                                                          DEFAULT_LEASE_S,
+                                                          QueueRole)
+from speech_dataset_preprocessing.globals import DEFAULT_FINAL_CHUNK_SIZE
 
 
 def split_hparams_string(hparams: Optional[str]) -> Optional[Dict[str, str]]:
@@ -38,6 +70,43 @@ def split_hparams_string(hparams: Optional[str]) -> Optional[Dict[str, str]]:
   return result
 
 
+def add_entry_filter_arguments(parser: ArgumentParser) -> None:
+  parser.add_argument('--speakers', type=str, nargs="+", help="keep only these speakers")
+  parser.add_argument('--languages', choices=Language, type=Language.__getitem__, nargs="+",
+                      help="keep only these languages")
+  parser.add_argument('--min_duration_s', type=float)
+  parser.add_argument('--max_duration_s', type=float)
+  parser.add_argument('--min_symbols', type=int)
+  parser.add_argument('--max_symbols', type=int)
+  parser.add_argument('--excluded_entry_ids', type=int, nargs="+")
+  parser.add_argument('--validated_wav_name', type=str,
+                      help="exclude the entries which failed the validation of these wavs")
+
+
+def pop_entry_filter(args: Dict) -> EntryFilter:
+  def pop_set(name: str) -> Optional[set]:
+    values = args.pop(name)
+    return None if values is None else set(values)
+
+  excluded_entry_ids = pop_set("excluded_entry_ids")
+  validated_wav_name = args.pop("validated_wav_name")
+  if validated_wav_name is not None:
+    invalid_entry_ids = load_excluded_entry_ids(
+      args["base_dir"], args["ds_name"], validated_wav_name)
+    excluded_entry_ids = invalid_entry_ids | (excluded_entry_ids or set())
+
+  result = EntryFilter(
+    speakers=pop_set("speakers"),
+    languages=pop_set("languages"),
+    min_duration_s=args.pop("min_duration_s"),
+    max_duration_s=args.pop("max_duration_s"),
+    min_symbols=args.pop("min_symbols"),
+    max_symbols=args.pop("max_symbols"),
+    excluded_entry_ids=excluded_entry_ids,
+  )
+  return result
+
+
 def init_preprocess_generic_parser(parser: ArgumentParser):
   parser.add_argument('--path', type=Path, required=True, help='dataset directory')
   parser.add_argument('--ds_name', type=str, required=True)
@@ -94,10 +163,63 @@ def init_preprocess_thchs_kaldi_parser(parser: ArgumentParser):
   return preprocess_thchs_kaldi
 
 
+def add_pipeline_arguments(parser: ArgumentParser) -> None:
+  parser.add_argument('--io_jobs', type=int, default=DEFAULT_IO_JOBS,
+                      help="count of threads for reading and for writing")
+  parser.add_argument('--read_queue_size', type=int, default=DEFAULT_READ_QUEUE_SIZE,
+                      help="count of entries which are read ahead")
+  parser.add_argument('--write_queue_size', type=int, default=DEFAULT_WRITE_QUEUE_SIZE,
+                      help="count of processed entries which can wait for being written")
+
+
+def add_packed_argument(parser: ArgumentParser) -> None:
+  parser.add_argument('--packed_dtype', choices=PACKED_DTYPES,
+                      help="write the wavs as raw PCM of this type into shards instead of one wav file per entry")
+
+
+def add_shard_arguments(parser: ArgumentParser) -> None:
+  parser.add_argument('--shard_index', type=int,
+                      help="process only this shard of the entries and save a partial result, requires --num_shards")
+  parser.add_argument('--num_shards', type=int,
+                      help="count of length-balanced shards into which the entries are split, e.g. one per node")
+
+
+def add_queue_arguments(parser: ArgumentParser) -> None:
+  parser.add_argument('--queue_role', choices=QueueRole, type=QueueRole.__getitem__,
+                      help="process batches of a work queue in the output directory; one COORDINATOR creates the queue and merges the results, any count of WORKERs (e.g. on other nodes) help until all batches are done")
+  parser.add_argument('--batch_size', type=int, default=DEFAULT_BATCH_SIZE,
+                      help="count of entries per batch of the queue")
+  parser.add_argument('--lease_s', type=float, default=DEFAULT_LEASE_S,
+                      help="seconds after which the batch of a worker which stopped renewing its lease is processed again")
+  parser.add_argument('--queue_run_id', type=str,
+                      help="id of the run of the queue; the COORDINATOR logs the generated id if it is not given, WORKERs require it and ignore the queue of any other run")
+
+
 def init_preprocess_mels_parser(parser: ArgumentParser):
   parser.add_argument('--ds_name', type=str, required=True)
   parser.add_argument('--wav_name', type=str, required=True)
   parser.add_argument('--custom_hparams', type=str)
+  parser.add_argument('--encoding', choices=MelEncoding, type=MelEncoding.__getitem__,
+                      default=MelEncoding.PT, help="file format in which the mels are stored")
+  parser.add_argument('--mode', choices=MelProcessingMode, type=MelProcessingMode.__getitem__,
+                      default=MelProcessingMode.THREADS, help="compute the mels in threads or in processes")
+  parser.add_argument('--n_processes', type=int,
+                      help="count of processes in PROCESSES mode; it is tuned if it or --n_threads is not given")
+  parser.add_argument('--n_threads', type=int,
+                      help="count of torch threads per process in PROCESSES mode")
+  parser.add_argument('--block_frames', type=int, default=DEFAULT_BLOCK_FRAMES,
+                      help="longer wavs are processed in blocks of this count of frames to limit the memory")
+  add_pipeline_arguments(parser)
+  add_shard_arguments(parser)
+  add_queue_arguments(parser)
+  parser.add_argument('--compute_stats', action='store_true',
+                      help="accumulate the mean and std of every mel channel, overall and per speaker, while the mels are computed")
+  parser.add_argument('--compute_features', action='store_true',
+                      help="save the energy and F0 of every mel frame next to the mel")
+  parser.add_argument('--f0_min', type=float, default=DEFAULT_F0_MIN,
+                      help="lowest F0 in Hz which is estimated")
+  parser.add_argument('--f0_max', type=float, default=DEFAULT_F0_MAX,
+                      help="highest F0 in Hz which is estimated")
   parser.add_argument("--overwrite", action="store_true")
   return preprocess_mels_cli
 
@@ -107,6 +229,14 @@ def preprocess_mels_cli(**args):
   preprocess_mels(**args)
 
 
+def init_mels_merge_parser(parser: ArgumentParser):
+  parser.add_argument('--ds_name', type=str, required=True)
+  parser.add_argument('--wav_name', type=str, required=True)
+  parser.add_argument('--num_shards', type=int, required=True)
+  parser.add_argument("--overwrite", action="store_true")
+  return mels_merge
+
+
 def init_mels_plot_parser(parser: ArgumentParser):
   parser.add_argument('--ds_name', type=str, required=True)
   parser.add_argument('--wav_name', type=str, required=True)
@@ -124,17 +254,143 @@ def init_merge_to_final_ds_parser(parser: ArgumentParser):
   parser.add_argument('--text_name', type=str, required=True)
   parser.add_argument('--audio_name', type=str, required=True)
   parser.add_argument('--final_name', type=str, required=True)
+  parser.add_argument('--chunk_size', type=int, default=DEFAULT_FINAL_CHUNK_SIZE,
+                      help="amount of entries which are merged and written at once")
   parser.add_argument("--overwrite", action="store_true")
   return merge_to_final_ds
 
 
+def init_preprocess_to_final_ds_parser(parser: ArgumentParser):
+  parser.add_argument('--ds_name', type=str, required=True)
+  parser.add_argument('--text_name', type=str, required=True)
+  parser.add_argument('--audio_name', type=str, required=True)
+  parser.add_argument('--final_name', type=str, required=True)
+  parser.add_argument('--normalize_text', action='store_true')
+  parser.add_argument('--to_ipa', action='store_true', help="convert the text to IPA after the normalization")
+  parser.add_argument('--consider_annotations', action='store_true')
+  parser.add_argument('--mode', choices=EngToIPAMode, type=EngToIPAMode.__getitem__)
+  parser.add_argument('--custom_hparams', type=str)
+  parser.add_argument('--encoding', choices=MelEncoding, type=MelEncoding.__getitem__,
+                      default=MelEncoding.PT, help="file format in which the mels are stored")
+  parser.add_argument('--block_frames', type=int, default=DEFAULT_BLOCK_FRAMES,
+                      help="longer wavs are processed in blocks of this count of frames to limit the memory")
+  parser.add_argument('--chunk_size', type=int, default=DEFAULT_FINAL_CHUNK_SIZE,
+                      help="amount of entries which are merged and written at once")
+  parser.add_argument("--overwrite", action="store_true")
+  return preprocess_to_final_ds_cli
+
+
+def preprocess_to_final_ds_cli(**args):
+  args["custom_hparams"] = split_hparams_string(args["custom_hparams"])
+  preprocess_to_final_ds(**args)
+
+
+def init_export_final_ds_parser(parser: ArgumentParser):
+  parser.add_argument('--ds_name', type=str, required=True)
+  parser.add_argument('--final_name', type=str, required=True)
+  parser.add_argument('--export_name', type=str, required=True)
+  parser.add_argument('--mel_dtype', type=str, choices=["float32", "float16"], default="float32")
+  parser.add_argument('--shard_frames', type=int, default=DEFAULT_SHARD_FRAMES,
+                      help="minimum amount of mel frames per shard")
+  parser.add_argument("--overwrite", action="store_true")
+  return export_final_ds
+
+
+def init_filter_ds_parser(parser: ArgumentParser):
+  parser.add_argument('--ds_name', type=str, required=True)
+  parser.add_argument('--dest_ds_name', type=str, required=True)
+  add_entry_filter_arguments(parser)
+  parser.add_argument("--overwrite", action="store_true")
+  return filter_ds_cli
+
+
+def filter_ds_cli(**args):
+  args["entry_filter"] = pop_entry_filter(args)
+  filter_ds(**args)
+
+
+def init_validate_wavs_parser(parser: ArgumentParser):
+  parser.add_argument('--ds_name', type=str, required=True)
+  parser.add_argument('--wav_name', type=str, required=True)
+  parser.add_argument('--text_name', type=str,
+                      help="validate the symbols of this text, too")
+  parser.add_argument('--max_clipping_rate', type=float, default=DEFAULT_MAX_CLIPPING_RATE,
+                      help="maximum share of samples at full scale")
+  parser.add_argument('--max_dc_offset', type=float, default=DEFAULT_MAX_DC_OFFSET,
+                      help="maximum absolute mean relative to full scale")
+  parser.add_argument("--overwrite", action="store_true")
+  return validate_wavs
+
+
+def init_filter_wavs_parser(parser: ArgumentParser):
+  parser.add_argument('--ds_name', type=str, required=True)
+  parser.add_argument('--orig_wav_name', type=str, required=True)
+  parser.add_argument('--dest_wav_name', type=str, required=True)
+  add_entry_filter_arguments(parser)
+  parser.add_argument("--overwrite", action="store_true")
+  return filter_wavs_cli
+
+
+def filter_wavs_cli(**args):
+  args["entry_filter"] = pop_entry_filter(args)
+  filter_wavs(**args)
+
+
+def init_filter_text_parser(parser: ArgumentParser):
+  parser.add_argument('--ds_name', type=str, required=True)
+  parser.add_argument('--orig_text_name', type=str, required=True)
+  parser.add_argument('--dest_text_name', type=str, required=True)
+  add_entry_filter_arguments(parser)
+  parser.add_argument("--overwrite", action="store_true")
+  return filter_text_cli
+
+
+def filter_text_cli(**args):
+  args["entry_filter"] = pop_entry_filter(args)
+  filter_text(**args)
+
+
+def init_combine_final_ds_parser(parser: ArgumentParser):
+  parser.add_argument('--ds_names', type=str, nargs="+", required=True)
+  parser.add_argument('--final_names', type=str, nargs="+", required=True,
+                      help="final name of each dataset in --ds_names")
+  parser.add_argument('--dest_ds_name', type=str, required=True)
+  parser.add_argument('--dest_final_name', type=str, required=True)
+  parser.add_argument('--keep_speaker_names', action="store_false", dest="prefix_speakers",
+                      help="don't prefix the speaker names with the dataset name, i.e. equal names are treated as one speaker")
+  parser.add_argument('--chunk_size', type=int, default=DEFAULT_FINAL_CHUNK_SIZE)
+  parser.add_argument("--overwrite", action="store_true")
+  return combine_final_ds
+
+
+def init_filter_final_ds_parser(parser: ArgumentParser):
+  parser.add_argument('--ds_name', type=str, required=True)
+  parser.add_argument('--orig_final_name', type=str, required=True)
+  parser.add_argument('--dest_final_name', type=str, required=True)
+  add_entry_filter_arguments(parser)
+  parser.add_argument("--overwrite", action="store_true")
+  return filter_final_ds_cli
+
+
+def filter_final_ds_cli(**args):
+  args["entry_filter"] = pop_entry_filter(args)
+  filter_final_ds(**args)
+
+
 def init_preprocess_text_parser(parser: ArgumentParser):
   parser.add_argument('--ds_name', type=str, required=True)
   parser.add_argument('--text_name', type=str, required=True)
+  add_queue_arguments(parser)
   parser.add_argument("--overwrite", action="store_true")
   return preprocess_text
 
 
+def init_text_stats_parser(parser: ArgumentParser):
+  parser.add_argument('--ds_name', type=str, required=True)
+  parser.add_argument('--text_name', type=str, required=True)
+  return text_stats
+
+
 def init_text_normalize_parser(parser: ArgumentParser):
   parser.add_argument('--ds_name', type=str, required=True)
   parser.add_argument('--orig_text_name', type=str, required=True)
@@ -150,6 +406,7 @@ def init_text_convert_to_ipa_parser(parser: ArgumentParser):
   parser.add_argument('--consider_annotations', action='store_true')
   parser.add_argument('--mode', choices=EngToIPAMode,
                       type=EngToIPAMode.__getitem__)
+  add_queue_arguments(parser)
   parser.add_argument("--overwrite", action="store_true")
   return text_convert_to_ipa
 
@@ -187,10 +444,22 @@ def init_text_map_to_ipa_parser(parser: ArgumentParser):
 def init_preprocess_wavs_parser(parser: ArgumentParser):
   parser.add_argument('--ds_name', type=str, required=True)
   parser.add_argument('--wav_name', type=str, required=True)
+  add_pipeline_arguments(parser)
+  add_packed_argument(parser)
+  add_shard_arguments(parser)
+  add_queue_arguments(parser)
   parser.add_argument("--overwrite", action="store_true")
   return preprocess_wavs
 
 
+def init_wavs_merge_parser(parser: ArgumentParser):
+  parser.add_argument('--ds_name', type=str, required=True)
+  parser.add_argument('--wav_name', type=str, required=True)
+  parser.add_argument('--num_shards', type=int, required=True)
+  parser.add_argument("--overwrite", action="store_true")
+  return wavs_merge
+
+
 def init_wavs_stats_parser(parser: ArgumentParser):
   parser.add_argument('--ds_name', type=str, required=True)
   parser.add_argument('--wav_name', type=str, required=True)
@@ -201,6 +470,9 @@ def init_wavs_normalize_parser(parser: ArgumentParser):
   parser.add_argument('--ds_name', type=str, required=True)
   parser.add_argument('--orig_wav_name', type=str, required=True)
   parser.add_argument('--dest_wav_name', type=str, required=True)
+  add_packed_argument(parser)
+  add_shard_arguments(parser)
+  add_queue_arguments(parser)
   parser.add_argument("--overwrite", action="store_true")
   return wavs_normalize
 
@@ -210,14 +482,49 @@ def init_wavs_upsample_parser(parser: ArgumentParser):
   parser.add_argument('--orig_wav_name', type=str, required=True)
   parser.add_argument('--dest_wav_name', type=str, required=True)
   parser.add_argument('--rate', type=int, required=True)
+  parser.add_argument('--mode', choices=ResampleMode, type=ResampleMode.__getitem__,
+                      default=ResampleMode.QUALITY)
+  add_packed_argument(parser)
+  add_shard_arguments(parser)
+  add_queue_arguments(parser)
   parser.add_argument("--overwrite", action="store_true")
   return wavs_resample
 
 
+def init_wavs_resample_benchmark_parser(parser: ArgumentParser):
+  parser.add_argument('--ds_name', type=str, required=True)
+  parser.add_argument('--wav_name', type=str, required=True)
+  parser.add_argument('--rate', type=int, required=True)
+  parser.add_argument('--mode', choices=ResampleMode, type=ResampleMode.__getitem__,
+                      default=ResampleMode.QUALITY)
+  parser.add_argument('--entries_count', type=int, default=100,
+                      help="amount of entries (from the start) which are resampled")
+  return wavs_resample_benchmark
+
+
+def init_wavs_convert_parser(parser: ArgumentParser):
+  parser.add_argument('--ds_name', type=str, required=True)
+  parser.add_argument('--orig_wav_name', type=str, required=True)
+  parser.add_argument('--dest_wav_name', type=str, required=True)
+  parser.add_argument('--to_mono', action="store_true")
+  parser.add_argument('--peak_normalize', action="store_true")
+  parser.add_argument('--rate', type=int, help="keep empty to keep the sampling rates")
+  parser.add_argument('--mode', choices=ResampleMode, type=ResampleMode.__getitem__,
+                      default=ResampleMode.QUALITY)
+  add_packed_argument(parser)
+  add_shard_arguments(parser)
+  add_queue_arguments(parser)
+  parser.add_argument("--overwrite", action="store_true")
+  return wavs_convert
+
+
 def init_wavs_stereo_to_mono_parser(parser: ArgumentParser):
   parser.add_argument('--ds_name', type=str, required=True)
   parser.add_argument('--orig_wav_name', type=str, required=True)
   parser.add_argument('--dest_wav_name', type=str, required=True)
+  add_packed_argument(parser)
+  add_shard_arguments(parser)
+  add_queue_arguments(parser)
   parser.add_argument("--overwrite", action="store_true")
   return wavs_stereo_to_mono
 
@@ -233,15 +540,38 @@ def init_wavs_remove_silence_parser(parser: ArgumentParser):
                       help="amount of factors of chunk_size at the beginning and the end should be reserved", required=True)
   parser.add_argument('--buffer_end_ms', type=float,
                       help="amount of factors of chunk_size at the beginning and the end should be reserved", required=True)
+  add_packed_argument(parser)
+  add_shard_arguments(parser)
+  add_queue_arguments(parser)
   parser.add_argument("--overwrite", action="store_true")
   return wavs_remove_silence
 
 
+def init_wavs_segment_parser(parser: ArgumentParser):
+  parser.add_argument('--ds_name', type=str, required=True)
+  parser.add_argument('--orig_wav_name', type=str, required=True)
+  parser.add_argument('--dest_wav_name', type=str, required=True)
+  parser.add_argument('--chunk_size', type=int, required=True,
+                      help="count of samples over which the energy is calculated")
+  parser.add_argument('--threshold', type=float, required=True,
+                      help="chunks with a lower energy (dBFS) are silent")
+  parser.add_argument('--min_silence_ms', type=float, default=300,
+                      help="minimum length of a silence at which the recordings are split")
+  parser.add_argument('--min_length_s', type=float, default=1)
+  parser.add_argument('--max_length_s', type=float, default=15)
+  add_packed_argument(parser)
+  parser.add_argument("--overwrite", action="store_true")
+  return wavs_segment
+
+
 def init_wavs_remove_silence_plot_parser(parser: ArgumentParser):
   parser.add_argument('--ds_name', type=str, required=True)
   parser.add_argument('--wav_name', type=str, required=True)
   parser.add_argument('--chunk_size', type=int, required=True)
   parser.add_argument('--entry_id', type=int, help="Keep empty for random entry.")
+  parser.add_argument('--seed', type=int, help="seed of the random entry")
+  parser.add_argument('--weighted', action="store_true",
+                      help="draw the random entry with a probability proportional to its duration")
   parser.add_argument('--threshold_start', type=float, required=True)
   parser.add_argument('--threshold_end', type=float, required=True)
   parser.add_argument('--buffer_start_ms', type=float,
@@ -251,6 +581,43 @@ def init_wavs_remove_silence_plot_parser(parser: ArgumentParser):
   return remove_silence_plot
 
 
+def init_run_pipeline_parser(parser: ArgumentParser):
+  parser.add_argument('--spec', type=Path, required=True,
+                      help="YAML or JSON file with the stages, i.e. the commands and their arguments")
+  parser.add_argument('--n_jobs', type=int, default=DEFAULT_PIPELINE_JOBS,
+                      help="count of stages which run concurrently, e.g. the text and the wav stages")
+  return run_pipeline_cli
+
+
+def get_stage_argv(stage: PipelineStage) -> List[str]:
+  result = [stage.command]
+  for name, value in stage.args.items():
+    if value is None or value is False:
+      continue
+    result.append(f"--{name}")
+    if value is True:
+      continue
+    if isinstance(value, list):
+      result.extend(str(x) for x in value)
+    else:
+      result.append(str(value))
+  # a stage is only executed if its inputs or arguments changed
+  result.append("--overwrite")
+  return result
+
+
+def run_pipeline_cli(base_dir: Path, spec: Path, n_jobs: int):
+  main_parser = _init_parser()
+  stages = load_pipeline_stages(spec)
+  # the arguments of all stages are checked before the first one starts
+  stage_args = {stage.name: main_parser.parse_args(get_stage_argv(stage)) for stage in stages}
+
+  def invoke_stage(stage: PipelineStage) -> None:
+    _process_args(stage_args[stage.name])
+
+  run_pipeline(base_dir, stages, invoke_stage, n_jobs)
+
+
 BASE_DIR_VAR = "base_dir"
 
 
@@ -280,26 +647,44 @@ def _init_parser():
   _add_parser_to(subparsers, "preprocess-thchs", init_preprocess_thchs_parser)
   _add_parser_to(subparsers, "preprocess-thchs-kaldi", init_preprocess_thchs_kaldi_parser)
 
+  _add_parser_to(subparsers, "ds-filter", init_filter_ds_parser)
+
   _add_parser_to(subparsers, "preprocess-wavs", init_preprocess_wavs_parser)
+  _add_parser_to(subparsers, "wavs-merge", init_wavs_merge_parser)
   _add_parser_to(subparsers, "wavs-stats", init_wavs_stats_parser)
   _add_parser_to(subparsers, "wavs-normalize", init_wavs_normalize_parser)
   _add_parser_to(subparsers, "wavs-resample", init_wavs_upsample_parser)
+  _add_parser_to(subparsers, "wavs-resample-benchmark", init_wavs_resample_benchmark_parser)
   _add_parser_to(subparsers, "wavs-stereo-to-mono", init_wavs_stereo_to_mono_parser)
+  _add_parser_to(subparsers, "wavs-convert", init_wavs_convert_parser)
   _add_parser_to(subparsers, "wavs-remove-silence", init_wavs_remove_silence_parser)
   _add_parser_to(subparsers, "wavs-remove-silence-plot", init_wavs_remove_silence_plot_parser)
+  _add_parser_to(subparsers, "wavs-segment", init_wavs_segment_parser)
+  _add_parser_to(subparsers, "wavs-validate", init_validate_wavs_parser)
+  _add_parser_to(subparsers, "wavs-filter", init_filter_wavs_parser)
 
   _add_parser_to(subparsers, "preprocess-text", init_preprocess_text_parser)
+  _add_parser_to(subparsers, "text-stats", init_text_stats_parser)
   _add_parser_to(subparsers, "text-normalize", init_text_normalize_parser)
   _add_parser_to(subparsers, "text-change-text", init_text_change_text_parser)
   _add_parser_to(subparsers, "text-ipa", init_text_convert_to_ipa_parser)
   _add_parser_to(subparsers, "text-change-ipa", init_text_change_ipa_parser)
   _add_parser_to(subparsers, "text-arpa-to-ipa", init_text_map_to_ipa_parser)
+  _add_parser_to(subparsers, "text-filter", init_filter_text_parser)
 
   _add_parser_to(subparsers, "preprocess-mels", init_preprocess_mels_parser)
+  _add_parser_to(subparsers, "mels-merge", init_mels_merge_parser)
   # is also possible without preprocess mels first
   _add_parser_to(subparsers, "mels-plot", init_mels_plot_parser)
 
   _add_parser_to(subparsers, "merge", init_merge_to_final_ds_parser)
+  # text, wavs and mels in one run without the intermediate steps
+  _add_parser_to(subparsers, "preprocess-to-final", init_preprocess_to_final_ds_parser)
+  _add_parser_to(subparsers, "final-filter", init_filter_final_ds_parser)
+  _add_parser_to(subparsers, "final-combine", init_combine_final_ds_parser)
+  _add_parser_to(subparsers, "export", init_export_final_ds_parser)
+
+  _add_parser_to(subparsers, "pipeline", init_run_pipeline_parser)
 
   return result
 
@@ -1 +1 @@
-from speech_dataset_preprocessing.app.final import load_final_ds
\ No newline at end of file
+from speech_dataset_preprocessing.app.final import iterate_final_ds, load_final_ds
\ No newline at end of file
@@ -0,0 +1,92 @@
+from concurrent.futures.process import ProcessPoolExecutor
+from functools import partial
+from logging import getLogger
+from multiprocessing import cpu_count
+from pathlib import Path
+from shutil import rmtree
+from typing import Dict, Optional
+
+from speech_dataset_preprocessing.app.ds import get_ds_dir, load_ds_data
+from speech_dataset_preprocessing.app.final import (get_final_dir,
+                                                    save_merged_final_ds)
+from speech_dataset_preprocessing.app.mel import (get_mel_dir, save_mel,
+                                                  save_mel_data)
+from speech_dataset_preprocessing.app.text import (get_text_dir,
+                                                   save_text_data,
+                                                   save_text_outputs,
+                                                   save_text_stats)
+from speech_dataset_preprocessing.app.wav import (get_wav_dir, save_wav_data,
+                                                  save_wav_stats)
+from speech_dataset_preprocessing.core.ds import DsDataList, get_entries_count
+from speech_dataset_preprocessing.core.mel import (DEFAULT_BLOCK_FRAMES,
+                                                   MelEncoding)
+from speech_dataset_preprocessing.core.mel import process as process_mels
+from speech_dataset_preprocessing.core.text import (TextDataList,
+                                                    convert_to_ipa, normalize)
+from speech_dataset_preprocessing.core.text import \
+    preprocess as preprocess_text
+from speech_dataset_preprocessing.core.wav import preprocess as preprocess_wav
+from speech_dataset_preprocessing.globals import DEFAULT_FINAL_CHUNK_SIZE
+from text_utils import EngToIPAMode
+
+
+def _process_text_branch(ds_data: DsDataList, text_dir: Path, normalize_text: bool, to_ipa: bool, consider_annotations: Optional[bool], mode: Optional[EngToIPAMode]) -> TextDataList:
+  # runs in its own process, the outputs are written there as well
+  text_data = preprocess_text(ds_data)
+  if normalize_text:
+    text_data = normalize(text_data)
+  if to_ipa:
+    text_data = convert_to_ipa(text_data, consider_annotations, mode, n_jobs=1)
+  save_text_data(text_dir, text_data)
+  save_text_outputs(text_dir, text_data.items())
+  return text_data
+
+
+def preprocess_to_final_ds(base_dir: Path, ds_name: str, text_name: str, audio_name: str, final_name: str, normalize_text: bool = False, to_ipa: bool = False, consider_annotations: Optional[bool] = None, mode: Optional[EngToIPAMode] = None, custom_hparams: Optional[Dict[str, str]] = None, encoding: MelEncoding = MelEncoding.PT, block_frames: Optional[int] = DEFAULT_BLOCK_FRAMES, chunk_size: int = DEFAULT_FINAL_CHUNK_SIZE, overwrite: bool = False) -> None:
+  # the text and the audio branch are independent until the merge, so the text branch runs in a separate process
+  logger = getLogger(__name__)
+  logger.info("Preprocessing text, wavs and mels...")
+  ds_dir = get_ds_dir(base_dir, ds_name)
+  text_dir = get_text_dir(ds_dir, text_name)
+  wav_dir = get_wav_dir(ds_dir, audio_name)
+  mel_dir = get_mel_dir(ds_dir, audio_name)
+  final_dir = get_final_dir(ds_dir, final_name)
+  output_dirs = [text_dir, wav_dir, mel_dir, final_dir]
+  existing_dirs = [output_dir for output_dir in output_dirs if output_dir.is_dir()]
+  if len(existing_dirs) > 0 and not overwrite:
+    logger.error("Already exists.")
+    return
+
+  # the data is read once for both branches
+  ds_data = load_ds_data(ds_dir)
+  if len(existing_dirs) > 0:
+    assert overwrite
+    logger.info("Overwriting existing data.")
+    for existing_dir in existing_dirs:
+      rmtree(existing_dir)
+  for output_dir in output_dirs:
+    output_dir.mkdir(parents=True, exist_ok=False)
+
+  # the separate audio stages leave one core for the main process (cpu_count() - 1), here another one is left for the process of the text branch
+  n_jobs = max(1, cpu_count() - 2)
+  with ProcessPoolExecutor(max_workers=1) as ex:
+    text_future = ex.submit(_process_text_branch, ds_data, text_dir, normalize_text,
+                            to_ipa, consider_annotations, mode)
+
+    wav_data = preprocess_wav(ds_data, wav_dir, n_jobs)
+    save_wav_data(wav_dir, wav_data)
+    save_wav_stats(ds_dir, wav_dir, ds_data, wav_data)
+    save_callback = partial(save_mel, dest_dir=mel_dir,
+                            data_len=get_entries_count(wav_data.items()), encoding=encoding)
+    mel_data = process_mels(wav_data, wav_dir, custom_hparams, save_callback,
+                            n_jobs, encoding, block_frames=block_frames)
+    save_mel_data(mel_dir, mel_data)
+    logger.info("Audio is done, waiting for the text...")
+    text_data = text_future.result()
+  # the stats are saved like the ones of the separate stages, e.g. for the stats commands
+  save_text_stats(ds_dir, text_dir, ds_data, text_data)
+
+  count = save_merged_final_ds(final_dir, ds_data.items(), text_data.items(), wav_data.items(),
+                               mel_data.items(), wav_dir, mel_dir, chunk_size)
+  logger.info(f"Merged {count} entries.")
+  logger.info("Done.")
@@ -0,0 +1,92 @@
+import pickle
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Iterator, Optional
+
+from general_utils import GenericList
+
+# the lists of the stages are kept in memory while a pipeline runs, i.e. a stage gets the output of the previous one without reading it again
+# they are still saved, so that the stages can be continued with single commands
+_cache: Optional[Dict[Path, Any]] = None
+_lock = Lock()
+
+# the lists are saved in frames of this count of entries, so that they can be iterated without loading them completely
+DATA_FRAME_SIZE = 2 ** 12
+
+
+@contextmanager
+def keep_data_in_memory() -> Iterator[None]:
+  global _cache
+  with _lock:
+    assert _cache is None
+    _cache = {}
+  try:
+    yield
+  finally:
+    with _lock:
+      _cache = None
+
+
+def _iterate_frames(path: Path) -> Iterator[Any]:
+  with path.open(mode="rb") as file:
+    while True:
+      try:
+        yield pickle.load(file)
+      except EOFError:
+        return
+
+
+def _save_frames(data: Any, path: Path) -> None:
+  # each frame is a list of the type of the data, i.e. a file of one frame equals the one of a pickled list
+  with path.open(mode="wb") as file:
+    if not isinstance(data, GenericList):
+      pickle.dump(data, file)
+      return
+    entries = iter(data.items())
+    while True:
+      frame = type(data)(islice(entries, DATA_FRAME_SIZE))
+      pickle.dump(frame, file)
+      if len(frame) < DATA_FRAME_SIZE:
+        return
+
+
+def _load_frames(path: Path) -> Any:
+  frames = _iterate_frames(path)
+  result = next(frames)
+  for frame in frames:
+    for entry in frame.items():
+      result.append(entry)
+  return result
+
+
+def load_data(path: Path) -> Any:
+  key = path.absolute()
+  with _lock:
+    if _cache is not None and key in _cache:
+      return _cache[key]
+  result = _load_frames(path)
+  with _lock:
+    if _cache is not None:
+      _cache[key] = result
+  return result
+
+
+def iterate_data(path: Path) -> Iterator[Any]:
+  # only one frame of the list is in memory at a time, unless the list is kept in memory anyway
+  key = path.absolute()
+  with _lock:
+    cached = _cache.get(key) if _cache is not None else None
+  if cached is not None:
+    yield from cached.items()
+    return
+  for frame in _iterate_frames(path):
+    yield from frame.items()
+
+
+def save_data(data: Any, path: Path) -> None:
+  _save_frames(data, path)
+  with _lock:
+    if _cache is not None:
+      _cache[path.absolute()] = data
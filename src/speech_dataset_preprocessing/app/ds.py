@@ -2,19 +2,23 @@ from functools import partial
 from logging import Logger, getLogger
 from pathlib import Path
 from shutil import copyfile, rmtree
-from typing import Callable
+from typing import Callable, Iterator
 
-from general_utils import load_obj, save_obj
-from speech_dataset_preprocessing.core.ds import (DsDataList,
+from speech_dataset_preprocessing.app.data_cache import (iterate_data,
+                                                         load_data, save_data)
+from speech_dataset_preprocessing.core.ds import (DsData, DsDataList,
                                                   PreprocessingResult,
                                                   arctic_preprocess,
                                                   generic_preprocess,
                                                   get_speaker_examples,
+                                                  get_speakers_log,
                                                   libritts_preprocess,
                                                   ljs_preprocess,
                                                   mailabs_preprocess,
                                                   thchs_kaldi_preprocess,
                                                   thchs_preprocess)
+from speech_dataset_preprocessing.core.filtering import (EntryFilter,
+                                                         filter_ds_data)
 from text_utils import SpeakersLogDict, SymbolFormat
 from unidecode import unidecode as convert_to_ascii
 
@@ -34,14 +38,23 @@ def get_ds_examples_dir(ds_dir: Path) -> Path:
   return ds_dir / "examples"
 
 
+def get_ds_data_path(ds_dir: Path) -> Path:
+  return ds_dir / _ds_data_csv
+
+
 def __save_ds_data(ds_dir: Path, result: DsDataList) -> None:
-  path = ds_dir / _ds_data_csv
-  save_obj(result, path)
+  path = get_ds_data_path(ds_dir)
+  save_data(result, path)
 
 
 def load_ds_data(ds_dir: Path) -> DsDataList:
-  path = ds_dir / _ds_data_csv
-  return load_obj(path)
+  path = get_ds_data_path(ds_dir)
+  return load_data(path)
+
+
+def iterate_ds_data(ds_dir: Path) -> Iterator[DsData]:
+  path = get_ds_data_path(ds_dir)
+  return iterate_data(path)
 
 
 def _save_ds_speaker_log_json(ds_dir: Path, speakers_log: SpeakersLogDict) -> None:
@@ -131,7 +144,7 @@ def __preprocess_ds(base_dir: Path, ds_name: str, preprocess_func: Callable[[],
 
   _save_ds_speaker_log_json(ds_dir, speakers_log)
   __save_ds_data(ds_dir, ds_data)
-  examples = get_speaker_examples(ds_data)
+  examples = get_speaker_examples(ds_data.items())
   _save_speaker_examples(ds_dir, examples, logger)
   logger.info("Dataset processed.")
 
@@ -139,6 +152,34 @@ def __preprocess_ds(base_dir: Path, ds_name: str, preprocess_func: Callable[[],
 def add_speaker_examples(base_dir: str, ds_name: str):
   logger = getLogger(__name__)
   ds_dir = get_ds_dir(base_dir, ds_name)
-  ds_data = load_ds_data(ds_dir)
-  examples = get_speaker_examples(ds_data)
+  # only the examples are kept in memory
+  examples = get_speaker_examples(iterate_ds_data(ds_dir))
   _save_speaker_examples(ds_dir, examples, logger)
+
+
+def filter_ds(base_dir: Path, ds_name: str, dest_ds_name: str, entry_filter: EntryFilter, overwrite: bool) -> None:
+  logger = getLogger(__name__)
+  logger.info("Filtering dataset...")
+  ds_dir = get_ds_dir(base_dir, ds_name)
+  assert ds_dir.is_dir()
+  # the stages of the original dataset are kept in its directory
+  assert dest_ds_name != ds_name
+  dest_ds_dir = get_ds_dir(base_dir, dest_ds_name)
+  if dest_ds_dir.is_dir() and not overwrite:
+    logger.info("Dataset already processed.")
+    return
+
+  ds_data = load_ds_data(ds_dir)
+  # the entries reference the original audio files, nothing is copied
+  result = filter_ds_data(ds_data, entry_filter)
+  logger.info(f"Kept {len(result)} of {len(ds_data)} entries.")
+
+  if dest_ds_dir.exists():
+    assert overwrite
+    logger.info("Overwriting existing data.")
+    rmtree(dest_ds_dir)
+  dest_ds_dir.mkdir(exist_ok=False, parents=True)
+
+  _save_ds_speaker_log_json(dest_ds_dir, get_speakers_log(result))
+  __save_ds_data(dest_ds_dir, result)
+  logger.info("Dataset processed.")
@@ -0,0 +1,49 @@
+from functools import partial
+from logging import getLogger
+from pathlib import Path
+from shutil import rmtree
+
+import numpy as np
+from speech_dataset_preprocessing.app.ds import get_ds_dir
+from speech_dataset_preprocessing.app.final import (get_final_dir,
+                                                    iterate_final_ds)
+from speech_dataset_preprocessing.core.export import (DEFAULT_SHARD_FRAMES,
+                                                      ExportedData, export,
+                                                      load_exported_data)
+
+
+def __get_export_root_dir(ds_dir: Path) -> Path:
+  return ds_dir / "export"
+
+
+def get_export_dir(ds_dir: Path, export_name: str) -> Path:
+  return __get_export_root_dir(ds_dir) / export_name
+
+
+def load_export(base_dir: Path, ds_name: str, export_name: str) -> ExportedData:
+  ds_dir = get_ds_dir(base_dir, ds_name)
+  export_dir = get_export_dir(ds_dir, export_name)
+  return load_exported_data(export_dir)
+
+
+def export_final_ds(base_dir: Path, ds_name: str, final_name: str, export_name: str, mel_dtype: str = "float32", shard_frames: int = DEFAULT_SHARD_FRAMES, overwrite: bool = False) -> None:
+  logger = getLogger(__name__)
+  logger.info("Exporting final dataset for training...")
+  ds_dir = get_ds_dir(base_dir, ds_name)
+  export_dir = get_export_dir(ds_dir, export_name)
+  if export_dir.is_dir() and not overwrite:
+    logger.error("Already exists.")
+    return
+
+  final_dir = get_final_dir(ds_dir, final_name)
+  assert final_dir.is_dir()
+
+  if export_dir.is_dir():
+    assert overwrite
+    logger.info("Overwriting existing data.")
+    rmtree(export_dir)
+  export_dir.mkdir(parents=True, exist_ok=False)
+
+  get_entries = partial(iterate_final_ds, base_dir, ds_name, final_name)
+  export(get_entries, export_dir, np.dtype(mel_dtype), shard_frames)
+  logger.info("Done.")
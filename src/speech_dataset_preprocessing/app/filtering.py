@@ -0,0 +1,127 @@
+from logging import getLogger
+from pathlib import Path
+from shutil import rmtree
+
+from speech_dataset_preprocessing.app.ds import get_ds_dir, load_ds_data
+from speech_dataset_preprocessing.app.final import (get_final_dir,
+                                                    iterate_final_ds,
+                                                    save_final_ds_chunks)
+from speech_dataset_preprocessing.app.mel import (get_mel_dir, load_mel_data,
+                                                  save_mel_data)
+from speech_dataset_preprocessing.app.text import (get_text_dir,
+                                                   load_text_data,
+                                                   save_text_data,
+                                                   save_text_outputs)
+from speech_dataset_preprocessing.app.wav import (get_wav_dir, load_wav_data,
+                                                  save_wav_data)
+from speech_dataset_preprocessing.core.filtering import (EntryFilter,
+                                                         filter_final_entries,
+                                                         filter_mel_data,
+                                                         filter_text_data,
+                                                         filter_wav_data)
+from speech_dataset_preprocessing.core.final import iterate_final_ds_chunks
+from speech_dataset_preprocessing.globals import DEFAULT_FINAL_CHUNK_SIZE
+
+
+def _can_write_dest_dir(dest_dir: Path, overwrite: bool) -> bool:
+  if dest_dir.is_dir() and not overwrite:
+    logger = getLogger(__name__)
+    logger.error("Already exists.")
+    return False
+  return True
+
+
+def _recreate_dest_dir(dest_dir: Path) -> None:
+  # is called only after the inputs were loaded and filtered, so that existing data is kept if they are invalid
+  if dest_dir.is_dir():
+    logger = getLogger(__name__)
+    logger.info("Overwriting existing data.")
+    rmtree(dest_dir)
+  dest_dir.mkdir(parents=True, exist_ok=False)
+
+
+def filter_wavs(base_dir: Path, ds_name: str, orig_wav_name: str, dest_wav_name: str, entry_filter: EntryFilter, overwrite: bool = False) -> None:
+  logger = getLogger(__name__)
+  logger.info("Filtering wavs...")
+  ds_dir = get_ds_dir(base_dir, ds_name)
+  orig_wav_dir = get_wav_dir(ds_dir, orig_wav_name)
+  assert orig_wav_dir.is_dir()
+  # the filtered entries reference the files of the original wavs and mels, which would be deleted otherwise
+  assert orig_wav_name != dest_wav_name
+  dest_wav_dir = get_wav_dir(ds_dir, dest_wav_name)
+  if not _can_write_dest_dir(dest_wav_dir, overwrite):
+    return
+
+  ds_data = load_ds_data(ds_dir)
+  wav_data = load_wav_data(orig_wav_dir)
+  result = filter_wav_data(ds_data, wav_data, entry_filter, orig_wav_dir, dest_wav_dir)
+  _recreate_dest_dir(dest_wav_dir)
+  save_wav_data(dest_wav_dir, result)
+  logger.info(f"Kept {len(result)} of {len(wav_data)} entries.")
+
+  # if the mels of the original wavs exist, they are referenced as well
+  orig_mel_dir = get_mel_dir(ds_dir, orig_wav_name)
+  if orig_mel_dir.is_dir():
+    dest_mel_dir = get_mel_dir(ds_dir, dest_wav_name)
+    if _can_write_dest_dir(dest_mel_dir, overwrite):
+      mel_data = load_mel_data(orig_mel_dir)
+      kept_entry_ids = {entry.entry_id for entry in result.items()}
+      mel_result = filter_mel_data(mel_data, kept_entry_ids, orig_mel_dir, dest_mel_dir)
+      _recreate_dest_dir(dest_mel_dir)
+      save_mel_data(dest_mel_dir, mel_result)
+      logger.info("Filtered mels, too.")
+  logger.info("Done.")
+
+
+def filter_text(base_dir: Path, ds_name: str, orig_text_name: str, dest_text_name: str, entry_filter: EntryFilter, overwrite: bool = False) -> None:
+  logger = getLogger(__name__)
+  logger.info("Filtering text...")
+  ds_dir = get_ds_dir(base_dir, ds_name)
+  orig_text_dir = get_text_dir(ds_dir, orig_text_name)
+  assert orig_text_dir.is_dir()
+  assert orig_text_name != dest_text_name
+  dest_text_dir = get_text_dir(ds_dir, dest_text_name)
+  if not _can_write_dest_dir(dest_text_dir, overwrite):
+    return
+
+  ds_data = load_ds_data(ds_dir)
+  text_data = load_text_data(orig_text_dir)
+  result = filter_text_data(ds_data, text_data, entry_filter)
+  _recreate_dest_dir(dest_text_dir)
+  save_text_data(dest_text_dir, result)
+  save_text_outputs(dest_text_dir, result.items())
+  logger.info(f"Kept {len(result)} of {len(text_data)} entries.")
+  logger.info("Done.")
+
+
+def filter_final_ds(base_dir: Path, ds_name: str, orig_final_name: str, dest_final_name: str, entry_filter: EntryFilter, overwrite: bool = False, chunk_size: int = DEFAULT_FINAL_CHUNK_SIZE) -> None:
+  logger = getLogger(__name__)
+  logger.info("Filtering final dataset...")
+  ds_dir = get_ds_dir(base_dir, ds_name)
+  orig_final_dir = get_final_dir(ds_dir, orig_final_name)
+  assert orig_final_dir.is_dir()
+  assert orig_final_name != dest_final_name
+  dest_final_dir = get_final_dir(ds_dir, dest_final_name)
+  if not _can_write_dest_dir(dest_final_dir, overwrite):
+    return
+
+  # the entries are streamed, so they are written to a temporary directory which replaces the destination only after all chunks are written
+  tmp_final_dir = dest_final_dir.parent / f".{dest_final_name}.tmp"
+  if tmp_final_dir.is_dir():
+    rmtree(tmp_final_dir)
+  tmp_final_dir.mkdir(parents=True, exist_ok=False)
+  try:
+    # the final entries contain absolute paths, therefore they reference the original files already
+    entries = iterate_final_ds(base_dir, ds_name, orig_final_name)
+    filtered_entries = filter_final_entries(entries, entry_filter)
+    chunks = iterate_final_ds_chunks(filtered_entries, chunk_size)
+    count = save_final_ds_chunks(tmp_final_dir, chunks)
+  except BaseException:
+    rmtree(tmp_final_dir)
+    raise
+  if dest_final_dir.is_dir():
+    logger.info("Overwriting existing data.")
+    rmtree(dest_final_dir)
+  tmp_final_dir.rename(dest_final_dir)
+  logger.info(f"Kept {count} entries.")
+  logger.info("Done.")
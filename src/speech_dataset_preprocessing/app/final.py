@@ -1,29 +1,74 @@
+import csv
+import pickle
 from logging import getLogger
 from pathlib import Path
 from shutil import rmtree
-
-from speech_dataset_preprocessing.app.ds import get_ds_dir, load_ds_data
-from speech_dataset_preprocessing.app.mel import get_mel_dir, load_mel_data
-from speech_dataset_preprocessing.app.text import get_text_dir, load_text_data
-from speech_dataset_preprocessing.app.wav import get_wav_dir, load_wav_data
-from speech_dataset_preprocessing.core.final import (FinalDsEntryList,
+from typing import Iterable, Iterator, List
+
+from speech_dataset_preprocessing.app.ds import get_ds_dir, iterate_ds_data
+from speech_dataset_preprocessing.app.mel import get_mel_dir, iterate_mel_data
+from speech_dataset_preprocessing.app.text import (get_text_dir,
+                                                   iterate_text_data)
+from speech_dataset_preprocessing.app.wav import get_wav_dir, iterate_wav_data
+from speech_dataset_preprocessing.core.ds import DsData
+from speech_dataset_preprocessing.core.final import (FinalDsEntry,
+                                                     FinalDsEntryList,
+                                                     combine_final_entries,
                                                      get_analysis_df,
-                                                     get_final_ds_from_data)
-from speech_dataset_preprocessing.globals import DEFAULT_CSV_SEPERATOR
-from general_utils import load_obj, save_obj
+                                                     iterate_final_ds_chunks,
+                                                     iterate_final_ds_entries)
+from speech_dataset_preprocessing.core.mel import MelData
+from speech_dataset_preprocessing.core.text import TextData
+from speech_dataset_preprocessing.core.wav import WavData
+from speech_dataset_preprocessing.globals import (DEFAULT_CSV_SEPERATOR,
+                                                  DEFAULT_FINAL_CHUNK_SIZE)
 
 FINAL_DATA_FILENAME = "data.pkl"
 ANALYSIS_DF_FILENAME = "analysis.csv"
+COMBINED_SOURCES_FILENAME = "sources.csv"
+COMBINED_SOURCES_COLUMNS = ["Id", "Dataset", "Original id", "Original speaker"]
 
 
-def save_final_ds(final_dir: Path, data: FinalDsEntryList) -> None:
+def save_final_ds_chunks(final_dir: Path, chunks: Iterable[FinalDsEntryList]) -> int:
+  # each chunk is appended as one pickle frame, so a single-frame file equals a pickled list
+  path = final_dir / FINAL_DATA_FILENAME
+  analysis_path = final_dir / ANALYSIS_DF_FILENAME
+  count = 0
+  with path.open(mode="wb") as file:
+    for chunk in chunks:
+      pickle.dump(chunk, file)
+      df = get_analysis_df(chunk.items())
+      df.to_csv(analysis_path, sep=DEFAULT_CSV_SEPERATOR,
+                header=count == 0, index=False, mode="w" if count == 0 else "a")
+      count += len(chunk)
+  if count == 0:
+    get_analysis_df([]).to_csv(analysis_path, sep=DEFAULT_CSV_SEPERATOR, header=True, index=False)
+  return count
+
+
+def iterate_final_ds_chunks_from_dir(final_dir: Path) -> Iterator[FinalDsEntryList]:
   path = final_dir / FINAL_DATA_FILENAME
-  save_obj(data, path)
+  with path.open(mode="rb") as file:
+    while True:
+      try:
+        yield pickle.load(file)
+      except EOFError:
+        return
+
+
+def iterate_final_ds(base_dir: Path, ds_name: str, final_name: str) -> Iterator[FinalDsEntry]:
+  ds_dir = get_ds_dir(base_dir, ds_name)
+  final_dir = get_final_dir(ds_dir, final_name)
+  for chunk in iterate_final_ds_chunks_from_dir(final_dir):
+    yield from chunk.items()
 
 
 def __load_final_ds(final_dir: Path) -> FinalDsEntryList:
-  path = final_dir / FINAL_DATA_FILENAME
-  return load_obj(path)
+  result = FinalDsEntryList()
+  for chunk in iterate_final_ds_chunks_from_dir(final_dir):
+    for entry in chunk.items():
+      result.append(entry)
+  return result
 
 
 def load_final_ds(base_dir: Path, ds_name: str, final_name: Path) -> FinalDsEntryList:
@@ -32,12 +77,6 @@ def load_final_ds(base_dir: Path, ds_name: str, final_name: Path) -> FinalDsEntr
   return __load_final_ds(final_dir)
 
 
-def save_analysis_df(final_dir: Path, data: FinalDsEntryList) -> None:
-  path = final_dir / ANALYSIS_DF_FILENAME
-  df = get_analysis_df(data)
-  df.to_csv(path, sep=DEFAULT_CSV_SEPERATOR, header=True, index=False)
-
-
 def __get_final_root_dir(ds_dir: Path) -> Path:
   return ds_dir / "final"
 
@@ -46,7 +85,23 @@ def get_final_dir(ds_dir: Path, final_name: str) -> Path:
   return __get_final_root_dir(ds_dir) / final_name
 
 
-def merge_to_final_ds(base_dir: Path, ds_name: str, text_name: str, audio_name: str, final_name: str, overwrite: bool) -> FinalDsEntryList:
+def save_merged_final_ds(final_dir: Path, ds_data: Iterable[DsData], text_data: Iterable[TextData], wav_data: Iterable[WavData], mel_data: Iterable[MelData], wav_dir: Path, mel_dir: Path, chunk_size: int) -> int:
+  # only the current chunk of the merged entries is kept in memory
+  entries = iterate_final_ds_entries(
+    ds_data=ds_data,
+    text_data=text_data,
+    wav_data=wav_data,
+    mel_data=mel_data,
+    wav_dir=wav_dir,
+    mel_dir=mel_dir,
+  )
+
+  chunks = iterate_final_ds_chunks(entries, chunk_size)
+  count = save_final_ds_chunks(final_dir, chunks)
+  return count
+
+
+def merge_to_final_ds(base_dir: Path, ds_name: str, text_name: str, audio_name: str, final_name: str, overwrite: bool, chunk_size: int = DEFAULT_FINAL_CHUNK_SIZE) -> None:
   logger = getLogger(__name__)
   ds_dir = get_ds_dir(base_dir, ds_name)
   final_dir = get_final_dir(ds_dir, final_name)
@@ -78,26 +133,68 @@ def merge_to_final_ds(base_dir: Path, ds_name: str, text_name: str, audio_name:
     logger.exception(msg)
     raise Exception(msg)
 
-  ds_data = load_ds_data(ds_dir)
-  text_data = load_text_data(text_dir)
-  wav_data = load_wav_data(wav_dir)
-  mel_data = load_mel_data(mel_dir)
-
-  final_data = get_final_ds_from_data(
-    ds_data=ds_data,
-    text_data=text_data,
-    wav_data=wav_data,
-    mel_data=mel_data,
-    wav_dir=wav_dir,
-    mel_dir=mel_dir,
-  )
-
   if final_dir.is_dir():
     assert overwrite
     logger.info("Overwriting existing data.")
     rmtree(final_dir)
   final_dir.mkdir(parents=True, exist_ok=False)
 
-  save_final_ds(final_dir, final_data)
-  save_analysis_df(final_dir, final_data)
+  # the inputs are streamed frame by frame, i.e. they are never loaded completely
+  count = save_merged_final_ds(
+    final_dir,
+    iterate_ds_data(ds_dir),
+    iterate_text_data(text_dir),
+    iterate_wav_data(wav_dir),
+    iterate_mel_data(mel_dir),
+    wav_dir,
+    mel_dir,
+    chunk_size,
+  )
+  logger.info(f"Merged {count} entries.")
+  logger.info("Done.")
+
+
+def combine_final_ds(base_dir: Path, ds_names: List[str], final_names: List[str], dest_ds_name: str, dest_final_name: str, prefix_speakers: bool = True, overwrite: bool = False, chunk_size: int = DEFAULT_FINAL_CHUNK_SIZE) -> None:
+  logger = getLogger(__name__)
+  assert len(ds_names) == len(final_names)
+  logger.info("Combining final datasets...")
+  for ds_name, final_name in zip(ds_names, final_names):
+    final_dir = get_final_dir(get_ds_dir(base_dir, ds_name), final_name)
+    if not final_dir.is_dir():
+      msg = f"Final data {final_name} of {ds_name} not found!"
+      logger.exception(msg)
+      raise Exception(msg)
+
+  dest_ds_dir = get_ds_dir(base_dir, dest_ds_name)
+  dest_final_dir = get_final_dir(dest_ds_dir, dest_final_name)
+  if dest_final_dir.is_dir() and not overwrite:
+    logger.error("Already exists.")
+    return
+  if dest_final_dir.is_dir():
+    assert overwrite
+    logger.info("Overwriting existing data.")
+    rmtree(dest_final_dir)
+  dest_final_dir.mkdir(parents=True, exist_ok=False)
+
+  sources = (
+    (ds_name, iterate_final_ds(base_dir, ds_name, final_name))
+    for ds_name, final_name in zip(ds_names, final_names)
+  )
+
+  sources_path = dest_final_dir / COMBINED_SOURCES_FILENAME
+  with sources_path.open(mode="w", encoding="utf-8", newline="") as sources_file:
+    sources_writer = csv.writer(
+      sources_file, delimiter=DEFAULT_CSV_SEPERATOR, lineterminator="\n")
+    sources_writer.writerow(COMBINED_SOURCES_COLUMNS)
+
+    def get_entries() -> Iterator[FinalDsEntry]:
+      # the id mapping is written while the entries are streamed into the chunks
+      for ds_name, entry, combined_entry in combine_final_entries(sources, prefix_speakers):
+        sources_writer.writerow(
+          (combined_entry.entry_id, ds_name, entry.entry_id, entry.speaker_name))
+        yield combined_entry
+
+    chunks = iterate_final_ds_chunks(get_entries(), chunk_size)
+    count = save_final_ds_chunks(dest_final_dir, chunks)
+  logger.info(f"Combined {count} entries of {len(ds_names)} datasets.")
   logger.info("Done.")
@@ -3,18 +3,45 @@ from logging import getLogger
 from multiprocessing import cpu_count
 from pathlib import Path
 from shutil import rmtree
-from typing import Dict, Optional
+from typing import Dict, Iterator, List, Optional
 
-import torch
-from general_utils import get_chunk_name, load_obj, save_obj
-from speech_dataset_preprocessing.app.ds import get_ds_dir
+import numpy as np
+from general_utils import get_chunk_name
+from speech_dataset_preprocessing.app.data_cache import (iterate_data,
+                                                         load_data, save_data)
+from speech_dataset_preprocessing.app.ds import get_ds_dir, load_ds_data
 from speech_dataset_preprocessing.app.wav import get_wav_dir, load_wav_data
-from speech_dataset_preprocessing.core.mel import MelDataList, process
-from speech_dataset_preprocessing.core.wav import WavData
+from speech_dataset_preprocessing.core.ds import get_entries_count
+from speech_dataset_preprocessing.core.features import (
+    DEFAULT_F0_MAX, DEFAULT_F0_MIN, F0Config, get_features_relative_path,
+    load_features_array, save_features_array)
+from speech_dataset_preprocessing.core.mel import (DEFAULT_BLOCK_FRAMES,
+                                                   MEL_FILE_EXTENSIONS,
+                                                   MelData, MelDataList,
+                                                   MelEncoding,
+                                                   MelProcessingMode,
+                                                   ProcessConfig,
+                                                   load_mel_array, process,
+                                                   process_with_processes,
+                                                   save_mel_array)
+from speech_dataset_preprocessing.core.mel_stats import (
+    MelStatsAccumulator, SpeakerMelStats, get_mean_and_std,
+    merge_speaker_mel_stats)
+from speech_dataset_preprocessing.core.pipelined import (
+    DEFAULT_IO_JOBS, DEFAULT_READ_QUEUE_SIZE, DEFAULT_WRITE_QUEUE_SIZE,
+    PipelineConfig)
+from speech_dataset_preprocessing.core.sharding import (
+    get_partial_dir, is_sharded, load_partial_positions, merge_partial_entries,
+    save_partial_positions, select_shard)
+from speech_dataset_preprocessing.core.wav import WavData, WavDataList
+from speech_dataset_preprocessing.core.work_queue import (
+    DEFAULT_BATCH_SIZE, DEFAULT_LEASE_S, QueueRole, get_queue_config,
+    is_queue_worker, run_queued_stage)
 from speech_dataset_preprocessing.globals import DEFAULT_PRE_CHUNK_SIZE
 from torch import Tensor
 
 MEL_DATA_CSV = "data.pkl"
+_mel_stats_pkl = "stats.pkl"
 
 
 def __get_mel_root_dir(ds_dir: Path) -> Path:
@@ -27,52 +54,191 @@ def get_mel_dir(ds_dir: Path, mel_name: str) -> Path:
 
 def load_mel_data(mel_dir: Path) -> MelDataList:
   path = mel_dir / MEL_DATA_CSV
-  return load_obj(path)
+  return load_data(path)
+
+
+def iterate_mel_data(mel_dir: Path) -> Iterator[MelData]:
+  path = mel_dir / MEL_DATA_CSV
+  return iterate_data(path)
 
 
 def save_mel_data(mel_dir: Path, mel_data: MelDataList) -> None:
   path = mel_dir / MEL_DATA_CSV
-  save_obj(mel_data, path)
+  save_data(mel_data, path)
+
+
+def load_mel_stats(mel_dir: Path) -> SpeakerMelStats:
+  path = mel_dir / _mel_stats_pkl
+  return load_data(path)
 
 
-def save_mel(dest_dir: Path, data_len: int, wav_entry: WavData, mel_tensor: Tensor) -> str:
+def save_mel_stats(mel_dir: Path, stats: SpeakerMelStats) -> None:
+  path = mel_dir / _mel_stats_pkl
+  save_data(stats, path)
+
+
+def log_mel_stats(stats: SpeakerMelStats) -> None:
+  logger = getLogger(__name__)
+  if stats.overall is None:
+    return
+  mean, std = get_mean_and_std(stats.overall)
+  logger.info(f"Accumulated the stats of {stats.overall.n_frames} frames of {len(stats.speakers)} speakers.")
+  logger.info(f"Mean over all channels: {np.mean(mean):.4f}, std over all channels: {np.mean(std):.4f}")
+
+
+def save_mel(dest_dir: Path, data_len: int, encoding: MelEncoding, wav_entry: WavData, mel_tensor: Tensor) -> str:
   chunk_dir_name = get_chunk_name(
     i=wav_entry.entry_id,
     chunksize=DEFAULT_PRE_CHUNK_SIZE,
     maximum=data_len - 1
   )
-  relative_dest_mel_path = Path(chunk_dir_name) / f"{wav_entry.entry_id}.pt"
+  file_name = f"{wav_entry.entry_id}{MEL_FILE_EXTENSIONS[encoding]}"
+  relative_dest_mel_path = Path(chunk_dir_name) / file_name
   absolute_chunk_dir = dest_dir / chunk_dir_name
   absolute_dest_mel_path = dest_dir / relative_dest_mel_path
 
   absolute_chunk_dir.mkdir(parents=True, exist_ok=True)
-  torch.save(mel_tensor, absolute_dest_mel_path)
+  save_mel_array(absolute_dest_mel_path, mel_tensor, encoding)
 
   return relative_dest_mel_path
 
 
-def preprocess_mels(base_dir: Path, ds_name: str, wav_name: str, custom_hparams: Optional[Dict[str, str]] = None, overwrite: bool = False):
+def load_mel(mel_dir: Path, entry: MelData) -> np.ndarray:
+  absolute_path = mel_dir / entry.mel_relative_path
+  return load_mel_array(absolute_path, entry.mel_encoding)
+
+
+def save_features(dest_dir: Path, mel_relative_path: Path, features: np.ndarray) -> None:
+  # the chunk directory was created for the mel
+  absolute_path = dest_dir / get_features_relative_path(mel_relative_path)
+  save_features_array(absolute_path, features)
+
+
+def load_features(mel_dir: Path, entry: MelData) -> np.ndarray:
+  # the first row is the energy, the second one the F0 which is 0 in unvoiced frames
+  assert entry.has_features
+  absolute_path = mel_dir / get_features_relative_path(entry.mel_relative_path)
+  return load_features_array(absolute_path)
+
+
+def preprocess_mels(base_dir: Path, ds_name: str, wav_name: str, custom_hparams: Optional[Dict[str, str]] = None, encoding: MelEncoding = MelEncoding.PT, mode: MelProcessingMode = MelProcessingMode.THREADS, n_processes: Optional[int] = None, n_threads: Optional[int] = None, block_frames: Optional[int] = DEFAULT_BLOCK_FRAMES, io_jobs: int = DEFAULT_IO_JOBS, read_queue_size: int = DEFAULT_READ_QUEUE_SIZE, write_queue_size: int = DEFAULT_WRITE_QUEUE_SIZE, shard_index: Optional[int] = None, num_shards: Optional[int] = None, queue_role: Optional[QueueRole] = None, batch_size: int = DEFAULT_BATCH_SIZE, lease_s: float = DEFAULT_LEASE_S, queue_run_id: Optional[str] = None, compute_stats: bool = False, compute_features: bool = False, f0_min: float = DEFAULT_F0_MIN, f0_max: float = DEFAULT_F0_MAX, overwrite: bool = False):
   logger = getLogger(__name__)
   logger.info("Preprocessing mels...")
   ds_dir = get_ds_dir(base_dir, ds_name)
   mel_dir = get_mel_dir(ds_dir, wav_name)
-  if mel_dir.is_dir() and not overwrite:
+  wav_dir = get_wav_dir(ds_dir, wav_name)
+  queue_config = get_queue_config(queue_role, batch_size, lease_s, queue_run_id)
+  n_jobs = cpu_count() - 1
+  speakers = None
+  if compute_stats:
+    speakers = {entry.entry_id: entry.speaker_name for entry in load_ds_data(ds_dir).items()}
+  f0_config = F0Config(f0_min, f0_max) if compute_features else None
+
+  def process_entries(entries: List[WavData], dest_dir: Path, data_len: int) -> MelDataList:
+    # the stats are saved next to the data of the entries, i.e. per shard or batch
+    entries_data = WavDataList(entries)
+    save_callback = partial(save_mel, dest_dir=dest_dir, data_len=data_len, encoding=encoding)
+    save_features_callback = partial(save_features, dest_dir=dest_dir) if compute_features else None
+    stats = MelStatsAccumulator(speakers) if compute_stats else None
+    if mode == MelProcessingMode.PROCESSES:
+      # the configuration is tuned if it is not given completely
+      process_config = None
+      if n_processes is not None and n_threads is not None:
+        process_config = ProcessConfig(n_processes, n_threads)
+      result = process_with_processes(entries_data, wav_dir, custom_hparams, save_callback,
+                                      n_jobs, encoding, process_config, block_frames, stats,
+                                      f0_config, save_features_callback)
+    else:
+      assert mode == MelProcessingMode.THREADS
+      pipeline_config = PipelineConfig(n_jobs, io_jobs, io_jobs, read_queue_size, write_queue_size)
+      result = process(entries_data, wav_dir, custom_hparams, save_callback,
+                       n_jobs, encoding, pipeline_config, block_frames, stats,
+                       f0_config, save_features_callback)
+    if stats is not None:
+      save_mel_stats(dest_dir, stats.get_stats())
+    return result
+
+  if is_queue_worker(queue_config):
+    entries = load_wav_data(wav_dir).items()
+    # the chunk directories of all batches are named by the largest id of the whole data
+    process_batch = partial(process_entries, data_len=get_entries_count(entries))
+    run_queued_stage(mel_dir, entries, process_batch, queue_config, "mel_relative_path")
+    return
+
+  sharded = is_sharded(shard_index, num_shards)
+  if sharded and queue_config is not None:
+    raise ValueError("A shard can't be processed with the queue.")
+  # each shard writes into its own partial directory of the mel directory
+  output_dir = get_partial_dir(mel_dir, shard_index) if sharded else mel_dir
+  if output_dir.is_dir() and not overwrite:
     logger.info("Already exists.")
     return
 
-  wav_dir = get_wav_dir(ds_dir, wav_name)
   assert wav_dir.is_dir()
   data = load_wav_data(wav_dir)
-  if len(data) == 0:
+  positions = None
+  if sharded:
+    durations = [entry.wav_duration for entry in data.items()]
+    positions, entries = select_shard(data.items(), durations, shard_index, num_shards)
+    data = WavDataList(entries)
+  if len(data) == 0 and not sharded:
     return
 
-  if mel_dir.is_dir():
+  if output_dir.is_dir():
     assert overwrite
     logger.info("Overwriting existing data.")
-    rmtree(mel_dir)
-  mel_dir.mkdir(exist_ok=False, parents=True)
+    rmtree(output_dir)
+  output_dir.mkdir(exist_ok=False, parents=True)
+
+  data_len = get_entries_count(data.items())
+  if queue_config is None:
+    mel_data = process_entries(data.items(), output_dir, data_len)
+  else:
+    process_batch = partial(process_entries, data_len=data_len)
+    mel_data = MelDataList(run_queued_stage(output_dir, data.items(), process_batch, queue_config, "mel_relative_path"))
+    if compute_stats:
+      save_mel_stats(output_dir, _merge_batch_stats(output_dir, mel_data))
+  save_mel_data(output_dir, mel_data)
+  if compute_stats:
+    log_mel_stats(load_mel_stats(output_dir))
+  if sharded:
+    save_partial_positions(output_dir, positions)
+    logger.info(f"Saved the partial result of {len(mel_data)} entries, merge all shards with mels-merge.")
+    return
+  logger.info("Done.")
+
+
+def _merge_batch_stats(mel_dir: Path, mel_data: MelDataList) -> SpeakerMelStats:
+  # only the directories of the committed batches are referenced by the entries, i.e. the stats of discarded batches are not merged
+  # a mel is saved in a chunk directory of its batch directory
+  batch_dirs = {entry.mel_relative_path.parent.parent for entry in mel_data.items()}
+  return merge_speaker_mel_stats(load_mel_stats(mel_dir / batch_dir) for batch_dir in sorted(batch_dirs))
 
-  save_callback = partial(save_mel, dest_dir=mel_dir, data_len=len(data))
-  mel_data = process(data, wav_dir, custom_hparams, save_callback, n_jobs=cpu_count() - 1)
+
+def mels_merge(base_dir: Path, ds_name: str, wav_name: str, num_shards: int, overwrite: bool = False) -> None:
+  # the partial results stay where they are, the merged data references them
+  logger = getLogger(__name__)
+  logger.info("Merging shards...")
+  ds_dir = get_ds_dir(base_dir, ds_name)
+  mel_dir = get_mel_dir(ds_dir, wav_name)
+  if (mel_dir / MEL_DATA_CSV).is_file() and not overwrite:
+    logger.error("Already exists.")
+    return
+
+  partials = []
+  for shard_index in range(num_shards):
+    partial_dir = get_partial_dir(mel_dir, shard_index)
+    if not (partial_dir / MEL_DATA_CSV).is_file():
+      logger.error(f"Shard {shard_index} is missing or not finished.")
+      return
+    partials.append((partial_dir.relative_to(mel_dir), load_partial_positions(partial_dir),
+                    load_mel_data(partial_dir).items()))
+
+  mel_data = MelDataList(merge_partial_entries(partials, "mel_relative_path"))
   save_mel_data(mel_dir, mel_data)
-  logger.info("Done.")
+  partial_dirs = [get_partial_dir(mel_dir, shard_index) for shard_index in range(num_shards)]
+  if all((partial_dir / _mel_stats_pkl).is_file() for partial_dir in partial_dirs):
+    stats = merge_speaker_mel_stats(load_mel_stats(partial_dir) for partial_dir in partial_dirs)
+    save_mel_stats(mel_dir, stats)
+    log_mel_stats(stats)
+  logger.info(f"Merged {len(mel_data)} entries.")
@@ -0,0 +1,110 @@
+import json
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from speech_dataset_preprocessing.app.data_cache import keep_data_in_memory
+from speech_dataset_preprocessing.app.ds import get_ds_dir
+from speech_dataset_preprocessing.app.export import get_export_dir
+from speech_dataset_preprocessing.app.final import get_final_dir
+from speech_dataset_preprocessing.app.mel import get_mel_dir
+from speech_dataset_preprocessing.app.text import get_text_dir
+from speech_dataset_preprocessing.app.wav import get_wav_dir
+from speech_dataset_preprocessing.core.pipeline import (
+    DEFAULT_PIPELINE_JOBS, DS, EXPORT, FINAL, MEL, TEXT, WAV, Artifact,
+    PipelineStage, get_dependencies, get_execution_order, get_stage_signature,
+    get_stages, run_stages)
+from speech_dataset_preprocessing.core.stats import get_sources_signature
+
+# is written into the output directory of a stage after it finished
+_pipeline_json = "pipeline.json"
+_data_pkl = "data.pkl"
+
+
+def load_pipeline_spec(path: Path) -> Dict[str, Any]:
+  content = path.read_text(encoding="utf-8")
+  if path.suffix.lower() in (".yml", ".yaml"):
+    # PyYAML is only needed for specifications in YAML
+    import yaml
+    return yaml.safe_load(content)
+  return json.loads(content)
+
+
+def get_artifact_dir(base_dir: Path, artifact: Artifact) -> Path:
+  kind, ds_name, name = artifact
+  ds_dir = get_ds_dir(base_dir, ds_name)
+  if kind == DS:
+    return ds_dir
+  get_dir: Dict[str, Callable[[Path, str], Path]] = {
+    WAV: get_wav_dir,
+    TEXT: get_text_dir,
+    MEL: get_mel_dir,
+    FINAL: get_final_dir,
+    EXPORT: get_export_dir,
+  }
+  return get_dir[kind](ds_dir, name)
+
+
+def _load_stored_signature(artifact_dir: Path) -> Optional[str]:
+  path = artifact_dir / _pipeline_json
+  if not path.is_file():
+    return None
+  return json.loads(path.read_text(encoding="utf-8"))["signature"]
+
+
+def _save_signature(artifact_dir: Path, stage_name: str, signature: str) -> None:
+  path = artifact_dir / _pipeline_json
+  path.write_text(json.dumps({"stage": stage_name, "signature": signature}), encoding="utf-8")
+
+
+def _get_existing_signature(base_dir: Path, artifact: Artifact) -> str:
+  # an input which wasn't written by the pipeline, e.g. by a single command, is compared by its modification time
+  artifact_dir = get_artifact_dir(base_dir, artifact)
+  stored_signature = _load_stored_signature(artifact_dir)
+  if stored_signature is not None:
+    return stored_signature
+  if not artifact_dir.exists():
+    raise ValueError(f"The input '{artifact_dir}' doesn't exist and no stage writes it.")
+  data_path = artifact_dir / _data_pkl
+  return str(get_sources_signature([data_path if data_path.is_file() else artifact_dir]))
+
+
+def get_signatures(base_dir: Path, stages: List[PipelineStage], dependencies: Dict[str, Set[str]]) -> Dict[str, str]:
+  # the signature of a stage contains the signatures of its inputs, i.e. changed arguments invalidate all following stages
+  result: Dict[str, str] = {}
+  stages_by_name = {stage.name: stage for stage in stages}
+  producers = {stage.output: stage.name for stage in stages}
+  for name in get_execution_order(dependencies):
+    stage = stages_by_name[name]
+    input_signatures = [
+      result[producers[artifact]] if artifact in producers else _get_existing_signature(base_dir, artifact)
+      for artifact in stage.inputs
+    ]
+    result[name] = get_stage_signature(stage, input_signatures)
+  return result
+
+
+def load_pipeline_stages(spec_path: Path) -> List[PipelineStage]:
+  return get_stages(load_pipeline_spec(spec_path))
+
+
+def run_pipeline(base_dir: Path, stages: List[PipelineStage], invoke_stage: Callable[[PipelineStage], None], n_jobs: int = DEFAULT_PIPELINE_JOBS) -> None:
+  # invoke_stage runs the command of a stage and overwrites its output
+  logger = getLogger(__name__)
+  dependencies = get_dependencies(stages)
+  signatures = get_signatures(base_dir, stages, dependencies)
+
+  def run_stage(stage: PipelineStage, dependency_executed: bool) -> bool:
+    output_dir = get_artifact_dir(base_dir, stage.output)
+    signature = signatures[stage.name]
+    if not dependency_executed and _load_stored_signature(output_dir) == signature:
+      logger.info(f"Skipped stage '{stage.name}' because its inputs and arguments didn't change.")
+      return False
+    invoke_stage(stage)
+    _save_signature(output_dir, stage.name, signature)
+    logger.info(f"Finished stage '{stage.name}'.")
+    return True
+
+  with keep_data_in_memory():
+    executed = run_stages(stages, dependencies, run_stage, n_jobs)
+  logger.info(f"Executed {len(executed)} of {len(stages)} stages.")
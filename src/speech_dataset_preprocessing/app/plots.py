@@ -10,7 +10,7 @@ from image_utils import stack_images_horizontally, stack_images_vertically
 from matplotlib import pyplot as plt
 from speech_dataset_preprocessing.app.ds import get_ds_dir, load_ds_data
 from speech_dataset_preprocessing.app.wav import get_wav_dir, load_wav_data
-from speech_dataset_preprocessing.core.ds import DsData
+from speech_dataset_preprocessing.core.ds import DsData, get_entries_count
 from speech_dataset_preprocessing.core.plots import process
 from speech_dataset_preprocessing.core.wav import WavData
 from speech_dataset_preprocessing.globals import DEFAULT_PRE_CHUNK_SIZE
@@ -54,7 +54,7 @@ def plot_mels(base_dir: Path, ds_name: str, wav_name: str, custom_hparams: Optio
     data = load_wav_data(wav_dir)
     ds_data = load_ds_data(ds_dir)
     assert len(data) > 0
-    save_callback = partial(save_plot, dest_dir=plots_dir, data_len=len(data))
+    save_callback = partial(save_plot, dest_dir=plots_dir, data_len=get_entries_count(data.items()))
     all_absolute_paths = process(data, ds_data, wav_dir, custom_hparams, save_callback)
 
     # all_paths = get_all_paths(plots_dir)
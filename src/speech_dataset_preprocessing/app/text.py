@@ -1,20 +1,35 @@
+import csv
+from collections import Counter
 from functools import partial
 from logging import getLogger
 from multiprocessing import cpu_count
 from pathlib import Path
 from shutil import rmtree
-from typing import Callable, Optional
+from typing import Any, Callable, Iterable, Iterator, List, Optional
 
 from general_utils import load_obj, save_obj
-from speech_dataset_preprocessing.app.ds import get_ds_dir, load_ds_data
-from speech_dataset_preprocessing.core.text import (TextDataList, change_ipa,
-                                                    change_text,
-                                                    convert_to_ipa, log_stats, map_to_ipa,
-                                                    normalize, preprocess)
+from sentence2pronunciation.lookup_cache import get_empty_cache
+from speech_dataset_preprocessing.app.data_cache import (DATA_FRAME_SIZE,
+                                                         iterate_data,
+                                                         load_data, save_data)
+from speech_dataset_preprocessing.app.ds import (get_ds_data_path, get_ds_dir,
+                                                 load_ds_data)
+from speech_dataset_preprocessing.core.ds import DsData, DsDataList
+from speech_dataset_preprocessing.core.stats import (Stats, StatsSignature,
+                                                     get_sources_signature)
+from speech_dataset_preprocessing.core.text import (
+    ANALYTICS_COLUMNS, TextData, TextDataList, change_ipa, change_text,
+    convert_to_ipa, get_analytics_row, get_stats,
+    get_symbol_stats_df_from_counter, log_stats, map_to_ipa, normalize,
+    preprocess)
+from speech_dataset_preprocessing.core.work_queue import (
+    DEFAULT_BATCH_SIZE, DEFAULT_LEASE_S, QueueConfig, QueueRole,
+    get_queue_config, is_queue_worker, run_queued_stage)
 from speech_dataset_preprocessing.globals import DEFAULT_CSV_SEPERATOR
 from text_utils import EngToIPAMode, SymbolsDict
 
 _text_data_csv = "data.pkl"
+_text_stats_pkl = "stats.pkl"
 ANALYSIS_SYMBOLS_DF_FILENAME = "symbols.csv"
 _whole_text_txt = "text.txt"
 ANALYSIS_DF_FILENAME = "analysis.csv"
@@ -33,32 +48,108 @@ def load_text_symbols_json(text_dir: Path) -> SymbolsDict:
   return SymbolsDict.load(path)
 
 
-def save_symbols_stats_df(text_dir: Path, data: TextDataList) -> None:
+def save_symbols_stats_df(text_dir: Path, symbol_counter: Counter) -> None:
   path = text_dir / ANALYSIS_SYMBOLS_DF_FILENAME
-  df = data.get_symbol_stats_df()
+  df = get_symbol_stats_df_from_counter(symbol_counter)
   df.to_csv(path, sep=DEFAULT_CSV_SEPERATOR, header=True, index=False)
 
 
-def save_whole_text(text_dir: Path, data: TextDataList) -> None:
-  path = text_dir / _whole_text_txt
-  text = data.get_whole_text()
-  path.write_text(text)
+class TextOutputsWriter():
+  # whole text, analytics and symbol counts are written in one pass, the entries are appended as they are produced
+  # the symbol counts are saved when the writer is closed
+  def __init__(self, text_dir: Path, save_symbols: bool = True) -> None:
+    self.text_dir = text_dir
+    self.save_symbols = save_symbols
+    self._symbol_counter = Counter()
+    self._is_first_entry = True
+    self._text_file = (text_dir / _whole_text_txt).open(mode="w", encoding="utf-8")
+    self._analysis_file = (text_dir / ANALYSIS_DF_FILENAME).open(
+      mode="w", encoding="utf-8", newline="")
+    self._analysis_writer = csv.writer(
+      self._analysis_file, delimiter=DEFAULT_CSV_SEPERATOR, lineterminator="\n")
+    self._analysis_writer.writerow(ANALYTICS_COLUMNS)
+
+  def write(self, entries: Iterable[TextData]) -> None:
+    for entry in entries:
+      if not self._is_first_entry:
+        self._text_file.write(" ")
+      self._is_first_entry = False
+      self._text_file.write(''.join(entry.symbols))
+      self._analysis_writer.writerow(get_analytics_row(entry))
+      if self.save_symbols:
+        self._symbol_counter.update(entry.symbols)
+
+  def close(self) -> None:
+    self._text_file.close()
+    self._analysis_file.close()
+    if self.save_symbols:
+      save_symbols_stats_df(self.text_dir, self._symbol_counter)
+
+  def __enter__(self) -> "TextOutputsWriter":
+    return self
+
+  def __exit__(self, *_) -> None:
+    self.close()
+
+
+def save_text_outputs(text_dir: Path, data: Iterable[TextData], save_symbols: bool = True) -> None:
+  with TextOutputsWriter(text_dir, save_symbols) as writer:
+    writer.write(data)
+
+
+def _process_and_write_in_chunks(entries: List[Any], process_entries: Callable[[List[Any], Path], List[TextData]], text_dir: Path) -> TextDataList:
+  # the outputs of a chunk are written as soon as it is processed, the entries are independent of each other
+  result = TextDataList()
+  with TextOutputsWriter(text_dir) as writer:
+    for chunk_start in range(0, len(entries), DATA_FRAME_SIZE):
+      chunk = process_entries(entries[chunk_start:chunk_start + DATA_FRAME_SIZE], text_dir)
+      writer.write(chunk)
+      for entry in chunk:
+        result.append(entry)
+  return result
+
+
+def _get_text_data_path(text_dir: Path) -> Path:
+  return text_dir / _text_data_csv
 
 
-def save_analytics_df(text_dir: Path, data: TextDataList) -> None:
-  path = text_dir / ANALYSIS_DF_FILENAME
-  analytics_df = data.get_analytics_df()
-  analytics_df.to_csv(path, sep=DEFAULT_CSV_SEPERATOR, header=True, index=False)
+def load_text_data(text_dir: Path) -> TextDataList:
+  path = _get_text_data_path(text_dir)
+  return load_data(path)
 
 
-def load_text_data(text_dir: Path) -> TextDataList:
-  path = text_dir / _text_data_csv
-  return load_obj(path)
+def iterate_text_data(text_dir: Path) -> Iterator[TextData]:
+  path = _get_text_data_path(text_dir)
+  return iterate_data(path)
 
 
 def save_text_data(text_dir: Path, data: TextDataList) -> None:
-  path = text_dir / _text_data_csv
-  save_obj(data, path)
+  path = _get_text_data_path(text_dir)
+  save_data(data, path)
+
+
+def _get_stats_signature(ds_dir: Path, text_dir: Path) -> StatsSignature:
+  return get_sources_signature([get_ds_data_path(ds_dir), _get_text_data_path(text_dir)])
+
+
+def _load_cached_stats(ds_dir: Path, text_dir: Path) -> Optional[Stats]:
+  path = text_dir / _text_stats_pkl
+  if not path.is_file():
+    return None
+  stats: Stats = load_obj(path)
+  if stats.signature != _get_stats_signature(ds_dir, text_dir):
+    return None
+  return stats
+
+
+def save_text_stats(ds_dir: Path, text_dir: Path, ds_data: DsDataList, text_data: TextDataList) -> None:
+  # the text data needs to be saved already, it is part of the signature
+  if len(text_data) == 0:
+    return
+  signature = _get_stats_signature(ds_dir, text_dir)
+  stats = get_stats(ds_data, text_data, signature)
+  save_obj(stats, text_dir / _text_stats_pkl)
+  log_stats(stats)
 
 
 def text_stats(base_dir: Path, ds_name: str, text_name: str):
@@ -67,9 +158,14 @@ def text_stats(base_dir: Path, ds_name: str, text_name: str):
   ds_dir = get_ds_dir(base_dir, ds_name)
   text_dir = get_text_dir(ds_dir, text_name)
   if text_dir.is_dir():
-    ds_data = load_ds_data(ds_dir)
-    text_data = load_text_data(text_dir)
-    log_stats(ds_data, text_data)
+    stats = _load_cached_stats(ds_dir, text_dir)
+    if stats is None:
+      ds_data = load_ds_data(ds_dir)
+      text_data = load_text_data(text_dir)
+      save_text_stats(ds_dir, text_dir, ds_data, text_data)
+    else:
+      logger.info("Using cached stats.")
+      log_stats(stats)
 
 
 def export_text(base_dir: Path, ds_name: str, text_name: str) -> None:
@@ -78,49 +174,67 @@ def export_text(base_dir: Path, ds_name: str, text_name: str) -> None:
   ds_dir = get_ds_dir(base_dir, ds_name)
   text_dir = get_text_dir(ds_dir, text_name)
   if text_dir.is_dir():
-    text_data = load_text_data(text_dir)
-    save_whole_text(text_dir, text_data)
-    save_analytics_df(text_dir, text_data)
+    # the symbol counts are only written by the processing of the stage
+    save_text_outputs(text_dir, iterate_text_data(text_dir), save_symbols=False)
     logger.info("Finished.")
 
 
-def preprocess_text(base_dir: Path, ds_name: str, text_name: str, overwrite: bool) -> None:
+def preprocess_text(base_dir: Path, ds_name: str, text_name: str, overwrite: bool, queue_role: Optional[QueueRole] = None, batch_size: int = DEFAULT_BATCH_SIZE, lease_s: float = DEFAULT_LEASE_S, queue_run_id: Optional[str] = None) -> None:
   logger = getLogger(__name__)
   logger.info("Preprocessing text...")
   ds_dir = get_ds_dir(base_dir, ds_name)
   text_dir = get_text_dir(ds_dir, text_name)
+  queue_config = get_queue_config(queue_role, batch_size, lease_s, queue_run_id)
+
+  def process_entries(entries: List[DsData], _: Path) -> List[TextData]:
+    # the texts are only saved in the data, i.e. nothing is written into the directory of the batch
+    return preprocess(DsDataList(entries)).items()
+
+  if is_queue_worker(queue_config):
+    run_queued_stage(text_dir, load_ds_data(ds_dir).items(), process_entries, queue_config, None)
+    return
+
   if text_dir.is_dir() and not overwrite:
     logger.error("Already exists.")
     return
 
   data = load_ds_data(ds_dir)
-  text_data = preprocess(data)
-
   if text_dir.is_dir():
     assert overwrite
     logger.info("Overwriting existing data.")
     rmtree(text_dir)
   text_dir.mkdir(parents=True, exist_ok=False)
 
+  if queue_config is None:
+    text_data = _process_and_write_in_chunks(data.items(), process_entries, text_dir)
+  else:
+    # the results of the workers are only available when all batches are done
+    text_data = TextDataList(run_queued_stage(text_dir, data.items(), process_entries, queue_config, None))
+    save_text_outputs(text_dir, text_data.items())
+
   save_text_data(text_dir, text_data)
-  save_symbols_stats_df(text_dir, text_data)
-  save_whole_text(text_dir, text_data)
-  save_analytics_df(text_dir, text_data)
 
 
-def _text_op(base_dir: Path, ds_name: str, orig_text_name: str, dest_text_name: str, operation: Callable[[TextDataList], TextDataList], overwrite: bool):
+def _text_op(base_dir: Path, ds_name: str, orig_text_name: str, dest_text_name: str, operation: Callable[[TextDataList], TextDataList], overwrite: bool, queue_config: Optional[QueueConfig] = None):
   logger = getLogger(__name__)
   ds_dir = get_ds_dir(base_dir, ds_name)
   orig_text_dir = get_text_dir(ds_dir, orig_text_name)
   assert orig_text_dir.is_dir()
   dest_text_dir = get_text_dir(ds_dir, dest_text_name)
+
+  def process_entries(entries: List[TextData], _: Path) -> List[TextData]:
+    return operation(TextDataList(entries)).items()
+
+  if is_queue_worker(queue_config):
+    run_queued_stage(dest_text_dir, load_text_data(orig_text_dir).items(), process_entries, queue_config, None)
+    return
+
   if dest_text_dir.is_dir() and not overwrite:
     logger.error("Already exists.")
     return
 
   logger.info("Reading data...")
   data = load_text_data(orig_text_dir)
-  text_data = operation(data)
 
   if dest_text_dir.is_dir():
     assert overwrite
@@ -128,10 +242,14 @@ def _text_op(base_dir: Path, ds_name: str, orig_text_name: str, dest_text_name:
     rmtree(dest_text_dir)
   dest_text_dir.mkdir(parents=True, exist_ok=False)
 
+  if queue_config is None:
+    text_data = _process_and_write_in_chunks(data.items(), process_entries, dest_text_dir)
+  else:
+    # the results of the workers are only available when all batches are done
+    text_data = TextDataList(run_queued_stage(dest_text_dir, data.items(), process_entries, queue_config, None))
+    save_text_outputs(dest_text_dir, text_data.items())
+
   save_text_data(dest_text_dir, text_data)
-  save_symbols_stats_df(dest_text_dir, text_data)
-  save_whole_text(dest_text_dir, text_data)
-  save_analytics_df(dest_text_dir, text_data)
   logger.info("Dataset processed.")
 
 
@@ -142,7 +260,7 @@ def text_normalize(base_dir: Path, ds_name: str, orig_text_name: str, dest_text_
   _text_op(base_dir, ds_name, orig_text_name, dest_text_name, operation, overwrite)
 
 
-def text_convert_to_ipa(base_dir: Path, ds_name: str, orig_text_name: str, dest_text_name: str, consider_annotations: Optional[bool], mode: Optional[EngToIPAMode], overwrite: bool) -> None:
+def text_convert_to_ipa(base_dir: Path, ds_name: str, orig_text_name: str, dest_text_name: str, consider_annotations: Optional[bool], mode: Optional[EngToIPAMode], overwrite: bool, queue_role: Optional[QueueRole] = None, batch_size: int = DEFAULT_BATCH_SIZE, lease_s: float = DEFAULT_LEASE_S, queue_run_id: Optional[str] = None) -> None:
   logger = getLogger(__name__)
   logger.info("Converting text to IPA...")
   operation = partial(
@@ -150,8 +268,11 @@ def text_convert_to_ipa(base_dir: Path, ds_name: str, orig_text_name: str, dest_
     mode=mode,
     consider_annotations=consider_annotations,
     n_jobs=cpu_count() - 1,
+    # the pronunciations are looked up once for all chunks
+    cache=get_empty_cache(),
   )
-  _text_op(base_dir, ds_name, orig_text_name, dest_text_name, operation, overwrite)
+  _text_op(base_dir, ds_name, orig_text_name, dest_text_name, operation, overwrite,
+           get_queue_config(queue_role, batch_size, lease_s, queue_run_id))
 
 def text_map_to_ipa(base_dir: Path, ds_name: str, orig_text_name: str, dest_text_name: str, overwrite: bool) -> None:
   logger = getLogger(__name__)
@@ -2,16 +2,18 @@ import os
 import tempfile
 from logging import getLogger
 from pathlib import Path
-from shutil import copyfile
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import matplotlib.pylab as plt
 import numpy as np
 from audio_utils.mel import plot_melspec
 from image_utils import stack_images_vertically
+from scipy.io.wavfile import write
 from speech_dataset_preprocessing.app.ds import get_ds_dir
-from speech_dataset_preprocessing.app.wav import get_wav_dir, load_wav_data
-from speech_dataset_preprocessing.core.wav import WavData
+from speech_dataset_preprocessing.app.wav import get_wav_dir, iterate_wav_data
+from speech_dataset_preprocessing.core.sampling import (sample_random,
+                                                        sample_weighted)
+from speech_dataset_preprocessing.core.wav import WavData, read_entry_wav
 from speech_dataset_preprocessing.core.wav import \
     remove_silence_plot as remove_silence_plot_core
 
@@ -25,10 +27,13 @@ def _save_orig_plot_if_not_exists(dest_dir: Path, mel) -> Path:
   return path
 
 
-def _save_orig_wav_if_not_exists(dest_dir: Path, orig_path: Path) -> None:
+def _save_orig_wav_if_not_exists(dest_dir: Path, wav_read: Tuple[int, np.ndarray]) -> Path:
+  # the entry can be contained in a packed store, therefore its samples are written instead of copying the file
   path = dest_dir / "original.wav"
   if not path.is_file():
-    copyfile(orig_path, path)
+    sampling_rate, wav = wav_read
+    write(path, sampling_rate, wav)
+  return path
 
 
 def _save_trimmed_plot_temp(mel: np.ndarray) -> Path:
@@ -53,15 +58,25 @@ def __get_trim_dir(wav_dir: Path, entry: WavData) -> Path:
   return __get_trim_root_dir(wav_dir) / str(entry.entry_id)
 
 
-def remove_silence_plot(base_dir: Path, ds_name: str, wav_name: str, chunk_size: int, threshold_start: float, threshold_end: float, buffer_start_ms: float, buffer_end_ms: float, entry_id: Optional[int] = None) -> None:
+def remove_silence_plot(base_dir: Path, ds_name: str, wav_name: str, chunk_size: int, threshold_start: float, threshold_end: float, buffer_start_ms: float, buffer_end_ms: float, entry_id: Optional[int] = None, seed: Optional[int] = None, weighted: bool = False) -> None:
   ds_dir = get_ds_dir(base_dir, ds_name)
   wav_dir = get_wav_dir(ds_dir, wav_name)
   assert wav_dir.is_dir()
-  data = load_wav_data(wav_dir)
+  # the entries are streamed, i.e. the wav data is not loaded completely
+  entries = iterate_wav_data(wav_dir)
   if entry_id is None:
-    entry = data.get_random_entry()
+    # without seed another entry is taken on every call
+    if weighted:
+      samples = sample_weighted(entries, lambda entry: entry.wav_duration, k=1, seed=seed)
+    else:
+      samples = sample_random(entries, k=1, seed=seed)
+    if len(samples) == 0:
+      raise ValueError(f"The wav data of {wav_name} contains no entries.")
+    entry = samples[0]
   else:
-    entry = data.get_entry(entry_id)
+    entry = next((entry for entry in entries if entry.entry_id == entry_id), None)
+    if entry is None:
+      raise ValueError(f"The wav data of {wav_name} contains no entry {entry_id}.")
 
   dest_dir = __get_trim_dir(wav_dir, entry)
   dest_dir.mkdir(parents=True, exist_ok=True)
@@ -69,7 +84,7 @@ def remove_silence_plot(base_dir: Path, ds_name: str, wav_name: str, chunk_size:
   dest_name = f"cs={chunk_size},ts={threshold_start}dBFS,bs={buffer_start_ms}ms,te={threshold_end}dBFS,be={buffer_end_ms}ms"
 
   wav_trimmed = dest_dir / f"{dest_name}.wav"
-  absolute_wav_path = wav_dir / entry.wav_relative_path
+  absolute_wav_path = _save_orig_wav_if_not_exists(dest_dir, read_entry_wav(entry, wav_dir))
 
   mel_orig, mel_trimmed = remove_silence_plot_core(
     wav_path=absolute_wav_path,
@@ -81,7 +96,6 @@ def remove_silence_plot(base_dir: Path, ds_name: str, wav_name: str, chunk_size:
     buffer_end_ms=buffer_end_ms
   )
 
-  _save_orig_wav_if_not_exists(dest_dir, absolute_wav_path)
   orig = _save_orig_plot_if_not_exists(dest_dir, mel_orig)
   trimmed = _save_trimmed_plot_temp(mel_trimmed)
   resulting_path = _save_comparison(dest_dir, dest_name, [orig, trimmed])
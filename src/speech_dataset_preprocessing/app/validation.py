@@ -0,0 +1,134 @@
+from logging import getLogger
+from multiprocessing import cpu_count
+from pathlib import Path
+from shutil import rmtree
+from typing import Optional, Set, Tuple
+
+import pandas as pd
+from general_utils import load_obj, save_obj
+from speech_dataset_preprocessing.app.ds import get_ds_dir
+from speech_dataset_preprocessing.app.mel import get_mel_dir, load_mel_data
+from speech_dataset_preprocessing.app.text import (get_text_dir,
+                                                   iterate_text_data)
+from speech_dataset_preprocessing.app.wav import get_wav_dir, load_wav_data
+from speech_dataset_preprocessing.core.ds import assert_is_ds_entry
+from speech_dataset_preprocessing.core.validation import (
+    DEFAULT_MAX_CLIPPING_RATE, DEFAULT_MAX_DC_OFFSET, ValidationThresholds,
+    WavValidationList, get_excluded_entry_ids, get_excluded_mel_entry_ids,
+    get_excluded_text_entry_ids, get_mel_report_df, get_report_df,
+    get_text_report_df, validate, validate_mels, validate_texts)
+from speech_dataset_preprocessing.globals import DEFAULT_CSV_SEPERATOR
+
+_validation_data_pkl = "data.pkl"
+REPORT_DF_FILENAME = "report.csv"
+MEL_REPORT_DF_FILENAME = "mel_report.csv"
+TEXT_REPORT_DF_FILENAME = "text_report.csv"
+# one entry id per line
+EXCLUDED_IDS_FILENAME = "excluded.txt"
+
+
+def _get_validation_root_dir(ds_dir: Path) -> Path:
+  return ds_dir / "validation"
+
+
+def get_validation_dir(ds_dir: Path, wav_name: str) -> Path:
+  return _get_validation_root_dir(ds_dir) / wav_name
+
+
+def load_validation_data(validation_dir: Path) -> WavValidationList:
+  path = validation_dir / _validation_data_pkl
+  return load_obj(path)
+
+
+def save_validation_data(validation_dir: Path, data: WavValidationList) -> None:
+  path = validation_dir / _validation_data_pkl
+  save_obj(data, path)
+
+
+def save_excluded_entry_ids(validation_dir: Path, entry_ids: Set[int]) -> None:
+  path = validation_dir / EXCLUDED_IDS_FILENAME
+  path.write_text("".join(f"{entry_id}\n" for entry_id in sorted(entry_ids)), encoding="utf-8")
+
+
+def load_excluded_entry_ids(base_dir: Path, ds_name: str, wav_name: str) -> Set[int]:
+  ds_dir = get_ds_dir(base_dir, ds_name)
+  path = get_validation_dir(ds_dir, wav_name) / EXCLUDED_IDS_FILENAME
+  assert path.is_file()
+  lines = path.read_text(encoding="utf-8").splitlines()
+  return {int(line) for line in lines if line != ""}
+
+
+def _log_issues(report_df: pd.DataFrame, issues: Tuple[str, ...], kind: str) -> None:
+  logger = getLogger(__name__)
+  issues_df = report_df[report_df["Issues"] != ""]
+  for issue in issues:
+    count = issues_df["Issues"].str.contains(issue, regex=False).sum()
+    logger.info(f"{kind} with {issue}: {count}")
+
+
+def validate_wavs(base_dir: Path, ds_name: str, wav_name: str, text_name: Optional[str] = None, max_clipping_rate: float = DEFAULT_MAX_CLIPPING_RATE, max_dc_offset: float = DEFAULT_MAX_DC_OFFSET, overwrite: bool = False) -> None:
+  # the mels of the wavs are validated as well if they exist, the excluded ids contain the entries which failed any check
+  logger = getLogger(__name__)
+  logger.info("Validating wavs...")
+  ds_dir = get_ds_dir(base_dir, ds_name)
+  wav_dir = get_wav_dir(ds_dir, wav_name)
+  assert wav_dir.is_dir()
+  text_dir = None if text_name is None else get_text_dir(ds_dir, text_name)
+  assert text_dir is None or text_dir.is_dir()
+  validation_dir = get_validation_dir(ds_dir, wav_name)
+  if validation_dir.is_dir() and not overwrite:
+    logger.error("Already exists.")
+    return
+
+  wav_data = load_wav_data(wav_dir)
+  if text_dir is not None:
+    # the ids of the text are ds ids, i.e. they can't be combined with the ids of segments
+    for entry in wav_data.items():
+      assert_is_ds_entry(entry)
+  validation_data = validate(wav_data, wav_dir, n_jobs=cpu_count())
+
+  mel_report_df = None
+  excluded_mel_entry_ids: Set[int] = set()
+  mel_dir = get_mel_dir(ds_dir, wav_name)
+  if mel_dir.is_dir():
+    logger.info("Validating mels...")
+    mel_validation_data = validate_mels(load_mel_data(mel_dir), mel_dir, n_jobs=cpu_count())
+    mel_report_df = get_mel_report_df(mel_validation_data)
+    excluded_mel_entry_ids = get_excluded_mel_entry_ids(mel_validation_data)
+
+  text_report_df = None
+  excluded_text_entry_ids: Set[int] = set()
+  if text_dir is not None:
+    logger.info("Validating text...")
+    text_validation_data = validate_texts(iterate_text_data(text_dir))
+    text_report_df = get_text_report_df(text_validation_data)
+    excluded_text_entry_ids = get_excluded_text_entry_ids(text_validation_data)
+
+  if validation_dir.is_dir():
+    assert overwrite
+    logger.info("Overwriting existing data.")
+    rmtree(validation_dir)
+  validation_dir.mkdir(parents=True, exist_ok=False)
+
+  thresholds = ValidationThresholds(max_clipping_rate, max_dc_offset)
+  excluded_entry_ids = get_excluded_entry_ids(validation_data, thresholds)
+  excluded_entry_ids |= excluded_mel_entry_ids | excluded_text_entry_ids
+  save_validation_data(validation_dir, validation_data)
+  report_df = get_report_df(validation_data, thresholds)
+  report_df.to_csv(validation_dir / REPORT_DF_FILENAME,
+                   sep=DEFAULT_CSV_SEPERATOR, header=True, index=False)
+  if mel_report_df is not None:
+    mel_report_df.to_csv(validation_dir / MEL_REPORT_DF_FILENAME,
+                         sep=DEFAULT_CSV_SEPERATOR, header=True, index=False)
+  if text_report_df is not None:
+    text_report_df.to_csv(validation_dir / TEXT_REPORT_DF_FILENAME,
+                          sep=DEFAULT_CSV_SEPERATOR, header=True, index=False)
+  save_excluded_entry_ids(validation_dir, excluded_entry_ids)
+
+  _log_issues(report_df, ("empty", "nan", "clipping", "dc offset", "duplicate"), "Wavs")
+  if mel_report_df is not None:
+    _log_issues(mel_report_df, ("empty", "channels", "nan"), "Mels")
+  if text_report_df is not None:
+    _log_issues(text_report_df, ("empty",), "Texts")
+  logger.info(f"Excluded {len(excluded_entry_ids)} of {len(validation_data)} entries.")
+  logger.info("Done.")
@@ -3,16 +3,38 @@ from logging import getLogger
 from multiprocessing import cpu_count
 from pathlib import Path
 from shutil import rmtree
-from typing import Callable
+from typing import Callable, Iterator, List, Optional
 
+import pandas as pd
 from general_utils import load_obj, save_obj
-from speech_dataset_preprocessing.app.ds import get_ds_dir, load_ds_data
-from speech_dataset_preprocessing.core.wav import (WavDataList, log_stats,
+from speech_dataset_preprocessing.app.data_cache import (iterate_data,
+                                                         load_data, save_data)
+from speech_dataset_preprocessing.app.ds import (get_ds_data_path, get_ds_dir,
+                                                 load_ds_data)
+from speech_dataset_preprocessing.core.ds import DsData, DsDataList
+from speech_dataset_preprocessing.core.pipelined import (
+    DEFAULT_IO_JOBS, DEFAULT_READ_QUEUE_SIZE, DEFAULT_WRITE_QUEUE_SIZE,
+    PipelineConfig)
+from speech_dataset_preprocessing.core.resample import ResampleMode
+from speech_dataset_preprocessing.core.segmentation import (
+    SegmentationParams, segment)
+from speech_dataset_preprocessing.core.sharding import (
+    get_partial_dir, is_sharded, load_partial_positions, merge_partial_entries,
+    save_partial_positions, select_shard)
+from speech_dataset_preprocessing.core.stats import (Stats, StatsSignature,
+                                                     get_sources_signature)
+from speech_dataset_preprocessing.core.wav import (WavData, WavDataList,
+                                                   benchmark_resample, convert,
+                                                   get_stats, log_stats,
                                                    normalize, preprocess,
                                                    remove_silence, resample,
                                                    stereo_to_mono)
+from speech_dataset_preprocessing.core.work_queue import (
+    DEFAULT_BATCH_SIZE, DEFAULT_LEASE_S, QueueConfig, QueueRole,
+    get_queue_config, is_queue_worker, run_queued_stage)
 
 _wav_data_csv = "data.pkl"
+_wav_stats_pkl = "stats.pkl"
 
 
 def _get_wav_root_dir(ds_dir: Path) -> Path:
@@ -23,38 +45,134 @@ def get_wav_dir(ds_dir: Path, wav_name: str) -> Path:
   return _get_wav_root_dir(ds_dir) / wav_name
 
 
+def _get_wav_data_path(wav_dir: Path) -> Path:
+  return wav_dir / _wav_data_csv
+
+
 def load_wav_data(wav_dir: Path) -> WavDataList:
-  path = wav_dir / _wav_data_csv
-  return load_obj(path)
+  path = _get_wav_data_path(wav_dir)
+  return load_data(path)
+
+
+def iterate_wav_data(wav_dir: Path) -> Iterator[WavData]:
+  path = _get_wav_data_path(wav_dir)
+  return iterate_data(path)
 
 
 def save_wav_data(wav_dir: Path, wav_data: WavDataList) -> None:
   wav_dir.mkdir(parents=True, exist_ok=True)
-  path = wav_dir / _wav_data_csv
-  save_obj(wav_data, path)
+  path = _get_wav_data_path(wav_dir)
+  save_data(wav_data, path)
+
+
+def _get_stats_signature(ds_dir: Path, wav_dir: Path) -> StatsSignature:
+  return get_sources_signature([get_ds_data_path(ds_dir), _get_wav_data_path(wav_dir)])
+
+
+def save_wav_stats(ds_dir: Path, wav_dir: Path, ds_data: DsDataList, wav_data: WavDataList) -> None:
+  if len(wav_data) == 0:
+    return
+  signature = _get_stats_signature(ds_dir, wav_dir)
+  stats = get_stats(ds_data, wav_data, signature)
+  save_obj(stats, wav_dir / _wav_stats_pkl)
+  log_stats(stats)
 
 
-def preprocess_wavs(base_dir: Path, ds_name: str, wav_name: str, overwrite: bool = False) -> None:
+def _load_cached_stats(ds_dir: Path, wav_dir: Path) -> Optional[Stats]:
+  path = wav_dir / _wav_stats_pkl
+  if not path.is_file():
+    return None
+  stats: Stats = load_obj(path)
+  if stats.signature != _get_stats_signature(ds_dir, wav_dir):
+    return None
+  return stats
+
+
+def _get_output_dir(wav_dir: Path, shard_index: Optional[int], num_shards: Optional[int], queue_config: Optional[QueueConfig]) -> Path:
+  if is_sharded(shard_index, num_shards):
+    if queue_config is not None:
+      raise ValueError("A shard can't be processed with the queue.")
+    return get_partial_dir(wav_dir, shard_index)
+  return wav_dir
+
+
+def _save_partial_result(partial_dir: Path, positions: List[int], wav_data: WavDataList) -> None:
+  logger = getLogger(__name__)
+  save_wav_data(partial_dir, wav_data)
+  save_partial_positions(partial_dir, positions)
+  logger.info(f"Saved the partial result of {len(wav_data)} entries, merge all shards with wavs-merge.")
+
+
+def preprocess_wavs(base_dir: Path, ds_name: str, wav_name: str, io_jobs: int = DEFAULT_IO_JOBS, read_queue_size: int = DEFAULT_READ_QUEUE_SIZE, write_queue_size: int = DEFAULT_WRITE_QUEUE_SIZE, packed_dtype: Optional[str] = None, shard_index: Optional[int] = None, num_shards: Optional[int] = None, queue_role: Optional[QueueRole] = None, batch_size: int = DEFAULT_BATCH_SIZE, lease_s: float = DEFAULT_LEASE_S, queue_run_id: Optional[str] = None, overwrite: bool = False) -> None:
   logger = getLogger(__name__)
   logger.info("Preprocessing wavs...")
   ds_dir = get_ds_dir(base_dir, ds_name)
   dest_wav_dir = get_wav_dir(ds_dir, wav_name)
-  if dest_wav_dir.is_dir() and not overwrite:
+  queue_config = get_queue_config(queue_role, batch_size, lease_s, queue_run_id)
+  n_jobs = cpu_count() - 1
+  pipeline_config = PipelineConfig(n_jobs, io_jobs, io_jobs, read_queue_size, write_queue_size)
+
+  def process_entries(entries: List[DsData], output_dir: Path) -> WavDataList:
+    return preprocess(DsDataList(entries), output_dir, n_jobs, pipeline_config, packed_dtype)
+
+  if is_queue_worker(queue_config):
+    run_queued_stage(dest_wav_dir, load_ds_data(ds_dir).items(), process_entries, queue_config, "wav_relative_path")
+    return
+
+  output_dir = _get_output_dir(dest_wav_dir, shard_index, num_shards, queue_config)
+  if output_dir.is_dir() and not overwrite:
     logger.error("Already exists.")
     return
 
   data = load_ds_data(ds_dir)
+  positions = None
+  if is_sharded(shard_index, num_shards):
+    # the durations are not known yet, the file sizes are proportional to them for most formats
+    sizes = [entry.wav_absolute_path.stat().st_size for entry in data.items()]
+    positions, entries = select_shard(data.items(), sizes, shard_index, num_shards)
+    data = DsDataList(entries)
 
-  if dest_wav_dir.is_dir():
+  if output_dir.is_dir():
     assert overwrite
     logger.info("Overwriting existing data.")
-    rmtree(dest_wav_dir)
-  dest_wav_dir.mkdir(exist_ok=False, parents=True)
+    rmtree(output_dir)
+  output_dir.mkdir(exist_ok=False, parents=True)
 
-  wav_data = preprocess(data, dest_wav_dir, n_jobs=cpu_count() - 1)
+  if queue_config is None:
+    wav_data = process_entries(data.items(), output_dir)
+  else:
+    wav_data = WavDataList(run_queued_stage(output_dir, data.items(), process_entries, queue_config, "wav_relative_path"))
+  if positions is not None:
+    _save_partial_result(output_dir, positions, wav_data)
+    return
   save_wav_data(dest_wav_dir, wav_data)
+  save_wav_stats(ds_dir, dest_wav_dir, data, wav_data)
+
+
+def wavs_merge(base_dir: Path, ds_name: str, wav_name: str, num_shards: int, overwrite: bool = False) -> None:
+  # the partial results stay where they are, the merged data references them
+  logger = getLogger(__name__)
+  logger.info("Merging shards...")
+  ds_dir = get_ds_dir(base_dir, ds_name)
+  wav_dir = get_wav_dir(ds_dir, wav_name)
+  if _get_wav_data_path(wav_dir).is_file() and not overwrite:
+    logger.error("Already exists.")
+    return
+
+  partials = []
+  for shard_index in range(num_shards):
+    partial_dir = get_partial_dir(wav_dir, shard_index)
+    if not _get_wav_data_path(partial_dir).is_file():
+      logger.error(f"Shard {shard_index} is missing or not finished.")
+      return
+    partials.append((partial_dir.relative_to(wav_dir), load_partial_positions(partial_dir),
+                    load_wav_data(partial_dir).items()))
+
+  wav_data = WavDataList(merge_partial_entries(partials, "wav_relative_path"))
+  save_wav_data(wav_dir, wav_data)
   ds_data = load_ds_data(ds_dir)
-  log_stats(ds_data, wav_data)
+  save_wav_stats(ds_dir, wav_dir, ds_data, wav_data)
+  logger.info(f"Merged {len(wav_data)} entries.")
 
 
 def wavs_stats(base_dir: Path, ds_name: str, wav_name: str) -> None:
@@ -63,49 +181,90 @@ def wavs_stats(base_dir: Path, ds_name: str, wav_name: str) -> None:
   ds_dir = get_ds_dir(base_dir, ds_name)
   wav_dir = get_wav_dir(ds_dir, wav_name)
   if wav_dir.is_dir():
-    ds_data = load_ds_data(ds_dir)
-    wav_data = load_wav_data(wav_dir)
-    log_stats(ds_data, wav_data)
+    stats = _load_cached_stats(ds_dir, wav_dir)
+    if stats is None:
+      ds_data = load_ds_data(ds_dir)
+      wav_data = load_wav_data(wav_dir)
+      save_wav_stats(ds_dir, wav_dir, ds_data, wav_data)
+    else:
+      logger.info("Using cached stats.")
+      log_stats(stats)
 
 
-def wavs_normalize(base_dir: Path, ds_name: str, orig_wav_name: str, dest_wav_name: str, overwrite: bool = False) -> None:
+def wavs_normalize(base_dir: Path, ds_name: str, orig_wav_name: str, dest_wav_name: str, packed_dtype: Optional[str] = None, shard_index: Optional[int] = None, num_shards: Optional[int] = None, queue_role: Optional[QueueRole] = None, batch_size: int = DEFAULT_BATCH_SIZE, lease_s: float = DEFAULT_LEASE_S, queue_run_id: Optional[str] = None, overwrite: bool = False) -> None:
   logger = getLogger(__name__)
   logger.info("Normalizing wavs...")
-  op = partial(normalize)
-  __wav_op(base_dir, ds_name, orig_wav_name, dest_wav_name, op, overwrite)
+  op = partial(normalize, n_jobs=cpu_count() - 1, packed_dtype=packed_dtype)
+  __wav_op(base_dir, ds_name, orig_wav_name, dest_wav_name, op, overwrite, shard_index, num_shards,
+           get_queue_config(queue_role, batch_size, lease_s, queue_run_id))
 
 
-def wavs_resample(base_dir: Path, ds_name: str, orig_wav_name: str, dest_wav_name: str, rate: int, overwrite: bool = False) -> None:
+def wavs_resample(base_dir: Path, ds_name: str, orig_wav_name: str, dest_wav_name: str, rate: int, mode: ResampleMode = ResampleMode.QUALITY, packed_dtype: Optional[str] = None, shard_index: Optional[int] = None, num_shards: Optional[int] = None, queue_role: Optional[QueueRole] = None, batch_size: int = DEFAULT_BATCH_SIZE, lease_s: float = DEFAULT_LEASE_S, queue_run_id: Optional[str] = None, overwrite: bool = False) -> None:
   logger = getLogger(__name__)
   logger.info("Resampling wavs...")
-  op = partial(resample, new_rate=rate, n_jobs=cpu_count() - 1)
-  __wav_op(base_dir, ds_name, orig_wav_name, dest_wav_name, op, overwrite)
+  op = partial(resample, new_rate=rate, mode=mode, n_jobs=cpu_count() - 1, packed_dtype=packed_dtype)
+  __wav_op(base_dir, ds_name, orig_wav_name, dest_wav_name, op, overwrite, shard_index, num_shards,
+           get_queue_config(queue_role, batch_size, lease_s, queue_run_id))
 
 
-def wavs_stereo_to_mono(base_dir: Path, ds_name: str, orig_wav_name: str, dest_wav_name: str, overwrite: bool = False) -> None:
+def wavs_resample_benchmark(base_dir: Path, ds_name: str, wav_name: str, rate: int, mode: ResampleMode = ResampleMode.QUALITY, entries_count: int = 100) -> None:
+  logger = getLogger(__name__)
+  logger.info("Benchmarking resampling...")
+  ds_dir = get_ds_dir(base_dir, ds_name)
+  wav_dir = get_wav_dir(ds_dir, wav_name)
+  assert wav_dir.is_dir()
+  data = load_wav_data(wav_dir)
+  subset = WavDataList(data.items()[:entries_count])
+  if len(subset) == 0:
+    return
+
+  result = benchmark_resample(subset, wav_dir, rate, mode)
+  with pd.option_context(
+    'display.max_columns', None,
+    'display.width', None,
+    'display.precision', 4,
+  ):
+    logger.info(f"\n{result}")
+
+
+def wavs_convert(base_dir: Path, ds_name: str, orig_wav_name: str, dest_wav_name: str, to_mono: bool, peak_normalize: bool, rate: Optional[int], mode: ResampleMode = ResampleMode.QUALITY, packed_dtype: Optional[str] = None, shard_index: Optional[int] = None, num_shards: Optional[int] = None, queue_role: Optional[QueueRole] = None, batch_size: int = DEFAULT_BATCH_SIZE, lease_s: float = DEFAULT_LEASE_S, queue_run_id: Optional[str] = None, overwrite: bool = False) -> None:
+  logger = getLogger(__name__)
+  logger.info("Converting wavs...")
+  op = partial(convert, to_mono=to_mono, peak_normalize=peak_normalize,
+               new_rate=rate, mode=mode, n_jobs=cpu_count() - 1, packed_dtype=packed_dtype)
+  __wav_op(base_dir, ds_name, orig_wav_name, dest_wav_name, op, overwrite, shard_index, num_shards,
+           get_queue_config(queue_role, batch_size, lease_s, queue_run_id))
+
+
+def wavs_stereo_to_mono(base_dir: Path, ds_name: str, orig_wav_name: str, dest_wav_name: str, packed_dtype: Optional[str] = None, shard_index: Optional[int] = None, num_shards: Optional[int] = None, queue_role: Optional[QueueRole] = None, batch_size: int = DEFAULT_BATCH_SIZE, lease_s: float = DEFAULT_LEASE_S, queue_run_id: Optional[str] = None, overwrite: bool = False) -> None:
   logger = getLogger(__name__)
   logger.info("Converting wavs from stereo to mono...")
-  op = partial(stereo_to_mono)
-  __wav_op(base_dir, ds_name, orig_wav_name, dest_wav_name, op, overwrite)
+  op = partial(stereo_to_mono, n_jobs=cpu_count() - 1, packed_dtype=packed_dtype)
+  __wav_op(base_dir, ds_name, orig_wav_name, dest_wav_name, op, overwrite, shard_index, num_shards,
+           get_queue_config(queue_role, batch_size, lease_s, queue_run_id))
 
 
-def wavs_remove_silence(base_dir: Path, ds_name: str, orig_wav_name: str, dest_wav_name: str, chunk_size: int, threshold_start: float, threshold_end: float, buffer_start_ms: float, buffer_end_ms: float, overwrite: bool = False) -> None:
+def wavs_remove_silence(base_dir: Path, ds_name: str, orig_wav_name: str, dest_wav_name: str, chunk_size: int, threshold_start: float, threshold_end: float, buffer_start_ms: float, buffer_end_ms: float, packed_dtype: Optional[str] = None, shard_index: Optional[int] = None, num_shards: Optional[int] = None, queue_role: Optional[QueueRole] = None, batch_size: int = DEFAULT_BATCH_SIZE, lease_s: float = DEFAULT_LEASE_S, queue_run_id: Optional[str] = None, overwrite: bool = False) -> None:
   logger = getLogger(__name__)
   logger.info("Removing silence in wavs...")
   op = partial(remove_silence, chunk_size=chunk_size, threshold_start=threshold_start,
-               threshold_end=threshold_end, buffer_start_ms=buffer_start_ms, buffer_end_ms=buffer_end_ms)
-  __wav_op(base_dir, ds_name, orig_wav_name, dest_wav_name, op, overwrite)
+               threshold_end=threshold_end, buffer_start_ms=buffer_start_ms, buffer_end_ms=buffer_end_ms,
+               n_jobs=cpu_count() - 1, packed_dtype=packed_dtype)
+  __wav_op(base_dir, ds_name, orig_wav_name, dest_wav_name, op, overwrite, shard_index, num_shards,
+           get_queue_config(queue_role, batch_size, lease_s, queue_run_id))
 
 
-def __wav_op(base_dir: Path, ds_name: str, origin_wav_name: str, destination_wav_name: str, op: Callable[[WavDataList, Path, Path], WavDataList], overwrite: bool) -> None:
+def wavs_segment(base_dir: Path, ds_name: str, orig_wav_name: str, dest_wav_name: str, chunk_size: int, threshold: float, min_silence_ms: float, min_length_s: float, max_length_s: float, packed_dtype: Optional[str] = None, overwrite: bool = False) -> None:
+  # the segments get new ids which are not contained in the ds data, therefore no stats are created and all joins with the ds data refuse them
   logger = getLogger(__name__)
+  logger.info("Segmenting wavs...")
   ds_dir = get_ds_dir(base_dir, ds_name)
-  dest_wav_dir = get_wav_dir(ds_dir, destination_wav_name)
+  dest_wav_dir = get_wav_dir(ds_dir, dest_wav_name)
   if dest_wav_dir.is_dir() and not overwrite:
     logger.error("Already exists.")
     return
 
-  orig_wav_dir = get_wav_dir(ds_dir, origin_wav_name)
+  orig_wav_dir = get_wav_dir(ds_dir, orig_wav_name)
   assert orig_wav_dir.is_dir()
   data = load_wav_data(orig_wav_dir)
 
@@ -113,9 +272,54 @@ def __wav_op(base_dir: Path, ds_name: str, origin_wav_name: str, destination_wav
     assert overwrite
     logger.info("Overwriting existing data.")
     rmtree(dest_wav_dir)
-
   dest_wav_dir.mkdir(exist_ok=False, parents=True)
-  wav_data = op(data, orig_wav_dir, dest_wav_dir)
+
+  params = SegmentationParams(chunk_size, threshold, min_silence_ms, min_length_s, max_length_s)
+  wav_data = segment(data, orig_wav_dir, dest_wav_dir, params, n_jobs=cpu_count() - 1, packed_dtype=packed_dtype)
+  save_wav_data(dest_wav_dir, wav_data)
+  total_duration_h = sum(x.wav_duration for x in wav_data.items()) / 3600
+  logger.info(f"Split {len(data)} entries into {len(wav_data)} segments ({total_duration_h:.2f}h).")
+
+
+def __wav_op(base_dir: Path, ds_name: str, origin_wav_name: str, destination_wav_name: str, op: Callable[[WavDataList, Path, Path], WavDataList], overwrite: bool, shard_index: Optional[int] = None, num_shards: Optional[int] = None, queue_config: Optional[QueueConfig] = None) -> None:
+  logger = getLogger(__name__)
+  ds_dir = get_ds_dir(base_dir, ds_name)
+  dest_wav_dir = get_wav_dir(ds_dir, destination_wav_name)
+  orig_wav_dir = get_wav_dir(ds_dir, origin_wav_name)
+
+  def process_entries(entries: List[WavData], output_dir: Path) -> WavDataList:
+    return op(WavDataList(entries), orig_wav_dir, output_dir)
+
+  if is_queue_worker(queue_config):
+    run_queued_stage(dest_wav_dir, load_wav_data(orig_wav_dir).items(), process_entries, queue_config, "wav_relative_path")
+    return
+
+  output_dir = _get_output_dir(dest_wav_dir, shard_index, num_shards, queue_config)
+  if output_dir.is_dir() and not overwrite:
+    logger.error("Already exists.")
+    return
+
+  assert orig_wav_dir.is_dir()
+  data = load_wav_data(orig_wav_dir)
+  positions = None
+  if is_sharded(shard_index, num_shards):
+    durations = [entry.wav_duration for entry in data.items()]
+    positions, entries = select_shard(data.items(), durations, shard_index, num_shards)
+    data = WavDataList(entries)
+
+  if output_dir.is_dir():
+    assert overwrite
+    logger.info("Overwriting existing data.")
+    rmtree(output_dir)
+
+  output_dir.mkdir(exist_ok=False, parents=True)
+  if queue_config is None:
+    wav_data = op(data, orig_wav_dir, output_dir)
+  else:
+    wav_data = WavDataList(run_queued_stage(output_dir, data.items(), process_entries, queue_config, "wav_relative_path"))
+  if positions is not None:
+    _save_partial_result(output_dir, positions, wav_data)
+    return
   save_wav_data(dest_wav_dir, wav_data)
   ds_data = load_ds_data(ds_dir)
-  log_stats(ds_data, wav_data)
+  save_wav_stats(ds_dir, dest_wav_dir, ds_data, wav_data)
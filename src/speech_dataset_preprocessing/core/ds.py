@@ -1,7 +1,7 @@
 from collections import Counter
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Callable, Optional, Set, Tuple
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
 
 from general_utils import GenericList
 from speech_dataset_parser_api import parse_directory
@@ -10,6 +10,8 @@ from speech_dataset_parser_old import (PreData, PreDataList, download_ljs,
                                        parse_arctic, parse_libritts, parse_ljs,
                                        parse_mailabs, parse_thchs,
                                        parse_thchs_kaldi)
+from speech_dataset_preprocessing.core.sampling import (DEFAULT_SEED,
+                                                        sample_per_group)
 from text_utils import (Gender, Language, Speaker, Speakers, SpeakersLogDict,
                         SymbolFormat, Symbols, get_format_from_str,
                         get_lang_from_str)
@@ -72,13 +74,18 @@ def generic_preprocess(directory: Path, tier_name: str, n_digits: int, symbols_f
     assert data_entry.wav_absolute_path.is_file()
     result.append(data_entry)
 
-  all_speakers: Speakers = (x.speaker_name for x in result.items())
-  all_speakers_counter = Counter(all_speakers)
-  speakers_log = SpeakersLogDict.fromcounter(all_speakers_counter)
+  speakers_log = get_speakers_log(result)
 
   return speakers_log, result
 
 
+def get_speakers_log(data: DsDataList) -> SpeakersLogDict:
+  all_speakers: Speakers = (x.speaker_name for x in data.items())
+  all_speakers_counter = Counter(all_speakers)
+  speakers_log = SpeakersLogDict.fromcounter(all_speakers_counter)
+  return speakers_log
+
+
 def get_gender_from_iso(gender_iso: int) -> Optional[Gender]:
   if gender_iso in {0, 9}:
     return None
@@ -115,14 +122,50 @@ def get_dsdata_from_predata(dir_path: Path, predata: PreData) -> DsData:
   return res
 
 
-def get_speaker_examples(data: DsDataList) -> DsDataList:
-  processed_speakers: Set[str] = set()
-  result = DsDataList()
-  for values in data.items(True):
-    if values.speaker_name not in processed_speakers:
-      processed_speakers.add(values.speaker_name)
-      result.append(values)
-  return result
+def get_source_entry_id(entry: Any) -> Optional[int]:
+  # is set for segments (wav or mel data): the id of the ds entry which was split, their own ids are no ds ids
+  return getattr(entry, "source_entry_id", None)
+
+
+def get_ds_entry_id(entry: Any) -> int:
+  # the id of the ds entry to which the entry belongs, i.e. the split entry for segments
+  source_entry_id = get_source_entry_id(entry)
+  return entry.entry_id if source_entry_id is None else source_entry_id
+
+
+def assert_is_ds_entry(entry: Any) -> None:
+  # segments can't be joined with the ds data by id, their ids would match other entries
+  source_entry_id = get_source_entry_id(entry)
+  if source_entry_id is not None:
+    raise ValueError(
+      f"Entry {entry.entry_id} is a segment of entry {source_entry_id}, segments can't be joined with the dataset.")
+
+
+def iterate_with_ds_data(ds_data: DsDataList, entries: Iterable[Any]) -> Iterator[Tuple[DsData, Any]]:
+  # the entries (e.g. wav data) need to be in the order of the ds data but can be a subset of it
+  iterator = iter(entries)
+  current = next(iterator, None)
+  for ds_entry in ds_data.items():
+    if current is None:
+      return
+    assert_is_ds_entry(current)
+    if current.entry_id == ds_entry.entry_id:
+      yield ds_entry, current
+      current = next(iterator, None)
+  if current is not None:
+    raise ValueError(f"Entry {current.entry_id} is not contained in the dataset or not in its order.")
+
+
+def get_entries_count(entries: Iterable[Any]) -> int:
+  # the chunk directories need to cover all ids, filtered subsets can contain gaps
+  return max((entry.entry_id for entry in entries), default=-1) + 1
+
+
+def get_speaker_examples(data: Iterable[DsData], seed: Optional[int] = DEFAULT_SEED) -> DsDataList:
+  # one seeded sample per speaker, i.e. the same examples are returned for the same data
+  # the entries are drawn in one pass, e.g. while they are streamed from the ds data
+  examples = sample_per_group(data, lambda entry: entry.speaker_name, k=1, seed=seed)
+  return DsDataList(examples)
 
 
 def thchs_preprocess(dir_path: Path, auto_dl: bool) -> PreprocessingResult:
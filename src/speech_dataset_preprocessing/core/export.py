@@ -0,0 +1,163 @@
+"""
+input: final data
+output: packed symbol ids, mel shards and a length index which can be memory-mapped for training
+"""
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, List, Tuple
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from speech_dataset_preprocessing.core.final import FinalDsEntry
+from text_utils import Speaker
+from tqdm import tqdm
+
+SYMBOLS_FILENAME = "symbols.json"
+SPEAKERS_FILENAME = "speakers.json"
+ENTRY_IDS_FILENAME = "entry_ids.npy"
+SPEAKER_IDS_FILENAME = "speaker_ids.npy"
+SYMBOL_IDS_FILENAME = "symbol_ids.npy"
+# n + 1 offsets into the symbol ids, the symbols of entry i are ids[offsets[i]:offsets[i + 1]]
+SYMBOL_OFFSETS_FILENAME = "symbol_offsets.npy"
+# per entry: shard number, first frame in the shard and count of frames
+MEL_INDEX_FILENAME = "mel_index.npy"
+# per entry: count of symbols and count of mel frames
+LENGTHS_FILENAME = "lengths.npy"
+# entry indices sorted by mel frames (ascending), e.g. for bucketed batching
+LENGTH_ORDER_FILENAME = "length_order.npy"
+# the shards are stored as (frames, channels) so that every mel is one contiguous block
+MEL_SHARD_FILENAME = "mels_{}.npy"
+
+DEFAULT_SHARD_FRAMES = 2 ** 20
+
+
+@dataclass()
+class ExportedData:
+  symbols: List[str]
+  speakers: List[Speaker]
+  entry_ids: np.ndarray
+  speaker_ids: np.ndarray
+  symbol_ids: np.ndarray
+  symbol_offsets: np.ndarray
+  mel_index: np.ndarray
+  lengths: np.ndarray
+  length_order: np.ndarray
+  mel_shards: List[np.ndarray]
+
+  def __len__(self) -> int:
+    return len(self.entry_ids)
+
+  def get_symbol_ids(self, index: int) -> np.ndarray:
+    return self.symbol_ids[self.symbol_offsets[index]:self.symbol_offsets[index + 1]]
+
+  def get_mel(self, index: int) -> np.ndarray:
+    shard, start, n_frames = self.mel_index[index]
+    return self.mel_shards[shard][start:start + n_frames].T
+
+
+def get_vocabularies(entries: Iterable[FinalDsEntry]) -> Tuple[List[str], List[Speaker], int, int]:
+  symbols = set()
+  speakers = set()
+  entries_count = 0
+  symbols_count = 0
+  for entry in entries:
+    symbols.update(entry.symbols)
+    speakers.add(entry.speaker_name)
+    entries_count += 1
+    symbols_count += len(entry.symbols)
+  return sorted(symbols), sorted(speakers), entries_count, symbols_count
+
+
+def export(get_entries: Callable[[], Iterable[FinalDsEntry]], export_dir: Path, mel_dtype: np.dtype, shard_frames: int) -> None:
+  # the entries are streamed twice: once for the vocabularies and sizes and once for writing
+  assert export_dir.is_dir()
+  assert shard_frames > 0
+  symbols, speakers, entries_count, symbols_count = get_vocabularies(get_entries())
+  _save_json(export_dir / SYMBOLS_FILENAME, symbols)
+  _save_json(export_dir / SPEAKERS_FILENAME, speakers)
+  symbol_to_id = {symbol: i for i, symbol in enumerate(symbols)}
+  speaker_to_id = {speaker: i for i, speaker in enumerate(speakers)}
+
+  symbol_ids = open_memmap(export_dir / SYMBOL_IDS_FILENAME, mode="w+",
+                           dtype=np.min_scalar_type(max(len(symbols) - 1, 0)), shape=(symbols_count,))
+  symbol_offsets = np.zeros(entries_count + 1, dtype=np.int64)
+  entry_ids = np.zeros(entries_count, dtype=np.int64)
+  speaker_ids = np.zeros(entries_count, dtype=np.int32)
+  mel_index = np.zeros((entries_count, 3), dtype=np.int64)
+  lengths = np.zeros((entries_count, 2), dtype=np.int64)
+
+  shard_nr = 0
+  shard_buffer: List[np.ndarray] = []
+  shard_frames_count = 0
+  n_channels = None
+  for i, entry in enumerate(tqdm(get_entries(), total=entries_count)):
+    entry_symbol_ids = [symbol_to_id[symbol] for symbol in entry.symbols]
+    start = symbol_offsets[i]
+    symbol_ids[start:start + len(entry_symbol_ids)] = entry_symbol_ids
+    symbol_offsets[i + 1] = start + len(entry_symbol_ids)
+    entry_ids[i] = entry.entry_id
+    speaker_ids[i] = speaker_to_id[entry.speaker_name]
+
+    mel = entry.load_mel()
+    if n_channels is None:
+      n_channels = mel.shape[0]
+    assert mel.shape[0] == n_channels
+    n_frames = mel.shape[1]
+    mel_index[i] = (shard_nr, shard_frames_count, n_frames)
+    lengths[i] = (len(entry_symbol_ids), n_frames)
+    shard_buffer.append(np.asarray(mel.T, dtype=mel_dtype))
+    shard_frames_count += n_frames
+
+    if shard_frames_count >= shard_frames:
+      _save_shard(export_dir, shard_nr, shard_buffer)
+      shard_nr += 1
+      shard_buffer = []
+      shard_frames_count = 0
+
+  if len(shard_buffer) > 0:
+    _save_shard(export_dir, shard_nr, shard_buffer)
+
+  symbol_ids.flush()
+  del symbol_ids
+  np.save(export_dir / SYMBOL_OFFSETS_FILENAME, symbol_offsets)
+  np.save(export_dir / ENTRY_IDS_FILENAME, entry_ids)
+  np.save(export_dir / SPEAKER_IDS_FILENAME, speaker_ids)
+  np.save(export_dir / MEL_INDEX_FILENAME, mel_index)
+  np.save(export_dir / LENGTHS_FILENAME, lengths)
+  np.save(export_dir / LENGTH_ORDER_FILENAME, np.argsort(lengths[:, 1], kind="stable"))
+
+
+def load_exported_data(export_dir: Path) -> ExportedData:
+  mel_index = np.load(export_dir / MEL_INDEX_FILENAME, mmap_mode="r")
+  shards_count = int(mel_index[:, 0].max()) + 1 if len(mel_index) > 0 else 0
+  result = ExportedData(
+    symbols=_load_json(export_dir / SYMBOLS_FILENAME),
+    speakers=_load_json(export_dir / SPEAKERS_FILENAME),
+    entry_ids=np.load(export_dir / ENTRY_IDS_FILENAME, mmap_mode="r"),
+    speaker_ids=np.load(export_dir / SPEAKER_IDS_FILENAME, mmap_mode="r"),
+    symbol_ids=np.load(export_dir / SYMBOL_IDS_FILENAME, mmap_mode="r"),
+    symbol_offsets=np.load(export_dir / SYMBOL_OFFSETS_FILENAME, mmap_mode="r"),
+    mel_index=mel_index,
+    lengths=np.load(export_dir / LENGTHS_FILENAME, mmap_mode="r"),
+    length_order=np.load(export_dir / LENGTH_ORDER_FILENAME, mmap_mode="r"),
+    mel_shards=[
+      np.load(export_dir / MEL_SHARD_FILENAME.format(i), mmap_mode="r")
+      for i in range(shards_count)
+    ],
+  )
+  return result
+
+
+def _save_shard(export_dir: Path, shard_nr: int, shard_buffer: List[np.ndarray]) -> None:
+  np.save(export_dir / MEL_SHARD_FILENAME.format(shard_nr), np.concatenate(shard_buffer, axis=0))
+
+
+def _save_json(path: Path, values: List[str]) -> None:
+  with path.open(mode="w", encoding="utf-8") as file:
+    json.dump(values, file, ensure_ascii=False, indent=2)
+
+
+def _load_json(path: Path) -> List[str]:
+  with path.open(mode="r", encoding="utf-8") as file:
+    return json.load(file)
@@ -0,0 +1,138 @@
+"""
+input: the wav and the STFT magnitudes of the mel computation
+output: frame-level energy and F0, one array per entry next to its mel
+"""
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import torch
+from speech_dataset_preprocessing.core.pcm import to_float
+from torch import Tensor
+
+# the features of an entry are saved as (2, frames) float32 array, they have the frames of its mel
+FEATURES_FILE_SUFFIX = "_features.npy"
+ENERGY_INDEX = 0
+F0_INDEX = 1
+
+DEFAULT_F0_MIN = 65.0
+DEFAULT_F0_MAX = 800.0
+DEFAULT_F0_THRESHOLD = 0.15
+# the frames are estimated in blocks of this count to limit the memory of long wavs
+DEFAULT_F0_BLOCK_FRAMES = 2 ** 12
+
+
+@dataclass()
+class F0Config:
+  f0_min: float = DEFAULT_F0_MIN
+  f0_max: float = DEFAULT_F0_MAX
+  # the maximum normalized difference at which a frame is voiced
+  threshold: float = DEFAULT_F0_THRESHOLD
+
+
+def get_features_relative_path(mel_relative_path: Path) -> Path:
+  # the features are saved in the chunk directory of the mel, i.e. they are moved with it on merging shards
+  return mel_relative_path.parent / f"{mel_relative_path.stem}{FEATURES_FILE_SUFFIX}"
+
+
+def get_features_array(energy: np.ndarray, f0: np.ndarray) -> np.ndarray:
+  assert energy.shape == f0.shape
+  return np.stack([energy, f0]).astype(np.float32, copy=False)
+
+
+def save_features_array(absolute_path: Path, features: np.ndarray) -> None:
+  assert features.shape[0] == 2
+  np.save(absolute_path, features)
+
+
+def load_features_array(absolute_path: Path) -> np.ndarray:
+  return np.load(absolute_path, mmap_mode="r")
+
+
+def get_energy(magnitudes: Tensor) -> Tensor:
+  # the L2 norm of the linear magnitudes per frame, the magnitudes have the shape (batch, bins, frames)
+  return torch.norm(magnitudes, dim=1)
+
+
+def get_frame_windows(wav: np.ndarray, first_frame: int, end_frame: int, hop_length: int, frame_length: int) -> np.ndarray:
+  # the frames are centered like the ones of the STFT, the wav is reflected at its borders
+  # only the samples of the frames are read, i.e. a memory-mapped wav isn't read completely
+  n_samples = wav.shape[0]
+  centers = np.arange(first_frame, end_frame) * hop_length
+  indices = centers[:, None] + np.arange(frame_length) - frame_length // 2
+  indices = np.abs(indices)
+  indices = np.where(indices >= n_samples, 2 * (n_samples - 1) - indices, indices)
+  indices = np.clip(indices, 0, n_samples - 1)
+  return to_float(wav[indices])
+
+
+def get_cumulative_mean_normalized_difference(frames: np.ndarray, max_lag: int) -> np.ndarray:
+  # the difference function of YIN for all frames at once, the autocorrelations are computed by FFT
+  n_frames, frame_length = frames.shape
+  window = frame_length - max_lag
+  assert window > 0
+  n_fft = 1 << int(np.ceil(np.log2(frame_length + window)))
+  spectrum = np.fft.rfft(frames, n=n_fft, axis=1)
+  window_spectrum = np.fft.rfft(frames[:, :window], n=n_fft, axis=1)
+  correlations = np.fft.irfft(spectrum * np.conj(window_spectrum), n=n_fft, axis=1)[:, :max_lag + 1]
+  cumulative_energy = np.concatenate(
+    [np.zeros((n_frames, 1)), np.cumsum(np.square(frames), axis=1)], axis=1)
+  lags = np.arange(max_lag + 1)
+  energies = cumulative_energy[:, lags + window] - cumulative_energy[:, lags]
+  differences = energies[:, :1] + energies - 2 * correlations
+  # differences within the rounding errors of the FFT are 0, e.g. for constant frames
+  differences = np.where(differences > 1e-9 * energies[:, :1], differences, 0.0)
+
+  result = np.ones_like(differences)
+  cumulative_differences = np.cumsum(differences[:, 1:], axis=1)
+  with np.errstate(divide="ignore", invalid="ignore"):
+    normalized = differences[:, 1:] * lags[1:] / cumulative_differences
+  # silent frames have no differences at all
+  result[:, 1:] = np.where(cumulative_differences > 0, normalized, 1.0)
+  return result
+
+
+def get_f0_from_differences(differences: np.ndarray, min_lag: int, sampling_rate: int, threshold: float) -> np.ndarray:
+  # the first lag below the threshold at which the difference stops falling is the period, unvoiced frames get 0
+  n_frames, n_lags = differences.shape
+  max_lag = n_lags - 1
+  lags = np.arange(n_lags)
+  next_differences = np.concatenate([differences[:, 1:], np.full((n_frames, 1), np.inf)], axis=1)
+  is_candidate = (differences < threshold) & (differences <= next_differences) & (lags >= min_lag)
+  is_voiced = is_candidate.any(axis=1)
+  periods = np.argmax(is_candidate, axis=1)
+
+  # the period is refined by a parabola through the neighbouring differences
+  rows = np.arange(n_frames)
+  previous_lags = np.maximum(periods - 1, 0)
+  next_lags = np.minimum(periods + 1, max_lag)
+  left = differences[rows, previous_lags]
+  center = differences[rows, periods]
+  right = differences[rows, next_lags]
+  curvature = left - 2 * center + right
+  with np.errstate(divide="ignore", invalid="ignore"):
+    shifts = np.where(curvature > 0, 0.5 * (left - right) / curvature, 0.0)
+  refined_periods = periods + np.clip(shifts, -0.5, 0.5)
+
+  result = np.zeros(n_frames, dtype=np.float64)
+  result[is_voiced] = sampling_rate / refined_periods[is_voiced]
+  return result
+
+
+def estimate_f0(wav: np.ndarray, sampling_rate: int, hop_length: int, frame_length: int, config: F0Config, block_frames: int = DEFAULT_F0_BLOCK_FRAMES) -> np.ndarray:
+  # YIN on frames of the length of the STFT, i.e. the F0 has the frames of the mel
+  assert config.f0_min > 0 and config.f0_max > config.f0_min
+  n_samples = wav.shape[0]
+  n_frames = n_samples // hop_length + 1
+  max_lag = min(int(sampling_rate / config.f0_min), frame_length // 2)
+  min_lag = max(1, int(sampling_rate / config.f0_max))
+  result = np.zeros(n_frames, dtype=np.float32)
+  if n_samples == 0:
+    return result
+  for first_frame in range(0, n_frames, block_frames):
+    end_frame = min(first_frame + block_frames, n_frames)
+    frames = get_frame_windows(wav, first_frame, end_frame, hop_length, frame_length)
+    differences = get_cumulative_mean_normalized_difference(frames, max_lag)
+    result[first_frame:end_frame] = get_f0_from_differences(
+      differences, min_lag, sampling_rate, config.threshold)
+  return result
@@ -0,0 +1,125 @@
+"""
+input: ds, wav, mel, text or final data
+output: the subset of the data which fulfills all given predicates, the audio files are referenced and not copied
+"""
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Set
+
+from speech_dataset_preprocessing.core.ds import (DsDataList,
+                                                  iterate_with_ds_data)
+from speech_dataset_preprocessing.core.final import FinalDsEntry
+from speech_dataset_preprocessing.core.mel import MelData, MelDataList
+from speech_dataset_preprocessing.core.text import TextData, TextDataList
+from speech_dataset_preprocessing.core.wav import WavData, WavDataList
+from text_utils import Language, Speaker
+
+
+@dataclass()
+class EntryFilter:
+  speakers: Optional[Set[Speaker]] = None
+  languages: Optional[Set[Language]] = None
+  min_duration_s: Optional[float] = None
+  max_duration_s: Optional[float] = None
+  min_symbols: Optional[int] = None
+  max_symbols: Optional[int] = None
+  excluded_entry_ids: Optional[Set[int]] = None
+
+  @property
+  def uses_duration(self) -> bool:
+    return self.min_duration_s is not None or self.max_duration_s is not None
+
+  @property
+  def uses_symbols(self) -> bool:
+    return self.min_symbols is not None or self.max_symbols is not None
+
+  def keep(self, entry_id: int, speaker: Speaker, language: Language, duration_s: Optional[float], n_symbols: Optional[int]) -> bool:
+    if self.excluded_entry_ids is not None and entry_id in self.excluded_entry_ids:
+      return False
+    if self.speakers is not None and speaker not in self.speakers:
+      return False
+    if self.languages is not None and language not in self.languages:
+      return False
+    if self.uses_duration:
+      if duration_s is None:
+        raise ValueError("The duration is not available for this data.")
+      if self.min_duration_s is not None and duration_s < self.min_duration_s:
+        return False
+      if self.max_duration_s is not None and duration_s > self.max_duration_s:
+        return False
+    if self.uses_symbols:
+      if n_symbols is None:
+        raise ValueError("The symbols are not available for this data.")
+      if self.min_symbols is not None and n_symbols < self.min_symbols:
+        return False
+      if self.max_symbols is not None and n_symbols > self.max_symbols:
+        return False
+    return True
+
+
+def filter_final_entries(entries: Iterable[FinalDsEntry], entry_filter: EntryFilter) -> Iterator[FinalDsEntry]:
+  for entry in entries:
+    if entry_filter.keep(entry.entry_id, entry.speaker_name, entry.symbols_language, entry.wav_duration, len(entry.symbols)):
+      yield entry
+
+
+def filter_ds_data(data: DsDataList, entry_filter: EntryFilter) -> DsDataList:
+  result = DsDataList(
+    entry for entry in data.items()
+    if entry_filter.keep(entry.entry_id, entry.speaker_name, entry.symbols_language, None, len(entry.symbols))
+  )
+  return result
+
+
+def filter_text_data(ds_data: DsDataList, data: TextDataList, entry_filter: EntryFilter) -> TextDataList:
+  result = TextDataList()
+  for ds_entry, entry in iterate_with_ds_data(ds_data, data.items()):
+    if entry_filter.keep(entry.entry_id, ds_entry.speaker_name, entry.symbols_language, None, len(entry.symbols)):
+      result.append(TextData(
+        entry_id=entry.entry_id,
+        symbols=entry.symbols,
+        symbols_language=entry.symbols_language,
+        symbols_format=entry.symbols_format,
+      ))
+  return result
+
+
+def get_referencing_path(orig_dir: Path, relative_path: Path, dest_dir: Path) -> Path:
+  # the path is relative to the destination, so that the dataset folder can still be moved
+  return Path(os.path.relpath(orig_dir / relative_path, dest_dir))
+
+
+def filter_wav_data(ds_data: DsDataList, data: WavDataList, entry_filter: EntryFilter, orig_dir: Path, dest_dir: Path) -> WavDataList:
+  result = WavDataList()
+  for ds_entry, entry in iterate_with_ds_data(ds_data, data.items()):
+    if entry_filter.keep(entry.entry_id, ds_entry.speaker_name, ds_entry.symbols_language, entry.wav_duration, None):
+      result.append(WavData(
+        entry_id=entry.entry_id,
+        wav_relative_path=get_referencing_path(orig_dir, entry.wav_relative_path, dest_dir),
+        wav_duration=entry.wav_duration,
+        wav_sampling_rate=entry.wav_sampling_rate,
+        wav_n_samples=entry.wav_n_samples,
+        source_entry_id=entry.source_entry_id,
+        source_start_s=entry.source_start_s,
+        wav_shard=entry.wav_shard,
+      ))
+  return result
+
+
+def filter_mel_data(data: MelDataList, entry_ids: Set[int], orig_dir: Path, dest_dir: Path) -> MelDataList:
+  result = MelDataList(
+    MelData(
+      entry_id=entry.entry_id,
+      mel_relative_path=get_referencing_path(orig_dir, entry.mel_relative_path, dest_dir),
+      mel_n_channels=entry.mel_n_channels,
+      mel_encoding=entry.mel_encoding,
+      mel_n_frames=entry.mel_n_frames,
+      # the features are next to the referenced mel
+      has_features=entry.has_features,
+      source_entry_id=entry.source_entry_id,
+    )
+    for entry in data.items()
+    if entry.entry_id in entry_ids
+  )
+  return result
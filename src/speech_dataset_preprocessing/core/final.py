@@ -1,12 +1,20 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from itertools import islice
 from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+import numpy as np
 from general_utils import GenericList
 from pandas import DataFrame
-from speech_dataset_preprocessing.core.ds import DsDataList
-from speech_dataset_preprocessing.core.mel import MelDataList
-from speech_dataset_preprocessing.core.text import TextDataList
-from speech_dataset_preprocessing.core.wav import WavDataList
+from scipy.io.wavfile import read
+from speech_dataset_preprocessing.core.ds import (DsData, DsDataList,
+                                                  assert_is_ds_entry)
+from speech_dataset_preprocessing.core.mel import (MelData, MelDataList,
+                                                   MelEncoding, load_mel_array)
+from speech_dataset_preprocessing.core.packed import (WavShardReference,
+                                                      read_packed_wav)
+from speech_dataset_preprocessing.core.text import TextData, TextDataList
+from speech_dataset_preprocessing.core.wav import WavData, WavDataList
 from text_utils import Gender, Language, Speaker, SymbolFormat, Symbols
 
 
@@ -27,13 +35,48 @@ class FinalDsEntry():
   wav_sampling_rate: int
   mel_absolute_path: Path
   mel_n_channels: int
+  mel_encoding: MelEncoding = MelEncoding.PT
+  # are None for data which was created before the counts were recorded
+  wav_n_samples: Optional[int] = None
+  mel_n_frames: Optional[int] = None
+  # is set if the wav is contained in a packed store, the wav path is the one of the shard then
+  wav_shard: Optional[WavShardReference] = None
+
+  def load_mel(self) -> np.ndarray:
+    return load_mel_array(self.mel_absolute_path, self.mel_encoding)
+
+  def load_wav(self) -> Tuple[int, np.ndarray]:
+    if self.wav_shard is None:
+      return read(self.wav_absolute_path)
+    assert self.wav_n_samples is not None
+    return self.wav_sampling_rate, read_packed_wav(self.wav_absolute_path, self.wav_shard, self.wav_n_samples)
 
 
 class FinalDsEntryList(GenericList[FinalDsEntry]):
   pass
 
 
-def get_analysis_df(data: FinalDsEntryList) -> DataFrame:
+ANALYSIS_COLUMNS = [
+  "Id",
+  "Basename",
+  "Speaker",
+  "Language",
+  "Original symbols",
+  "Original symbols format",
+  "Symbols",
+  "Symbols format",
+  "Wav duration (s)",
+  "Wav sampling rate (Hz)",
+  "# Wav samples",
+  "# Mel-channels",
+  "# Mel frames",
+  "Original wav-path",
+  "Wav-path",
+  "Mel-path",
+]
+
+
+def get_analysis_df(data: Iterable[FinalDsEntry]) -> DataFrame:
   values = [
     (
       entry.entry_id,
@@ -46,58 +89,166 @@ def get_analysis_df(data: FinalDsEntryList) -> DataFrame:
       repr(entry.symbols_format),
       entry.wav_duration,
       entry.wav_sampling_rate,
+      entry.wav_n_samples,
       entry.mel_n_channels,
+      entry.mel_n_frames,
       str(entry.wav_original_absolute_path),
       str(entry.wav_absolute_path),
       str(entry.mel_absolute_path),
-    ) for entry in data.items()
+    ) for entry in data
   ]
 
-  columns = [
-    "Id",
-    "Basename",
-    "Speaker",
-    "Language",
-    "Original symbols",
-    "Original symbols format",
-    "Symbols",
-    "Symbols format",
-    "Wav duration (s)",
-    "Wav sampling rate (Hz)",
-    "# Mel-channels",
-    "Original wav-path",
-    "Wav-path",
-    "Mel-path",
-  ]
-
-  result = DataFrame(data=values, columns=columns)
+  result = DataFrame(data=values, columns=ANALYSIS_COLUMNS)
   return result
 
 
-def get_final_ds_from_data(ds_data: DsDataList, text_data: TextDataList, wav_data: WavDataList, mel_data: MelDataList, wav_dir: Path, mel_dir: Path) -> FinalDsEntryList:
-  res = WavDataList()
-  for ds_data_entry, text_data_entry, wav_data_entry, mel_data_entry in zip(ds_data.items(), text_data.items(), wav_data.items(), mel_data.items()):
-    assert ds_data_entry.entry_id == text_data_entry.entry_id == wav_data_entry.entry_id == mel_data_entry.entry_id
-    assert ds_data_entry.symbols_language == text_data_entry.symbols_language
-
-    new_entry = FinalDsEntry(
-      entry_id=ds_data_entry.entry_id,
-      basename=ds_data_entry.basename,
-      speaker_gender=ds_data_entry.speaker_gender,
-      speaker_name=ds_data_entry.speaker_name,
-      symbols_language=ds_data_entry.symbols_language,
-      symbols_original=ds_data_entry.symbols,
-      symbols_original_format=ds_data_entry.symbols_format,
-      symbols=text_data_entry.symbols,
-      symbols_format=text_data_entry.symbols_format,
-      wav_original_absolute_path=ds_data_entry.wav_absolute_path,
-      wav_absolute_path=wav_dir / wav_data_entry.wav_relative_path,
-      wav_duration=wav_data_entry.wav_duration,
-      wav_sampling_rate=wav_data_entry.wav_sampling_rate,
-      mel_absolute_path=mel_dir / mel_data_entry.mel_relative_path,
-      mel_n_channels=mel_data_entry.mel_n_channels,
-    )
-
-    res.append(new_entry)
+def iterate_final_ds_entries(ds_data: Iterable[DsData], text_data: Iterable[TextData], wav_data: Iterable[WavData], mel_data: Iterable[MelData], wav_dir: Path, mel_dir: Path) -> Iterator[FinalDsEntry]:
+  # the stages need to be in the order of the ds data but can be filtered subsets of it, only entries which are contained in all stages are merged
+  # all entries are consumed once in order, i.e. they can be streamed from the saved stages
+  text_entries = iter(text_data)
+  wav_entries = iter(wav_data)
+  mel_entries = iter(mel_data)
+  text_data_entry = next(text_entries, None)
+  wav_data_entry = next(wav_entries, None)
+  mel_data_entry = next(mel_entries, None)
+
+  for ds_data_entry in ds_data:
+    entry_id = ds_data_entry.entry_id
+    for stage_entry in (wav_data_entry, mel_data_entry):
+      if stage_entry is not None:
+        assert_is_ds_entry(stage_entry)
+    is_in_text = text_data_entry is not None and text_data_entry.entry_id == entry_id
+    is_in_wav = wav_data_entry is not None and wav_data_entry.entry_id == entry_id
+    is_in_mel = mel_data_entry is not None and mel_data_entry.entry_id == entry_id
+
+    if is_in_text and is_in_wav and is_in_mel:
+      assert ds_data_entry.symbols_language == text_data_entry.symbols_language
+
+      new_entry = FinalDsEntry(
+        entry_id=ds_data_entry.entry_id,
+        basename=ds_data_entry.basename,
+        speaker_gender=ds_data_entry.speaker_gender,
+        speaker_name=ds_data_entry.speaker_name,
+        symbols_language=ds_data_entry.symbols_language,
+        symbols_original=ds_data_entry.symbols,
+        symbols_original_format=ds_data_entry.symbols_format,
+        symbols=text_data_entry.symbols,
+        symbols_format=text_data_entry.symbols_format,
+        wav_original_absolute_path=ds_data_entry.wav_absolute_path,
+        wav_absolute_path=wav_dir / wav_data_entry.wav_relative_path,
+        wav_duration=wav_data_entry.wav_duration,
+        wav_sampling_rate=wav_data_entry.wav_sampling_rate,
+        mel_absolute_path=mel_dir / mel_data_entry.mel_relative_path,
+        mel_n_channels=mel_data_entry.mel_n_channels,
+        mel_encoding=mel_data_entry.mel_encoding,
+        wav_n_samples=wav_data_entry.wav_n_samples,
+        mel_n_frames=mel_data_entry.mel_n_frames,
+        wav_shard=wav_data_entry.wav_shard,
+      )
+
+      yield new_entry
+
+    if is_in_text:
+      text_data_entry = next(text_entries, None)
+    if is_in_wav:
+      wav_data_entry = next(wav_entries, None)
+    if is_in_mel:
+      mel_data_entry = next(mel_entries, None)
+
+  for remaining_entry in (text_data_entry, wav_data_entry, mel_data_entry):
+    if remaining_entry is not None:
+      raise ValueError(
+        f"Entry {remaining_entry.entry_id} is not contained in the dataset or not in its order.")
+
+
+def iterate_final_ds_chunks(entries: Iterable[FinalDsEntry], chunk_size: int) -> Iterator[FinalDsEntryList]:
+  assert chunk_size > 0
+  iterator = iter(entries)
+  while True:
+    chunk = FinalDsEntryList(islice(iterator, chunk_size))
+    if len(chunk) == 0:
+      return
+    yield chunk
+
 
+def get_final_ds_from_data(ds_data: DsDataList, text_data: TextDataList, wav_data: WavDataList, mel_data: MelDataList, wav_dir: Path, mel_dir: Path) -> FinalDsEntryList:
+  entries = iterate_final_ds_entries(
+    ds_data=ds_data.items(),
+    text_data=text_data.items(),
+    wav_data=wav_data.items(),
+    mel_data=mel_data.items(),
+    wav_dir=wav_dir,
+    mel_dir=mel_dir,
+  )
+  res = FinalDsEntryList(entries)
   return res
+
+
+# (dataset name, entries) of each combined final dataset
+CombineSource = Tuple[str, Iterable[FinalDsEntry]]
+# (dataset name, original entry, combined entry)
+CombinedEntry = Tuple[str, FinalDsEntry, FinalDsEntry]
+
+
+def get_combined_speaker_name(ds_name: str, speaker: Speaker, prefix_speakers: bool) -> Speaker:
+  if not prefix_speakers:
+    return speaker
+  return f"{ds_name},{speaker}"
+
+
+def combine_final_entries(sources: Iterable[CombineSource], prefix_speakers: bool) -> Iterator[CombinedEntry]:
+  # the entry ids are numbered consecutively across the datasets, the paths still reference the files of each dataset
+  ds_names = set()
+  entry_id = 0
+  for ds_name, entries in sources:
+    if ds_name in ds_names:
+      raise ValueError(f"Dataset {ds_name} is contained more than once.")
+    ds_names.add(ds_name)
+    for entry in entries:
+      combined_entry = replace(
+        entry,
+        entry_id=entry_id,
+        speaker_name=get_combined_speaker_name(ds_name, entry.speaker_name, prefix_speakers),
+      )
+      yield ds_name, entry, combined_entry
+      entry_id += 1
+
+
+def get_mel_n_frames(entry: FinalDsEntry) -> int:
+  if entry.mel_n_frames is None:
+    raise ValueError(f"The count of mel frames of entry {entry.entry_id} is unknown, please recreate the mels.")
+  return entry.mel_n_frames
+
+
+def filter_by_lengths(entries: Iterable[FinalDsEntry], min_frames: Optional[int] = None, max_frames: Optional[int] = None, min_symbols: Optional[int] = None, max_symbols: Optional[int] = None) -> Iterator[FinalDsEntry]:
+  for entry in entries:
+    if min_frames is not None or max_frames is not None:
+      n_frames = get_mel_n_frames(entry)
+      if min_frames is not None and n_frames < min_frames:
+        continue
+      if max_frames is not None and n_frames > max_frames:
+        continue
+    n_symbols = len(entry.symbols)
+    if min_symbols is not None and n_symbols < min_symbols:
+      continue
+    if max_symbols is not None and n_symbols > max_symbols:
+      continue
+    yield entry
+
+
+def get_length_buckets(entries: Iterable[FinalDsEntry], boundaries: List[int]) -> Dict[int, List[int]]:
+  # bucket i contains the entry_ids with boundaries[i - 1] <= mel frames < boundaries[i]
+  assert list(boundaries) == sorted(boundaries)
+  entry_ids = []
+  n_frames = []
+  for entry in entries:
+    entry_ids.append(entry.entry_id)
+    n_frames.append(get_mel_n_frames(entry))
+
+  bucket_indices = np.digitize(np.array(n_frames, dtype=np.int64), boundaries, right=False)
+  result: Dict[int, List[int]] = {}
+  for bucket_index, entry_id in zip(bucket_indices.tolist(), entry_ids):
+    if bucket_index not in result:
+      result[bucket_index] = []
+    result[bucket_index].append(entry_id)
+  return result
@@ -2,51 +2,360 @@
 input: wav data
 output: mel data
 """
-from concurrent.futures.thread import ThreadPoolExecutor
+from concurrent.futures.process import ProcessPoolExecutor
 from dataclasses import dataclass
+from enum import Enum
 from functools import partial
+from itertools import islice
 from logging import getLogger
 from pathlib import Path
-from typing import Callable, Dict, Optional
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
 
+import numpy as np
+import torch
 from audio_utils.mel import TacotronSTFT, TSTFTHParams
 from general_utils import GenericList, overwrite_custom_hparams
-from speech_dataset_preprocessing.core.wav import WavData, WavDataList
+from speech_dataset_preprocessing.core.ds import get_ds_entry_id
+from speech_dataset_preprocessing.core.features import (F0Config, estimate_f0,
+                                                        get_energy,
+                                                        get_features_array)
+from speech_dataset_preprocessing.core.mel_stats import (MelStats,
+                                                         MelStatsAccumulator,
+                                                         get_mel_stats)
+from speech_dataset_preprocessing.core.pcm import to_float
+from speech_dataset_preprocessing.core.pipelined import (PipelineConfig,
+                                                         log_queue_metrics,
+                                                         run_pipelined)
+from speech_dataset_preprocessing.core.wav import (WavData, WavDataList,
+                                                   read_entry_wav)
 from torch import Tensor
 from tqdm import tqdm
 
 
+class MelEncoding(Enum):
+  PT = 0
+  NPY_FLOAT32 = 1
+  NPY_FLOAT16 = 2
+  NPZ_COMPRESSED = 3
+
+  def __str__(self) -> str:
+    return self.name
+
+
+MEL_FILE_EXTENSIONS = {
+  MelEncoding.PT: ".pt",
+  MelEncoding.NPY_FLOAT32: ".npy",
+  MelEncoding.NPY_FLOAT16: ".npy",
+  MelEncoding.NPZ_COMPRESSED: ".npz",
+}
+
+NPZ_MEL_KEY = "mel"
+
+DEFAULT_TUNE_ENTRIES_COUNT = 32
+# wavs with more samples than this count of frames are processed in blocks of it
+DEFAULT_BLOCK_FRAMES = 2 ** 14
+
+
+class MelProcessingMode(Enum):
+  # one parser shared by threads which overlap the I/O with the computation
+  THREADS = 0
+  # one parser per process, each process uses its own count of torch threads
+  PROCESSES = 1
+
+  def __str__(self) -> str:
+    return self.name
+
+
+@dataclass()
+class ProcessConfig:
+  n_processes: int
+  n_threads: int
+
+  def __str__(self) -> str:
+    return f"{self.n_processes} processes x {self.n_threads} torch threads"
+
+
 @dataclass()
 class MelData:
   entry_id: int
   mel_relative_path: Path
   mel_n_channels: int
+  # mels which were created before the encoding was recorded are torch files
+  mel_encoding: MelEncoding = MelEncoding.PT
+  # is None for data which was created before the count was recorded
+  mel_n_frames: Optional[int] = None
+  # the energy and F0 are saved next to the mel, they have its frames
+  has_features: bool = False
+  # is set for the mels of segments: the entry of the recording which was split
+  source_entry_id: Optional[int] = None
 
 
 class MelDataList(GenericList[MelData]):
   pass
 
 
-def process_entry(entry: WavData, wav_dir: Path, mel_parser: TacotronSTFT, save_callback: Callable[[WavData, Tensor], str]) -> MelData:
-  absolute_wav_path = wav_dir / entry.wav_relative_path
-  mel_tensor = mel_parser.get_mel_tensor_from_file(absolute_wav_path)
+def save_mel_array(absolute_path: Path, mel_tensor: Tensor, encoding: MelEncoding) -> None:
+  if encoding == MelEncoding.PT:
+    torch.save(mel_tensor, absolute_path)
+  elif encoding == MelEncoding.NPY_FLOAT32:
+    np.save(absolute_path, mel_tensor.numpy().astype(np.float32, copy=False))
+  elif encoding == MelEncoding.NPY_FLOAT16:
+    np.save(absolute_path, mel_tensor.numpy().astype(np.float16))
+  elif encoding == MelEncoding.NPZ_COMPRESSED:
+    np.savez_compressed(absolute_path, **{NPZ_MEL_KEY: mel_tensor.numpy()})
+  else:
+    assert False
+
+
+def load_mel_array(absolute_path: Path, encoding: MelEncoding) -> np.ndarray:
+  # npy files are memory-mapped, i.e. only the accessed parts are read from disk
+  if encoding == MelEncoding.PT:
+    return torch.load(absolute_path).numpy()
+  if encoding in {MelEncoding.NPY_FLOAT32, MelEncoding.NPY_FLOAT16}:
+    return np.load(absolute_path, mmap_mode="r")
+  if encoding == MelEncoding.NPZ_COMPRESSED:
+    with np.load(absolute_path) as data:
+      return data[NPZ_MEL_KEY]
+  assert False
+
+
+def pcm_to_float32(wav: np.ndarray) -> np.ndarray:
+  # integer samples are scaled by the maximum wav value, e.g. 32768 for 16 bit
+  return to_float(wav, np.float32)
+
+
+def get_mel_tensor_from_wav(wav: np.ndarray, mel_parser: TacotronSTFT) -> Tensor:
+  wav_tensor = torch.from_numpy(pcm_to_float32(wav)).unsqueeze(0)
+  mel_tensor = mel_parser.mel_spectrogram(wav_tensor).squeeze(0)
+  return mel_tensor
+
+
+def get_mel_and_energy_from_wav(wav: np.ndarray, mel_parser: TacotronSTFT) -> Tensor:
+  # the computation of mel_spectrogram with access to the magnitudes, i.e. the energy needs no second STFT
+  # the energy is appended to the mel as last row, so that the blocks of long wavs are computed like mels
+  wav_tensor = torch.from_numpy(pcm_to_float32(wav)).unsqueeze(0)
+  magnitudes, _ = mel_parser.stft_fn.transform(wav_tensor)
+  magnitudes = magnitudes.data
+  mel_output = mel_parser.spectral_normalize(torch.matmul(mel_parser.mel_basis, magnitudes))
+  energy = get_energy(magnitudes)
+  return torch.cat([mel_output, energy.unsqueeze(1)], dim=1).squeeze(0)
+
+
+def get_mel_tensor_in_blocks(wav: np.ndarray, mel_parser: TacotronSTFT, hop_length: int, filter_length: int, block_frames: int, compute_block: Callable[[np.ndarray, TacotronSTFT], Tensor] = get_mel_tensor_from_wav) -> Tensor:
+  # the frames are computed block by block from overlapping parts of the wav, so that only one block is converted to float at a time
+  # a block starts at a multiple of the hop length and contains the samples of the frames before and after it, the frames at the borders of a block which are affected by its reflection padding are dropped
+  # therefore every frame is computed from the same samples as in the computation of the whole wav at once
+  assert filter_length % 2 == 0
+  assert block_frames > 0
+  n_samples = wav.shape[0]
+  padding = filter_length // 2
+  n_frames = n_samples // hop_length + 1
+  context_frames = -(-padding // hop_length) + 1
+  result: Optional[Tensor] = None
+  for first_frame in range(0, n_frames, block_frames):
+    end_frame = min(first_frame + block_frames, n_frames)
+    start = max(0, (first_frame - context_frames) * hop_length)
+    end = min(n_samples, (end_frame - 1 + context_frames) * hop_length)
+    block_mel = compute_block(wav[start:end], mel_parser)
+    offset = first_frame - start // hop_length
+    if result is None:
+      result = torch.empty((block_mel.shape[0], n_frames), dtype=block_mel.dtype)
+    result[:, first_frame:end_frame] = block_mel[:, offset:offset + end_frame - first_frame]
+  assert result is not None
+  return result
+
+
+def is_long_wav(entry: WavData, hparams: TSTFTHParams, block_frames: Optional[int]) -> bool:
+  if block_frames is None:
+    return False
+  return entry.wav_duration * entry.wav_sampling_rate > block_frames * hparams.hop_length
+
+
+def read_wav(entry: WavData, wav_dir: Path, hparams: TSTFTHParams, block_frames: Optional[int] = None) -> Tuple[int, np.ndarray]:
+  # long wavs stay memory-mapped and are read block by block during the computation, the others are read completely here
+  sampling_rate, wav = read_entry_wav(entry, wav_dir)
+  if not is_long_wav(entry, hparams, block_frames):
+    wav = np.array(wav)
+  return sampling_rate, wav
+
+
+def compute_mel(entry: WavData, wav_read: Tuple[int, np.ndarray], mel_parser: TacotronSTFT, hparams: TSTFTHParams, block_frames: Optional[int] = None, compute_block: Callable[[np.ndarray, TacotronSTFT], Tensor] = get_mel_tensor_from_wav) -> Tensor:
+  wav_sampling_rate, wav = wav_read
+  if wav_sampling_rate != hparams.sampling_rate:
+    raise ValueError(f"Entry {entry.entry_id} has a sampling rate of {wav_sampling_rate}Hz but {hparams.sampling_rate}Hz are required.")
+  if block_frames is not None and wav.shape[0] > block_frames * hparams.hop_length:
+    return get_mel_tensor_in_blocks(wav, mel_parser, hparams.hop_length, hparams.filter_length, block_frames, compute_block)
+  return compute_block(wav, mel_parser)
+
+
+def compute_mel_and_features(entry: WavData, wav_read: Tuple[int, np.ndarray], mel_parser: TacotronSTFT, hparams: TSTFTHParams, f0_config: F0Config, block_frames: Optional[int] = None) -> Tuple[Tensor, np.ndarray]:
+  # the F0 is estimated on frames of the length and hop of the STFT, i.e. it has the frames of the mel
+  mel_and_energy = compute_mel(entry, wav_read, mel_parser, hparams,
+                               block_frames, get_mel_and_energy_from_wav)
+  # the mel is copied, otherwise the energy would be saved with the storage of a torch file
+  mel_tensor = mel_and_energy[:-1].clone()
+  energy = mel_and_energy[-1].numpy()
+  _, wav = wav_read
+  f0 = estimate_f0(wav, hparams.sampling_rate, hparams.hop_length, hparams.filter_length, f0_config)
+  return mel_tensor, get_features_array(energy, f0)
+
+
+def compute_entry(entry: WavData, wav_read: Tuple[int, np.ndarray], mel_parser: TacotronSTFT, hparams: TSTFTHParams, block_frames: Optional[int] = None, f0_config: Optional[F0Config] = None, stats: Optional[MelStatsAccumulator] = None) -> Tuple[Tensor, Optional[np.ndarray]]:
+  # the features are only computed if an F0 config is given
+  features = None
+  if f0_config is None:
+    mel_tensor = compute_mel(entry, wav_read, mel_parser, hparams, block_frames)
+  else:
+    mel_tensor, features = compute_mel_and_features(
+      entry, wav_read, mel_parser, hparams, f0_config, block_frames)
+  if stats is not None:
+    # the stats are accumulated by the computing threads, i.e. the mels are not read again for them
+    stats.add(get_ds_entry_id(entry), mel_tensor.numpy())
+  return mel_tensor, features
+
+
+def save_entry(entry: WavData, mel_tensor: Tensor, n_mel_channels: int, encoding: MelEncoding, save_callback: Callable[[WavData, Tensor], str], features: Optional[np.ndarray] = None, save_features_callback: Optional[Callable[[Path, np.ndarray], None]] = None) -> MelData:
   path = save_callback(wav_entry=entry, mel_tensor=mel_tensor)
-  mel_data = MelData(entry.entry_id, path, mel_parser.n_mel_channels)
+  mel_data = MelData(entry.entry_id, path, n_mel_channels,
+                     encoding, mel_tensor.shape[1], source_entry_id=entry.source_entry_id)
+  if features is not None:
+    assert save_features_callback is not None
+    # the path of the features is derived from the one of the mel
+    save_features_callback(mel_relative_path=path, features=features)
+    mel_data.has_features = True
   return mel_data
 
 
-def process(data: WavDataList, wav_dir: Path, custom_hparams: Optional[Dict[str, str]], save_callback: Callable[[WavData, Tensor], str], n_jobs: int) -> MelDataList:
+def save_computed_entry(entry: WavData, computed: Tuple[Tensor, Optional[np.ndarray]], n_mel_channels: int, encoding: MelEncoding, save_callback: Callable[[WavData, Tensor], str], save_features_callback: Optional[Callable[[Path, np.ndarray], None]] = None) -> MelData:
+  mel_tensor, features = computed
+  return save_entry(entry, mel_tensor, n_mel_channels, encoding, save_callback, features, save_features_callback)
+
+
+def process_entry(entry: WavData, wav_dir: Path, mel_parser: TacotronSTFT, hparams: TSTFTHParams, encoding: MelEncoding, save_callback: Callable[[WavData, Tensor], str], block_frames: Optional[int] = None, f0_config: Optional[F0Config] = None, save_features_callback: Optional[Callable[[Path, np.ndarray], None]] = None) -> MelData:
+  wav_read = read_wav(entry, wav_dir, hparams, block_frames)
+  mel_tensor, features = compute_entry(entry, wav_read, mel_parser, hparams, block_frames, f0_config)
+  return save_entry(entry, mel_tensor, mel_parser.n_mel_channels, encoding, save_callback, features, save_features_callback)
+
+
+def process(data: WavDataList, wav_dir: Path, custom_hparams: Optional[Dict[str, str]], save_callback: Callable[[WavData, Tensor], str], n_jobs: int, encoding: MelEncoding = MelEncoding.PT, pipeline_config: Optional[PipelineConfig] = None, block_frames: Optional[int] = DEFAULT_BLOCK_FRAMES, stats: Optional[MelStatsAccumulator] = None, f0_config: Optional[F0Config] = None, save_features_callback: Optional[Callable[[Path, np.ndarray], None]] = None) -> MelDataList:
+  # the wavs are read ahead and the mels are written while the next mels are computed
   hparams = TSTFTHParams()
   hparams = overwrite_custom_hparams(hparams, custom_hparams)
   mel_parser = TacotronSTFT(hparams, logger=getLogger())
-  mt_method = partial(
-    process_entry,
+  if pipeline_config is None:
+    pipeline_config = PipelineConfig(compute_jobs=n_jobs)
+
+  result, metrics = run_pipelined(
+    data.items(),
+    read=partial(read_wav, wav_dir=wav_dir, hparams=hparams, block_frames=block_frames),
+    compute=partial(compute_entry, mel_parser=mel_parser, hparams=hparams,
+                    block_frames=block_frames, f0_config=f0_config, stats=stats),
+    write=partial(save_computed_entry, n_mel_channels=mel_parser.n_mel_channels, encoding=encoding,
+                  save_callback=save_callback, save_features_callback=save_features_callback),
+    config=pipeline_config,
+    total=len(data),
+  )
+  log_queue_metrics(metrics)
+
+  return MelDataList(result)
+
+
+# the parser of a worker process, it is created once by the initializer
+_worker_mel_parser: Optional[TacotronSTFT] = None
+
+
+def _init_worker(hparams: TSTFTHParams, n_threads: int) -> None:
+  global _worker_mel_parser
+  torch.set_num_threads(n_threads)
+  _worker_mel_parser = TacotronSTFT(hparams, logger=getLogger())
+
+
+def _process_entry_in_worker(entry: WavData, wav_dir: Path, hparams: TSTFTHParams, encoding: MelEncoding, save_callback: Callable[[WavData, Tensor], str], block_frames: Optional[int], f0_config: Optional[F0Config], save_features_callback: Optional[Callable[[Path, np.ndarray], None]]) -> MelData:
+  assert _worker_mel_parser is not None
+  return process_entry(entry, wav_dir, _worker_mel_parser, hparams, encoding, save_callback, block_frames, f0_config, save_features_callback)
+
+
+def _process_entry_with_stats_in_worker(entry: WavData, wav_dir: Path, hparams: TSTFTHParams, encoding: MelEncoding, save_callback: Callable[[WavData, Tensor], str], block_frames: Optional[int], f0_config: Optional[F0Config], save_features_callback: Optional[Callable[[Path, np.ndarray], None]]) -> Tuple[MelData, MelStats]:
+  # the stats of the entry are returned with its data and accumulated in the main process
+  assert _worker_mel_parser is not None
+  wav_read = read_wav(entry, wav_dir, hparams, block_frames)
+  mel_tensor, features = compute_entry(entry, wav_read, _worker_mel_parser, hparams, block_frames, f0_config)
+  mel_data = save_entry(entry, mel_tensor, _worker_mel_parser.n_mel_channels,
+                        encoding, save_callback, features, save_features_callback)
+  return mel_data, get_mel_stats(mel_tensor.numpy())
+
+
+def _compute_entry_in_worker(entry: WavData, wav_dir: Path, hparams: TSTFTHParams, block_frames: Optional[int]) -> int:
+  assert _worker_mel_parser is not None
+  wav_read = read_wav(entry, wav_dir, hparams, block_frames)
+  mel_tensor = compute_mel(entry, wav_read, _worker_mel_parser, hparams, block_frames)
+  return mel_tensor.shape[1]
+
+
+def get_process_config_candidates(n_cores: int) -> List[ProcessConfig]:
+  # all cores are used: n_processes * n_threads == n_cores (rounded down)
+  assert n_cores > 0
+  result = []
+  n_threads = 1
+  while n_threads <= n_cores:
+    result.append(ProcessConfig(n_cores // n_threads, n_threads))
+    n_threads *= 2
+  return result
+
+
+def tune_process_config(data: WavDataList, wav_dir: Path, hparams: TSTFTHParams, n_cores: int, block_frames: Optional[int], entries_count: int = DEFAULT_TUNE_ENTRIES_COUNT) -> ProcessConfig:
+  # each candidate computes the mels of the same entries without saving them, the one with the highest throughput is taken
+  logger = getLogger(__name__)
+  entries = list(islice(data.items(), entries_count))
+  method = partial(_compute_entry_in_worker, wav_dir=wav_dir,
+                   hparams=hparams, block_frames=block_frames)
+  best_config = None
+  best_duration = None
+  for config in get_process_config_candidates(n_cores):
+    with ProcessPoolExecutor(max_workers=config.n_processes, initializer=_init_worker, initargs=(hparams, config.n_threads)) as ex:
+      # the first entries warm up all processes, i.e. the start of the processes is not measured
+      list(ex.map(method, entries[:config.n_processes]))
+      start = perf_counter()
+      list(ex.map(method, entries))
+      duration = perf_counter() - start
+    logger.info(f"{config}: {duration:.2f}s")
+    if best_duration is None or duration < best_duration:
+      best_config = config
+      best_duration = duration
+  assert best_config is not None
+  return best_config
+
+
+def process_with_processes(data: WavDataList, wav_dir: Path, custom_hparams: Optional[Dict[str, str]], save_callback: Callable[[WavData, Tensor], str], n_cores: int, encoding: MelEncoding = MelEncoding.PT, config: Optional[ProcessConfig] = None, block_frames: Optional[int] = DEFAULT_BLOCK_FRAMES, stats: Optional[MelStatsAccumulator] = None, f0_config: Optional[F0Config] = None, save_features_callback: Optional[Callable[[Path, np.ndarray], None]] = None) -> MelDataList:
+  # the save callbacks need to be picklable, e.g. a partial of a module-level function
+  logger = getLogger(__name__)
+  hparams = TSTFTHParams()
+  hparams = overwrite_custom_hparams(hparams, custom_hparams)
+  if config is None:
+    logger.info("Tuning the count of processes and threads...")
+    config = tune_process_config(data, wav_dir, hparams, n_cores, block_frames)
+  logger.info(f"Using {config}.")
+
+  method = partial(
+    _process_entry_in_worker if stats is None else _process_entry_with_stats_in_worker,
     wav_dir=wav_dir,
-    mel_parser=mel_parser,
+    hparams=hparams,
+    encoding=encoding,
     save_callback=save_callback,
+    block_frames=block_frames,
+    f0_config=f0_config,
+    save_features_callback=save_features_callback,
   )
-
-  with ThreadPoolExecutor(max_workers=n_jobs) as ex:
-    result = MelDataList(tqdm(ex.map(mt_method, data.items()), total=len(data)))
+  chunksize = max(1, len(data) // (config.n_processes * 16))
+  with ProcessPoolExecutor(max_workers=config.n_processes, initializer=_init_worker, initargs=(hparams, config.n_threads)) as ex:
+    results = tqdm(ex.map(method, data.items(), chunksize=chunksize), total=len(data))
+    if stats is None:
+      result = MelDataList(results)
+    else:
+      result = MelDataList()
+      for mel_data, entry_stats in results:
+        stats.add_stats(get_ds_entry_id(mel_data), entry_stats)
+        result.append(mel_data)
 
   return result
@@ -0,0 +1,86 @@
+"""
+input: mels while they are computed
+output: the mean and standard deviation of every mel channel, overall and per speaker, without reading the mels again
+"""
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from text_utils import Speaker
+
+
+@dataclass()
+class MelStats:
+  # the sums over all frames per channel, the mean and variance are derived from them
+  n_frames: int
+  sums: np.ndarray
+  squared_sums: np.ndarray
+
+
+@dataclass()
+class SpeakerMelStats:
+  overall: Optional[MelStats] = None
+  speakers: Dict[Speaker, MelStats] = field(default_factory=dict)
+
+
+def get_mel_stats(mel: np.ndarray) -> MelStats:
+  # the mel has the shape (channels, frames), the sums are accumulated in float64 to keep them exact over many frames
+  mel = np.asarray(mel)
+  sums = np.sum(mel, axis=1, dtype=np.float64)
+  squared_sums = np.einsum("ij,ij->i", mel, mel, dtype=np.float64)
+  return MelStats(mel.shape[1], sums, squared_sums)
+
+
+def merge_mel_stats(stats: Optional[MelStats], other: MelStats) -> MelStats:
+  if stats is None:
+    return MelStats(other.n_frames, other.sums.copy(), other.squared_sums.copy())
+  assert stats.sums.shape == other.sums.shape
+  return MelStats(stats.n_frames + other.n_frames, stats.sums + other.sums, stats.squared_sums + other.squared_sums)
+
+
+def merge_speaker_mel_stats(parts: Iterable[SpeakerMelStats]) -> SpeakerMelStats:
+  # e.g. the stats of shards
+  result = SpeakerMelStats()
+  for part in parts:
+    if part.overall is not None:
+      result.overall = merge_mel_stats(result.overall, part.overall)
+    for speaker, stats in part.speakers.items():
+      result.speakers[speaker] = merge_mel_stats(result.speakers.get(speaker), stats)
+  return result
+
+
+def get_mean_and_std(stats: MelStats) -> Tuple[np.ndarray, np.ndarray]:
+  assert stats.n_frames > 0
+  mean = stats.sums / stats.n_frames
+  # rounding can make the variance of constant channels slightly negative
+  variance = np.maximum(stats.squared_sums / stats.n_frames - np.square(mean), 0.0)
+  return mean, np.sqrt(variance)
+
+
+class MelStatsAccumulator():
+  # is shared by the threads which compute the mels, the stats of an entry are computed outside of the lock
+  def __init__(self, speakers: Optional[Dict[int, Speaker]] = None) -> None:
+    # the speakers by ds entry id, only the overall stats are accumulated without them
+    self.speakers = speakers
+    self._lock = Lock()
+    self._result = SpeakerMelStats()
+
+  def add(self, ds_entry_id: int, mel: np.ndarray) -> None:
+    self.add_stats(ds_entry_id, get_mel_stats(mel))
+
+  def add_stats(self, ds_entry_id: int, stats: MelStats) -> None:
+    # the id is the one of the ds entry, e.g. the one of the split entry for segments
+    speaker = None
+    if self.speakers is not None:
+      if ds_entry_id not in self.speakers:
+        raise ValueError(f"Entry {ds_entry_id} is not contained in the dataset, therefore its speaker is unknown.")
+      speaker = self.speakers[ds_entry_id]
+    with self._lock:
+      self._result.overall = merge_mel_stats(self._result.overall, stats)
+      if speaker is not None:
+        self._result.speakers[speaker] = merge_mel_stats(self._result.speakers.get(speaker), stats)
+
+  def get_stats(self) -> SpeakerMelStats:
+    with self._lock:
+      return self._result
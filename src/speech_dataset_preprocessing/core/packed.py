@@ -0,0 +1,87 @@
+"""
+input: wavs
+output: shards of raw PCM which contain the samples of many entries, each entry references its range in a shard
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from typing import BinaryIO, Optional, Tuple
+
+import numpy as np
+from speech_dataset_preprocessing.core.pcm import from_float, to_float
+
+PACKED_DTYPES = ("int16", "float32")
+# the samples are stored without header in the native byte order, interleaved if there are multiple channels
+WAV_SHARD_FILENAME = "wavs_{}.pcm"
+
+DEFAULT_SHARD_SAMPLES = 2 ** 28
+
+
+@dataclass()
+class WavShardReference:
+  # the position of the first sample of the entry in the shard, the samples of all channels are counted
+  offset: int
+  dtype: str
+  n_channels: int = 1
+
+
+def to_packed_dtype(wav: np.ndarray, dtype: np.dtype) -> np.ndarray:
+  # integer samples are scaled by the maximum wav value, e.g. 32768 for 16 bit, like for the mel computation
+  if wav.dtype == dtype:
+    return wav
+  return from_float(to_float(wav), dtype)
+
+
+def read_packed_wav(shard_path: Path, shard: WavShardReference, n_samples: int) -> np.ndarray:
+  # the range is memory-mapped, i.e. slicing it doesn't copy anything
+  dtype = np.dtype(shard.dtype)
+  shape = (n_samples,) if shard.n_channels == 1 else (n_samples, shard.n_channels)
+  if n_samples == 0:
+    return np.zeros(shape, dtype=dtype)
+  return np.memmap(shard_path, dtype=dtype, mode="r", offset=shard.offset * dtype.itemsize, shape=shape)
+
+
+class PackedWavWriter():
+  # the entries are appended in the order in which they are written, so it can be shared by threads
+  # a new shard is started as soon as the current one contains at least shard_samples samples
+  def __init__(self, dest_dir: Path, dtype: np.dtype, shard_samples: int = DEFAULT_SHARD_SAMPLES) -> None:
+    assert str(dtype) in PACKED_DTYPES
+    assert shard_samples > 0
+    self.dest_dir = dest_dir
+    self.dtype = np.dtype(dtype)
+    self.shard_samples = shard_samples
+    self._lock = Lock()
+    self._shard_nr = 0
+    self._shard_offset = 0
+    self._file: Optional[BinaryIO] = None
+
+  def write(self, entry_id: int, sampling_rate: int, wav: np.ndarray) -> Tuple[Path, Optional[WavShardReference]]:
+    # the conversion happens outside of the lock, only the appending is serialized
+    samples = np.ascontiguousarray(to_packed_dtype(wav, self.dtype))
+    n_channels = 1 if samples.ndim == 1 else samples.shape[1]
+    with self._lock:
+      if self._file is not None and self._shard_offset >= self.shard_samples:
+        self._file.close()
+        self._file = None
+        self._shard_nr += 1
+        self._shard_offset = 0
+      relative_shard_path = Path(WAV_SHARD_FILENAME.format(self._shard_nr))
+      if self._file is None:
+        self._file = (self.dest_dir / relative_shard_path).open(mode="wb")
+      offset = self._shard_offset
+      self._file.write(samples.data)
+      self._shard_offset += samples.size
+    shard = WavShardReference(offset, str(self.dtype), n_channels)
+    return relative_shard_path, shard
+
+  def close(self) -> None:
+    with self._lock:
+      if self._file is not None:
+        self._file.close()
+        self._file = None
+
+  def __enter__(self) -> "PackedWavWriter":
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
@@ -0,0 +1,42 @@
+"""
+input: wav samples of any dtype
+output: the samples as floats in [-1, 1] and back, so that all stages scale integer wavs the same way
+"""
+import numpy as np
+
+
+def get_full_scale(dtype: np.dtype) -> float:
+  # the half of the integer range, e.g. 32768 for int16 and 128 for uint8, floats are already in [-1, 1]
+  if np.issubdtype(dtype, np.integer):
+    info = np.iinfo(dtype)
+    return (float(info.max) - float(info.min) + 1) / 2
+  return 1.0
+
+
+def get_zero_level(dtype: np.dtype) -> float:
+  # unsigned samples are centred in their range, e.g. at 128 for uint8
+  if np.issubdtype(dtype, np.unsignedinteger):
+    return get_full_scale(dtype)
+  return 0.0
+
+
+def get_max_level(dtype: np.dtype) -> float:
+  # the largest float which is converted without clipping, e.g. 32767 / 32768 for int16
+  if np.issubdtype(dtype, np.integer):
+    return (float(np.iinfo(dtype).max) - get_zero_level(dtype)) / get_full_scale(dtype)
+  return 1.0
+
+
+def to_float(wav: np.ndarray, dtype: np.dtype = np.float64) -> np.ndarray:
+  if np.issubdtype(wav.dtype, np.integer):
+    return (wav.astype(dtype) - get_zero_level(wav.dtype)) / get_full_scale(wav.dtype)
+  return wav.astype(dtype, copy=False)
+
+
+def from_float(wav: np.ndarray, dtype: np.dtype) -> np.ndarray:
+  # integer samples are rounded and clipped to the range of the dtype
+  if np.issubdtype(dtype, np.integer):
+    info = np.iinfo(dtype)
+    scaled = np.round(wav * get_full_scale(dtype) + get_zero_level(dtype))
+    return np.clip(scaled, info.min, info.max).astype(dtype)
+  return wav.astype(dtype, copy=False)
@@ -0,0 +1,174 @@
+"""
+input: a specification of stages, i.e. CLI commands with their arguments
+output: the stages as a DAG which is executed with independent branches running concurrently
+"""
+import hashlib
+import json
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+DEFAULT_PIPELINE_JOBS = 2
+
+DS = "ds"
+WAV = "wav"
+TEXT = "text"
+MEL = "mel"
+FINAL = "final"
+EXPORT = "export"
+
+# (kind, ds name, name), the name of a dataset artifact is empty
+Artifact = Tuple[str, str, str]
+# (kind, argument which contains the name)
+ArtifactArgument = Tuple[str, str]
+
+_DS_ARGUMENT: ArtifactArgument = (DS, "ds_name")
+
+# the artifacts which a command reads and the one which it writes
+COMMAND_ARTIFACTS: Dict[str, Tuple[List[ArtifactArgument], ArtifactArgument]] = {
+  "preprocess-generic": ([], _DS_ARGUMENT),
+  "preprocess-ljs": ([], _DS_ARGUMENT),
+  "preprocess-mailabs": ([], _DS_ARGUMENT),
+  "preprocess-arctic": ([], _DS_ARGUMENT),
+  "preprocess-libritts": ([], _DS_ARGUMENT),
+  "preprocess-thchs": ([], _DS_ARGUMENT),
+  "preprocess-thchs-kaldi": ([], _DS_ARGUMENT),
+  "ds-filter": ([_DS_ARGUMENT], (DS, "dest_ds_name")),
+  "preprocess-wavs": ([_DS_ARGUMENT], (WAV, "wav_name")),
+  "wavs-normalize": ([_DS_ARGUMENT, (WAV, "orig_wav_name")], (WAV, "dest_wav_name")),
+  "wavs-resample": ([_DS_ARGUMENT, (WAV, "orig_wav_name")], (WAV, "dest_wav_name")),
+  "wavs-stereo-to-mono": ([_DS_ARGUMENT, (WAV, "orig_wav_name")], (WAV, "dest_wav_name")),
+  "wavs-convert": ([_DS_ARGUMENT, (WAV, "orig_wav_name")], (WAV, "dest_wav_name")),
+  "wavs-remove-silence": ([_DS_ARGUMENT, (WAV, "orig_wav_name")], (WAV, "dest_wav_name")),
+  "wavs-segment": ([_DS_ARGUMENT, (WAV, "orig_wav_name")], (WAV, "dest_wav_name")),
+  "preprocess-text": ([_DS_ARGUMENT], (TEXT, "text_name")),
+  "text-normalize": ([_DS_ARGUMENT, (TEXT, "orig_text_name")], (TEXT, "dest_text_name")),
+  "text-change-text": ([_DS_ARGUMENT, (TEXT, "orig_text_name")], (TEXT, "dest_text_name")),
+  "text-ipa": ([_DS_ARGUMENT, (TEXT, "orig_text_name")], (TEXT, "dest_text_name")),
+  "text-change-ipa": ([_DS_ARGUMENT, (TEXT, "orig_text_name")], (TEXT, "dest_text_name")),
+  "text-arpa-to-ipa": ([_DS_ARGUMENT, (TEXT, "orig_text_name")], (TEXT, "dest_text_name")),
+  "preprocess-mels": ([_DS_ARGUMENT, (WAV, "wav_name")], (MEL, "wav_name")),
+  "merge": ([_DS_ARGUMENT, (TEXT, "text_name"), (WAV, "audio_name"), (MEL, "audio_name")], (FINAL, "final_name")),
+  "export": ([_DS_ARGUMENT, (FINAL, "final_name")], (EXPORT, "export_name")),
+}
+
+
+@dataclass()
+class PipelineStage:
+  name: str
+  command: str
+  args: Dict[str, Any]
+  inputs: List[Artifact]
+  output: Artifact
+
+
+def get_artifact(argument: ArtifactArgument, args: Dict[str, Any]) -> Artifact:
+  kind, arg_name = argument
+  if arg_name not in args:
+    raise ValueError(f"The argument '{arg_name}' is missing.")
+  if kind == DS:
+    return DS, str(args[arg_name]), ""
+  if "ds_name" not in args:
+    raise ValueError("The argument 'ds_name' is missing.")
+  return kind, str(args["ds_name"]), str(args[arg_name])
+
+
+def get_stages(spec: Dict[str, Any]) -> List[PipelineStage]:
+  # the arguments on the top level are the defaults for all stages, e.g. the ds_name
+  default_args = spec.get("args", {})
+  result = []
+  names = set()
+  for stage_spec in spec.get("stages", []):
+    command = stage_spec["command"]
+    if command not in COMMAND_ARTIFACTS:
+      raise ValueError(f"The command '{command}' can't be used in a pipeline.")
+    name = stage_spec.get("name", command)
+    if name in names:
+      raise ValueError(f"The stage name '{name}' is not unique, please name the stages.")
+    names.add(name)
+    args = {**default_args, **stage_spec.get("args", {})}
+    if "overwrite" in args:
+      raise ValueError(f"Stage '{name}': the stages are overwritten if their inputs changed, overwrite can't be set.")
+    input_arguments, output_argument = COMMAND_ARTIFACTS[command]
+    inputs = [get_artifact(argument, args) for argument in input_arguments]
+    output = get_artifact(output_argument, args)
+    result.append(PipelineStage(name, command, args, inputs, output))
+  return result
+
+
+def get_dependencies(stages: List[PipelineStage]) -> Dict[str, Set[str]]:
+  # the inputs which no stage produces need to exist already
+  producers: Dict[Artifact, str] = {}
+  for stage in stages:
+    if stage.output in producers:
+      raise ValueError(
+        f"The stages '{producers[stage.output]}' and '{stage.name}' write the same output.")
+    producers[stage.output] = stage.name
+
+  result = {
+    stage.name: {producers[artifact] for artifact in stage.inputs if artifact in producers}
+    for stage in stages
+  }
+  get_execution_order(result)
+  return result
+
+
+def get_execution_order(dependencies: Dict[str, Set[str]]) -> List[str]:
+  # the order of the specification is kept where possible
+  result = []
+  done: Set[str] = set()
+  remaining = list(dependencies.keys())
+  while len(remaining) > 0:
+    ready = [name for name in remaining if dependencies[name] <= done]
+    if len(ready) == 0:
+      raise ValueError(f"The stages {', '.join(remaining)} depend on each other.")
+    result.extend(ready)
+    done.update(ready)
+    remaining = [name for name in remaining if name not in done]
+  return result
+
+
+def get_stage_signature(stage: PipelineStage, input_signatures: List[str]) -> str:
+  # the arguments are compared by their string representation, e.g. the names of enum values
+  content = json.dumps({
+    "command": stage.command,
+    "args": {key: str(value) for key, value in sorted(stage.args.items())},
+    "inputs": input_signatures,
+  }, sort_keys=True)
+  return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def run_stages(stages: List[PipelineStage], dependencies: Dict[str, Set[str]], run_stage: Callable[[PipelineStage, bool], bool], n_jobs: int) -> List[str]:
+  # run_stage gets whether a dependency of the stage was executed and returns whether the stage was executed
+  # a stage starts as soon as all of its dependencies are finished, i.e. independent branches run concurrently
+  # returns the names of the executed stages
+  logger = getLogger(__name__)
+  stages_by_name = {stage.name: stage for stage in stages}
+  finished: Set[str] = set()
+  executed: Set[str] = set()
+  running: Dict[Future, str] = {}
+  pending = get_execution_order(dependencies)
+  with ThreadPoolExecutor(max_workers=n_jobs) as ex:
+    while len(pending) > 0 or len(running) > 0:
+      ready = [name for name in pending if dependencies[name] <= finished]
+      for name in ready:
+        logger.info(f"Starting stage '{name}'...")
+        dependency_executed = len(dependencies[name] & executed) > 0
+        running[ex.submit(run_stage, stages_by_name[name], dependency_executed)] = name
+      pending = [name for name in pending if name not in ready]
+
+      done_futures, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+      for future in done_futures:
+        name = running.pop(future)
+        error: Optional[BaseException] = future.exception()
+        if error is not None:
+          # the running stages are finished, no further stages are started
+          logger.error(f"Stage '{name}' failed.")
+          for other in running:
+            other.cancel()
+          raise error
+        if future.result():
+          executed.add(name)
+        finished.add(name)
+  return [name for name in get_execution_order(dependencies) if name in executed]
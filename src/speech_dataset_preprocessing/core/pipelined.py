@@ -0,0 +1,154 @@
+"""
+runs the reading, computing and writing of entries on separate pools, so that the I/O overlaps the computation
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from concurrent.futures.thread import ThreadPoolExecutor
+from dataclasses import dataclass
+from logging import getLogger
+from time import perf_counter
+from typing import (Callable, Deque, Dict, Iterable, List, Optional, Tuple,
+                    TypeVar)
+
+from tqdm import tqdm
+
+DEFAULT_IO_JOBS = 4
+DEFAULT_READ_QUEUE_SIZE = 16
+DEFAULT_WRITE_QUEUE_SIZE = 16
+
+READ_QUEUE = "read"
+COMPUTE_QUEUE = "compute"
+WRITE_QUEUE = "write"
+
+Entry = TypeVar("Entry")
+Read = TypeVar("Read")
+Computed = TypeVar("Computed")
+Result = TypeVar("Result")
+
+
+@dataclass()
+class PipelineConfig:
+  compute_jobs: int
+  read_jobs: int = DEFAULT_IO_JOBS
+  write_jobs: int = DEFAULT_IO_JOBS
+  # count of entries which are read ahead of the computation
+  read_queue_size: int = DEFAULT_READ_QUEUE_SIZE
+  # count of computed entries which can wait for being written
+  write_queue_size: int = DEFAULT_WRITE_QUEUE_SIZE
+
+
+@dataclass()
+class QueueMetrics:
+  name: str
+  capacity: int
+  # time-weighted sums
+  occupied_s: float = 0.0
+  full_s: float = 0.0
+  total_s: float = 0.0
+
+  def add(self, occupancy: int, duration_s: float) -> None:
+    self.occupied_s += occupancy * duration_s
+    if occupancy >= self.capacity:
+      self.full_s += duration_s
+    self.total_s += duration_s
+
+  @property
+  def mean_occupancy(self) -> float:
+    if self.total_s == 0:
+      return 0.0
+    return self.occupied_s / self.total_s / self.capacity
+
+  @property
+  def full_rate(self) -> float:
+    if self.total_s == 0:
+      return 0.0
+    return self.full_s / self.total_s
+
+
+def log_queue_metrics(metrics: Dict[str, QueueMetrics]) -> None:
+  # the read queue contains the entries which were read and wait for the computation, the compute queue the running computations and the write queue the pending writes
+  # i.e. an empty read queue and a low compute occupancy mean reading is the bottleneck, a full read queue means the computation is the bottleneck and a full write queue means writing is the bottleneck
+  logger = getLogger(__name__)
+  for queue_metrics in metrics.values():
+    logger.info(
+      f"Queue '{queue_metrics.name}' (capacity {queue_metrics.capacity}): mean occupancy {queue_metrics.mean_occupancy * 100:.1f}%, full {queue_metrics.full_rate * 100:.1f}% of the time.")
+
+
+def run_pipelined(entries: Iterable[Entry], read: Callable[[Entry], Read], compute: Optional[Callable[[Entry, Read], Computed]], write: Callable[[Entry, Computed], Result], config: PipelineConfig, total: Optional[int] = None) -> Tuple[List[Result], Dict[str, QueueMetrics]]:
+  # the results are returned in the order of the entries
+  # without compute the read results are passed to the writing directly, i.e. only the I/O overlaps
+  assert config.compute_jobs > 0 and config.read_jobs > 0 and config.write_jobs > 0
+  assert config.read_queue_size > 0 and config.write_queue_size > 0
+  metrics = {
+    READ_QUEUE: QueueMetrics(READ_QUEUE, config.read_queue_size),
+    COMPUTE_QUEUE: QueueMetrics(COMPUTE_QUEUE, config.compute_jobs),
+    WRITE_QUEUE: QueueMetrics(WRITE_QUEUE, config.write_queue_size),
+  }
+  if compute is None:
+    del metrics[COMPUTE_QUEUE]
+  results: Dict[int, Result] = {}
+  reads: Deque[Tuple[int, Entry, Future]] = deque()
+  computations: Deque[Tuple[int, Entry, Future]] = deque()
+  writes: Deque[Tuple[int, Future]] = deque()
+  iterator = enumerate(entries)
+  is_exhausted = False
+
+  with ThreadPoolExecutor(max_workers=config.read_jobs) as read_pool, \
+      ThreadPoolExecutor(max_workers=config.compute_jobs) as compute_pool, \
+      ThreadPoolExecutor(max_workers=config.write_jobs) as write_pool, \
+      tqdm(total=total) as progress_bar:
+    last_time = perf_counter()
+    while True:
+      for i, future in _pop_done(writes):
+        results[i] = future.result()
+        progress_bar.update()
+
+      for i, entry, future in _pop_done(computations, max_count=config.write_queue_size - len(writes)):
+        writes.append((i, write_pool.submit(write, entry, future.result())))
+
+      if compute is None:
+        for i, entry, future in _pop_done(reads, max_count=config.write_queue_size - len(writes)):
+          writes.append((i, write_pool.submit(write, entry, future.result())))
+      else:
+        for i, entry, future in _pop_done(reads, max_count=config.compute_jobs - len(computations)):
+          computations.append((i, entry, compute_pool.submit(compute, entry, future.result())))
+
+      while not is_exhausted and len(reads) < config.read_queue_size:
+        next_entry = next(iterator, None)
+        if next_entry is None:
+          is_exhausted = True
+        else:
+          i, entry = next_entry
+          reads.append((i, entry, read_pool.submit(read, entry)))
+
+      if is_exhausted and len(reads) == 0 and len(computations) == 0 and len(writes) == 0:
+        break
+      ready_reads_count = sum(1 for x in reads if x[-1].done())
+      running = [x[-1] for x in (*reads, *computations, *writes) if not x[-1].done()]
+      if len(running) > 0:
+        wait(running, return_when=FIRST_COMPLETED)
+
+      current_time = perf_counter()
+      duration_s = current_time - last_time
+      last_time = current_time
+      metrics[READ_QUEUE].add(ready_reads_count, duration_s)
+      if compute is not None:
+        metrics[COMPUTE_QUEUE].add(len(computations), duration_s)
+      metrics[WRITE_QUEUE].add(len(writes), duration_s)
+
+  result = [results[i] for i in range(len(results))]
+  return result, metrics
+
+
+def _pop_done(pending: Deque, max_count: Optional[int] = None) -> List:
+  # takes the finished entries of the queue while keeping the order of the remaining ones
+  result = []
+  remaining = []
+  while len(pending) > 0:
+    item = pending.popleft()
+    if item[-1].done() and (max_count is None or len(result) < max_count):
+      result.append(item)
+    else:
+      remaining.append(item)
+  pending.extend(remaining)
+  return result
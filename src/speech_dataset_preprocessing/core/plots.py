@@ -7,8 +7,11 @@ from pathlib import Path
 from typing import Callable, Dict, List, Optional
 
 from audio_utils.mel import TacotronSTFT, TSTFTHParams
-from speech_dataset_preprocessing.core.ds import DsData, DsDataList
-from speech_dataset_preprocessing.core.wav import WavData, WavDataList
+from speech_dataset_preprocessing.core.ds import (DsData, DsDataList,
+                                                  iterate_with_ds_data)
+from speech_dataset_preprocessing.core.mel import get_mel_tensor_from_wav
+from speech_dataset_preprocessing.core.wav import (WavData, WavDataList,
+                                                   read_entry_wav)
 from general_utils import overwrite_custom_hparams
 
 
@@ -18,9 +21,9 @@ def process(data: WavDataList, ds: DsDataList, wav_dir: Path, custom_hparams: Op
   mel_parser = TacotronSTFT(hparams, logger=getLogger())
 
   all_paths: List[Path] = []
-  for wav_entry, ds_entry in zip(data.items(True), ds.items(True)):
-    absolute_wav_path = wav_dir / wav_entry.wav_relative_path
-    mel_tensor = mel_parser.get_mel_tensor_from_file(absolute_wav_path)
+  for ds_entry, wav_entry in iterate_with_ds_data(ds, data.items(True)):
+    _, wav = read_entry_wav(wav_entry, wav_dir)
+    mel_tensor = get_mel_tensor_from_wav(wav, mel_parser)
     absolute_path = save_callback(wav_entry=wav_entry, ds_entry=ds_entry, mel_tensor=mel_tensor)
     all_paths.append(absolute_path)
   return all_paths
@@ -0,0 +1,61 @@
+"""
+polyphase resampling with filters that are designed only once per rate pair
+"""
+from enum import Enum
+from functools import lru_cache
+from math import gcd
+from typing import Tuple
+
+import numpy as np
+from scipy.signal import firwin, resample_poly
+
+
+class ResampleMode(Enum):
+  QUALITY = 0
+  SPEED = 1
+
+  def __str__(self) -> str:
+    return self.name
+
+
+# (half filter length per max(up, down), kaiser beta, dtype used for filtering)
+_MODE_SETTINGS = {
+  ResampleMode.QUALITY: (32, 8.6, np.float64),
+  ResampleMode.SPEED: (8, 5.0, np.float32),
+}
+
+ResampleFilter = Tuple[int, int, np.ndarray]
+
+
+@lru_cache(maxsize=None)
+def get_resample_filter(orig_rate: int, new_rate: int, mode: ResampleMode) -> ResampleFilter:
+  assert orig_rate > 0 and new_rate > 0
+  divisor = gcd(orig_rate, new_rate)
+  up = new_rate // divisor
+  down = orig_rate // divisor
+  half_len_factor, beta, dtype = _MODE_SETTINGS[mode]
+  max_rate = max(up, down)
+  half_len = half_len_factor * max_rate
+  coefficients = firwin(2 * half_len + 1, 1 / max_rate, window=("kaiser", beta))
+  coefficients = coefficients.astype(dtype)
+  # the array is shared by all callers
+  coefficients.setflags(write=False)
+  return up, down, coefficients
+
+
+def resample_wav(wav: np.ndarray, orig_rate: int, new_rate: int, mode: ResampleMode) -> np.ndarray:
+  if orig_rate == new_rate:
+    return wav.copy()
+
+  up, down, coefficients = get_resample_filter(orig_rate, new_rate, mode)
+  dtype = coefficients.dtype
+  wav_float = wav.astype(dtype, copy=False)
+  resampled = resample_poly(wav_float, up, down, axis=0, window=coefficients)
+  return to_dtype(resampled, wav.dtype)
+
+
+def to_dtype(wav: np.ndarray, dtype: np.dtype) -> np.ndarray:
+  if np.issubdtype(dtype, np.integer):
+    info = np.iinfo(dtype)
+    wav = np.clip(np.round(wav), info.min, info.max)
+  return wav.astype(dtype, copy=False)
@@ -0,0 +1,90 @@
+"""
+input: entries of a data list
+output: seeded samples of them which are drawn in one pass, i.e. only the samples are kept in memory
+"""
+import heapq
+from itertools import islice
+from math import exp, floor, log
+from random import Random
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+DEFAULT_SEED = 1234
+
+
+def _get_in_order(samples: Iterable[Tuple[int, T]]) -> List[T]:
+  # the samples are returned in the order of the entries, i.e. independent of the sampling
+  return [entry for _, entry in sorted(samples, key=lambda sample: sample[0])]
+
+
+def _add_to_reservoir(reservoir: List[Tuple[int, T]], count: int, position: int, entry: T, k: int, rng: Random) -> None:
+  # the count is the number of entries which were offered before this one
+  if count < k:
+    reservoir.append((position, entry))
+    return
+  replaced_index = rng.randint(0, count)
+  if replaced_index < k:
+    reservoir[replaced_index] = (position, entry)
+
+
+def _get_open_random(rng: Random) -> float:
+  # a number in (0, 1), i.e. its logarithm is defined and negative
+  result = rng.random()
+  while result == 0.0:
+    result = rng.random()
+  return result
+
+
+def sample_random(entries: Iterable[T], k: int, seed: Optional[int] = DEFAULT_SEED) -> List[T]:
+  # reservoir sampling which skips the entries between two replacements (Algorithm L), i.e. random numbers are only drawn for the replacements
+  # every entry is sampled with the same probability, the same seed returns the same samples for the same entries, no seed returns different samples on every call
+  assert k >= 0
+  if k == 0:
+    return []
+  rng = Random(seed)
+  positioned_entries = enumerate(entries)
+  reservoir: List[Tuple[int, T]] = list(islice(positioned_entries, k))
+  weight = exp(log(_get_open_random(rng)) / k)
+  while weight < 1.0:
+    skip = floor(log(_get_open_random(rng)) / log(1.0 - weight))
+    replacement = next(islice(positioned_entries, skip, None), None)
+    if replacement is None:
+      break
+    reservoir[rng.randrange(k)] = replacement
+    weight *= exp(log(_get_open_random(rng)) / k)
+  return _get_in_order(reservoir)
+
+
+def sample_per_group(entries: Iterable[T], get_group: Callable[[T], Hashable], k: int, seed: Optional[int] = DEFAULT_SEED) -> List[T]:
+  # one reservoir per group, e.g. per speaker, i.e. each group has min(k, its count of entries) samples
+  assert k >= 0
+  rng = Random(seed)
+  reservoirs: Dict[Hashable, List[Tuple[int, T]]] = {}
+  counts: Dict[Hashable, int] = {}
+  for position, entry in enumerate(entries):
+    group = get_group(entry)
+    reservoir = reservoirs.setdefault(group, [])
+    count = counts.get(group, 0)
+    _add_to_reservoir(reservoir, count, position, entry, k, rng)
+    counts[group] = count + 1
+  return _get_in_order(sample for reservoir in reservoirs.values() for sample in reservoir)
+
+
+def sample_weighted(entries: Iterable[T], get_weight: Callable[[T], float], k: int, seed: Optional[int] = DEFAULT_SEED) -> List[T]:
+  # weighted reservoir sampling without replacement (Efraimidis and Spirakis), e.g. weighted by the duration
+  # the entries with the k largest keys log(u) / weight are sampled, entries without weight are never sampled
+  assert k >= 0
+  rng = Random(seed)
+  heap: List[Tuple[float, int, T]] = []
+  for position, entry in enumerate(entries):
+    weight = get_weight(entry)
+    if weight <= 0:
+      continue
+    # 1 - random() is in (0, 1], i.e. its logarithm is defined
+    key = log(1.0 - rng.random()) / weight
+    if len(heap) < k:
+      heapq.heappush(heap, (key, position, entry))
+    elif len(heap) > 0 and key > heap[0][0]:
+      heapq.heapreplace(heap, (key, position, entry))
+  return _get_in_order((position, entry) for _, position, entry in heap)
@@ -0,0 +1,112 @@
+"""
+input: wav data of long recordings
+output: wav data of the segments which result from splitting the recordings at silences
+"""
+from concurrent.futures.process import ProcessPoolExecutor
+from concurrent.futures.thread import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+from speech_dataset_preprocessing.core.wav import (WavData, WavDataList,
+                                                   WavWriter, get_chunk_dbfs,
+                                                   get_wav_writer,
+                                                   read_entry_wav)
+from tqdm import tqdm
+
+# (first sample, end sample) of a segment in the source wav
+Segment = Tuple[int, int]
+
+
+@dataclass()
+class SegmentationParams:
+  # count of samples over which the energy is calculated
+  chunk_size: int
+  # chunks with a lower energy (dBFS) are silent
+  threshold: float
+  # the recordings are only split at silences which are at least this long
+  min_silence_ms: float
+  min_length_s: float
+  max_length_s: float
+
+
+def get_silences(silent: np.ndarray, min_chunks: int) -> np.ndarray:
+  # returns the (start, end) chunks of all silences which are at least min_chunks long
+  padded = np.concatenate(([False], silent, [False]))
+  changes = np.flatnonzero(padded[1:] != padded[:-1])
+  silences = changes.reshape(-1, 2)
+  lengths = silences[:, 1] - silences[:, 0]
+  return silences[lengths >= min_chunks]
+
+
+def get_segments(dbfs: np.ndarray, chunk_size: int, n_samples: int, sampling_rate: int, params: SegmentationParams) -> List[Segment]:
+  # the recording is cut in the middle of silences, every segment is as long as possible without exceeding the maximum length
+  # if there is no silence to cut before the maximum length, the segment is cut at the maximum length
+  silent = dbfs < params.threshold
+  min_silence_chunks = max(1, int(round(params.min_silence_ms / 1000 * sampling_rate / chunk_size)))
+  silences = get_silences(silent, min_silence_chunks)
+  cuts = (silences[:, 0] + silences[:, 1]) // 2 * chunk_size
+  cuts = np.append(cuts[(cuts > 0) & (cuts < n_samples)], n_samples)
+  min_samples = int(params.min_length_s * sampling_rate)
+  max_samples = int(params.max_length_s * sampling_rate)
+  assert 0 < max_samples
+  assert min_samples <= max_samples
+
+  result = []
+  start = 0
+  while start < n_samples:
+    # the last cut which results in a segment of the allowed length
+    index = np.searchsorted(cuts, start + max_samples, side="right") - 1
+    if index >= 0 and cuts[index] >= start + max(min_samples, 1):
+      end = int(cuts[index])
+    else:
+      end = min(start + max_samples, n_samples)
+    start_chunk = start // chunk_size
+    end_chunk = -(-end // chunk_size)
+    is_silent = bool(silent[start_chunk:end_chunk].all())
+    if end - start >= min_samples and not is_silent:
+      result.append((start, end))
+    start = end
+  return result
+
+
+def get_entry_segments(entry: WavData, wav_dir: Path, params: SegmentationParams) -> List[Segment]:
+  # the wav is memory-mapped, only the calculation of the energy touches all samples
+  sampling_rate, wav = read_entry_wav(entry, wav_dir)
+  dbfs = get_chunk_dbfs(wav, params.chunk_size)
+  return get_segments(dbfs, params.chunk_size, wav.shape[0], sampling_rate, params)
+
+
+def write_segment(source_entry: WavData, segment: Segment, entry_id: int, orig_dir: Path, writer: WavWriter) -> WavData:
+  sampling_rate, wav = read_entry_wav(source_entry, orig_dir)
+  start, end = segment
+  # only the samples of the segment are read from the memory-mapped file
+  relative_dest_wav_path, shard = writer.write(entry_id, sampling_rate, wav[start:end])
+  n_samples = end - start
+  return WavData(entry_id, relative_dest_wav_path, n_samples / sampling_rate,
+                 sampling_rate, n_samples, source_entry.entry_id, start / sampling_rate, shard)
+
+
+def segment(data: WavDataList, orig_dir: Path, dest_dir: Path, params: SegmentationParams, n_jobs: int, packed_dtype: Optional[str] = None) -> WavDataList:
+  # the segments get consecutive ids in the order of the source entries
+  method = partial(get_entry_segments, wav_dir=orig_dir, params=params)
+  with ProcessPoolExecutor(max_workers=n_jobs) as ex:
+    entries_segments = list(tqdm(ex.map(method, data.items(), chunksize=16), total=len(data)))
+
+  jobs = [
+    (source_entry, entry_segment)
+    for source_entry, entry_segments in zip(data.items(), entries_segments)
+    for entry_segment in entry_segments
+  ]
+
+  writer = get_wav_writer(dest_dir, len(jobs), packed_dtype)
+
+  def write_job(entry_id: int) -> WavData:
+    source_entry, entry_segment = jobs[entry_id]
+    return write_segment(source_entry, entry_segment, entry_id, orig_dir, writer)
+
+  with writer, ThreadPoolExecutor(max_workers=n_jobs) as ex:
+    result = WavDataList(tqdm(ex.map(write_job, range(len(jobs))), total=len(jobs)))
+  return result
@@ -0,0 +1,86 @@
+"""
+input: the entries of a stage and their lengths
+output: length-balanced shards which can be processed by separate nodes, the partial results are merged into the normal stage output afterwards
+"""
+import heapq
+from dataclasses import replace
+from pathlib import Path
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+from general_utils import load_obj, save_obj
+
+# each shard writes into its own directory, so that the nodes don't need to coordinate
+PARTIAL_DIR_NAME = "partial"
+# the positions of the entries of a shard in the input of the stage, they restore the order on merging
+_positions_pkl = "positions.pkl"
+
+
+def get_partial_dir(stage_dir: Path, shard_index: int) -> Path:
+  return stage_dir / PARTIAL_DIR_NAME / str(shard_index)
+
+
+def is_sharded(shard_index: Optional[int], num_shards: Optional[int]) -> bool:
+  if shard_index is None and num_shards is None:
+    return False
+  if shard_index is None or num_shards is None:
+    raise ValueError("The shard index and the count of shards need to be given together.")
+  if num_shards < 1:
+    raise ValueError("The count of shards needs to be at least 1.")
+  if not 0 <= shard_index < num_shards:
+    raise ValueError(f"The shard index needs to be in [0, {num_shards}).")
+  return True
+
+
+def get_shard_assignments(lengths: Sequence[float], num_shards: int) -> np.ndarray:
+  # greedy: the longest entry is assigned to the shard with the lowest total length, i.e. the totals differ by at most the longest entry
+  # ties are resolved by the position and the shard index, so every node computes the same assignments
+  assert num_shards > 0
+  lengths = np.asarray(lengths, dtype=np.float64)
+  order = np.argsort(-lengths, kind="stable")
+  totals = [(0.0, shard_index) for shard_index in range(num_shards)]
+  result = np.empty(len(lengths), dtype=np.int64)
+  for position in order:
+    total, shard_index = heapq.heappop(totals)
+    result[position] = shard_index
+    heapq.heappush(totals, (total + lengths[position], shard_index))
+  return result
+
+
+def get_shard_positions(lengths: Sequence[float], shard_index: int, num_shards: int) -> List[int]:
+  # the positions are ascending, i.e. the shard keeps the order of the input
+  assignments = get_shard_assignments(lengths, num_shards)
+  return np.flatnonzero(assignments == shard_index).tolist()
+
+
+def select_shard(entries: List[Any], lengths: Sequence[float], shard_index: int, num_shards: int) -> Tuple[List[int], List[Any]]:
+  assert len(entries) == len(lengths)
+  positions = get_shard_positions(lengths, shard_index, num_shards)
+  return positions, [entries[position] for position in positions]
+
+
+def save_partial_positions(partial_dir: Path, positions: List[int]) -> None:
+  save_obj(positions, partial_dir / _positions_pkl)
+
+
+def load_partial_positions(partial_dir: Path) -> List[int]:
+  return load_obj(partial_dir / _positions_pkl)
+
+
+def merge_partial_entries(partials: List[Tuple[Path, List[int], List[Any]]], path_attribute: Optional[str]) -> List[Any]:
+  # the paths of the entries are relative to their partial directory, they are made relative to the stage directory (if the entries have a path)
+  # all shards need to be complete, i.e. the positions need to cover the whole input
+  positions_count = sum(len(positions) for _, positions, _ in partials)
+  result: List[Any] = [None] * positions_count
+  for relative_partial_dir, positions, entries in partials:
+    if len(positions) != len(entries):
+      raise ValueError(f"The shard in '{relative_partial_dir}' is incomplete.")
+    for position, entry in zip(positions, entries):
+      if not 0 <= position < positions_count or result[position] is not None:
+        raise ValueError(f"The shards don't cover the input, position {position} is invalid.")
+      if path_attribute is None:
+        result[position] = entry
+      else:
+        path = relative_partial_dir / getattr(entry, path_attribute)
+        result[position] = replace(entry, **{path_attribute: path})
+  return result
@@ -0,0 +1,107 @@
+"""
+grouped statistics over columnar values, e.g. durations or symbol counts per speaker
+"""
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+OVERALL_NAME = "Overall"
+PERCENTILES = (50, 95, 99)
+DEFAULT_HISTOGRAM_BINS = 10
+
+StatsSignature = Tuple[Tuple[str, int, int], ...]
+
+
+@dataclass()
+class Stats:
+  signature: StatsSignature
+  overview: pd.DataFrame
+  histogram: pd.DataFrame
+  info: Dict[str, str] = field(default_factory=dict)
+
+
+def get_sources_signature(paths: Iterable[Path]) -> StatsSignature:
+  result = []
+  for path in paths:
+    stat = path.stat()
+    result.append((str(path), stat.st_mtime_ns, stat.st_size))
+  return tuple(result)
+
+
+def get_overview_df(values: np.ndarray, speakers: Sequence[str], value_name: str) -> pd.DataFrame:
+  assert len(values) == len(speakers)
+  codes, names = pd.factorize(np.asarray(speakers, dtype=object), sort=False)
+  df = pd.DataFrame({"code": codes, "value": values})
+  grouped = df.groupby("code", sort=True)["value"]
+  aggregated = grouped.agg(["count", "min", "max", "mean", "sum"])
+  quantiles = grouped.quantile([p / 100 for p in PERCENTILES]).unstack()
+
+  columns = _get_overview_columns(value_name)
+  speaker_rows = pd.DataFrame({
+    columns[0]: names[aggregated.index.values],
+    columns[1]: aggregated["count"].values,
+    columns[2]: aggregated["min"].values,
+    columns[3]: aggregated["max"].values,
+    columns[4]: aggregated["mean"].values,
+    **{
+      column: quantiles.iloc[:, i].values
+      for i, column in enumerate(columns[5:-1])
+    },
+    columns[-1]: aggregated["sum"].values,
+  })
+
+  overall_row = pd.DataFrame([(
+    OVERALL_NAME,
+    len(values),
+    np.min(values),
+    np.max(values),
+    np.mean(values),
+    *np.percentile(values, PERCENTILES),
+    np.sum(values),
+  )], columns=columns)
+
+  result = pd.concat([overall_row, speaker_rows], ignore_index=True)
+  result.sort_values(by=columns[-1], ascending=False, inplace=True, kind="stable")
+  result.reset_index(drop=True, inplace=True)
+  return result
+
+
+def _get_overview_columns(value_name: str) -> List[str]:
+  return [
+    "Speaker",
+    "# Entries",
+    f"Min {value_name}",
+    f"Max {value_name}",
+    f"Avg {value_name}",
+    *(f"P{p} {value_name}" for p in PERCENTILES),
+    f"Total {value_name}",
+  ]
+
+
+def get_histogram_df(values: np.ndarray, speakers: Sequence[str], n_bins: int = DEFAULT_HISTOGRAM_BINS) -> pd.DataFrame:
+  assert len(values) == len(speakers)
+  assert n_bins > 0
+  codes, names = pd.factorize(np.asarray(speakers, dtype=object), sort=False)
+  overall_counts, edges = np.histogram(values, bins=n_bins)
+  # the last bin is closed, like in np.histogram
+  bin_indices = np.clip(np.searchsorted(edges, values, side="right") - 1, 0, n_bins - 1)
+  counts = np.bincount(codes * n_bins + bin_indices, minlength=len(names) * n_bins)
+  counts = counts.reshape(len(names), n_bins)
+
+  result = pd.DataFrame({
+    "From": edges[:-1],
+    "To": edges[1:],
+    OVERALL_NAME: overall_counts,
+  })
+  for code, name in enumerate(names):
+    result[name] = counts[code]
+  return result
+
+
+def get_grouped_stats(values: np.ndarray, speakers: Sequence[str], value_name: str, signature: StatsSignature, n_bins: int = DEFAULT_HISTOGRAM_BINS) -> Stats:
+  overview = get_overview_df(values, speakers, value_name)
+  histogram = get_histogram_df(values, speakers, n_bins)
+  return Stats(signature, overview, histogram)
@@ -2,15 +2,21 @@ from collections import Counter
 from concurrent.futures.thread import ThreadPoolExecutor
 from dataclasses import dataclass
 from functools import partial
+from itertools import chain
 from logging import getLogger
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 from general_utils import GenericList
-from numpy.core.fromnumeric import mean
 from sentence2pronunciation.lookup_cache import LookupCache, get_empty_cache
-from speech_dataset_preprocessing.core.ds import DsDataList
-from text_utils import EngToIPAMode, Language, Speaker, SymbolFormat, Symbols
+from speech_dataset_preprocessing.core.ds import (DsDataList,
+                                                  iterate_with_ds_data)
+from speech_dataset_preprocessing.core.stats import (DEFAULT_HISTOGRAM_BINS,
+                                                     OVERALL_NAME, Stats,
+                                                     StatsSignature,
+                                                     get_grouped_stats)
+from text_utils import EngToIPAMode, Language, SymbolFormat, Symbols
 from text_utils import change_ipa as change_ipa_method
 from text_utils import symbols_to_ipa, text_normalize, text_to_symbols
 from text_utils.pronunciation.ARPAToIPAMapper import symbols_map_arpa_to_ipa
@@ -27,6 +33,26 @@ class TextData:
   symbols_format: SymbolFormat
 
 
+ANALYTICS_COLUMNS = ["Id", "Symbols", "# Symbols", "Format", "Language"]
+SYMBOL_STATS_COLUMNS = ["Symbol", "# Occurrences"]
+
+
+def get_analytics_row(entry: TextData) -> Tuple[int, str, int, str, str]:
+  return (
+    entry.entry_id,
+    ''.join(entry.symbols),
+    len(entry.symbols),
+    repr(entry.symbols_format),
+    repr(entry.symbols_language),
+  )
+
+
+def get_symbol_stats_df_from_counter(symbol_counter: Counter) -> pd.DataFrame:
+  values = sorted(symbol_counter.items())
+  res = pd.DataFrame(data=values, columns=SYMBOL_STATS_COLUMNS)
+  return res
+
+
 class TextDataList(GenericList[TextData]):
   def get_whole_text(self) -> str:
     texts = [''.join(x.symbols) for x in self.items()]
@@ -34,66 +60,112 @@ class TextDataList(GenericList[TextData]):
     return res
 
   def get_analytics_df(self) -> pd.DataFrame:
-    values = [
-      (
-        entry.entry_id,
-        ''.join(entry.symbols),
-        len(entry.symbols),
-        repr(entry.symbols_format),
-        repr(entry.symbols_language),
-      ) for entry in self.items()
-    ]
-    columns = ["Id", "Symbols", "# Symbols", "Format", "Language"]
-    res = pd.DataFrame(data=values, columns=columns)
+    values = [get_analytics_row(entry) for entry in self.items()]
+    res = pd.DataFrame(data=values, columns=ANALYTICS_COLUMNS)
     return res
 
   def get_symbol_stats_df(self) -> pd.DataFrame:
-    symbol_counter = Counter(symbol for item in self.items() for symbol in item.symbols)
-    values = [(symbol, count) for symbol, count in symbol_counter.most_common()]
-    values.sort()
-    columns = ["Symbol", "# Occurrences"]
-    res = pd.DataFrame(data=values, columns=columns)
-    return res
+    symbol_counter = Counter()
+    for item in self.items():
+      symbol_counter.update(item.symbols)
+    return get_symbol_stats_df_from_counter(symbol_counter)
+
+
+# maps a single symbol to any count of symbols, i.e. it is independent of the neighbouring symbols
+SymbolMap = Callable[[Symbols, Language], Symbols]
+
+
+@dataclass()
+class CompiledSymbolMap:
+  # the output symbols of the symbol with id i are output_symbols[output_offsets[i]:output_offsets[i + 1]]
+  output_symbols: np.ndarray
+  output_offsets: np.ndarray
+
+
+class _SymbolIds(dict):
+  # the ids of the symbols of one language, unknown symbols get the next id of the vocabulary
+  def __init__(self, language: Language, vocabulary: List[Tuple[Language, str]]) -> None:
+    super().__init__()
+    self.language = language
+    self.vocabulary = vocabulary
+
+  def __missing__(self, symbol: str) -> int:
+    symbol_id = len(self.vocabulary)
+    self.vocabulary.append((self.language, symbol))
+    self[symbol] = symbol_id
+    return symbol_id
+
+
+def get_flat_symbol_ids(entries: List[TextData]) -> Tuple[np.ndarray, np.ndarray, List[Tuple[Language, str]]]:
+  # the symbols of all entries as one array of ids, the symbols of entry i are ids[boundaries[i]:boundaries[i + 1]]
+  # a symbol gets an id per language because the maps can depend on the language
+  boundaries = np.zeros(len(entries) + 1, dtype=np.int64)
+  np.cumsum(np.fromiter((len(entry.symbols) for entry in entries), dtype=np.int64,
+            count=len(entries)), out=boundaries[1:])
+  vocabulary: List[Tuple[Language, str]] = []
+  symbol_ids: Dict[Language, _SymbolIds] = {}
+  for language in {entry.symbols_language for entry in entries}:
+    symbol_ids[language] = _SymbolIds(language, vocabulary)
+  # the known symbols are looked up without calls into Python
+  ids = np.fromiter(
+    chain.from_iterable(map(symbol_ids[entry.symbols_language].__getitem__, entry.symbols) for entry in entries),
+    dtype=np.int64,
+    count=boundaries[-1],
+  )
+  return ids, boundaries, vocabulary
+
+
+def compile_symbol_map(vocabulary: List[Tuple[Language, str]], symbol_map: SymbolMap) -> CompiledSymbolMap:
+  # the map is called once per distinct symbol, a symbol can be mapped to any count of symbols
+  outputs = [tuple(symbol_map((symbol,), language)) for language, symbol in vocabulary]
+  output_offsets = np.zeros(len(outputs) + 1, dtype=np.int64)
+  np.cumsum(np.fromiter((len(output) for output in outputs), dtype=np.int64,
+            count=len(outputs)), out=output_offsets[1:])
+  output_symbols = np.empty(output_offsets[-1], dtype=object)
+  output_symbols[:] = [symbol for output in outputs for symbol in output]
+  return CompiledSymbolMap(output_symbols, output_offsets)
+
+
+def apply_symbol_map(ids: np.ndarray, boundaries: np.ndarray, compiled: CompiledSymbolMap) -> Tuple[np.ndarray, np.ndarray]:
+  # returns the mapped symbols of all entries and their boundaries
+  counts = np.diff(compiled.output_offsets)[ids]
+  mapped_offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+  np.cumsum(counts, out=mapped_offsets[1:])
+  # the position of every output symbol within the outputs of its input symbol
+  positions = np.arange(mapped_offsets[-1]) - np.repeat(mapped_offsets[:-1], counts)
+  output_indices = np.repeat(compiled.output_offsets[:-1][ids], counts) + positions
+  return compiled.output_symbols[output_indices], mapped_offsets[boundaries]
+
+
+def map_symbols_in_batch(entries: List[TextData], symbol_map: SymbolMap) -> TextDataList:
+  # the map is compiled for the distinct symbols of all entries and applied to all symbols at once
+  ids, boundaries, vocabulary = get_flat_symbol_ids(entries)
+  compiled = compile_symbol_map(vocabulary, symbol_map)
+  mapped_symbols, mapped_boundaries = apply_symbol_map(ids, boundaries, compiled)
+  mapped_symbols = mapped_symbols.tolist()
+  mapped_boundaries = mapped_boundaries.tolist()
+  result = TextDataList()
+  for i, entry in enumerate(entries):
+    text_entry = TextData(
+      entry_id=entry.entry_id,
+      symbols=tuple(mapped_symbols[mapped_boundaries[i]:mapped_boundaries[i + 1]]),
+      symbols_format=entry.symbols_format,
+      symbols_language=entry.symbols_language,
+    )
+    result.append(text_entry)
+  return result
+
 
+def get_stats(ds_data: DsDataList, text_data: TextDataList, signature: StatsSignature, n_bins: int = DEFAULT_HISTOGRAM_BINS) -> Stats:
+  # the text data can be a filtered subset of the ds data
+  speakers = [ds_entry.speaker_name for ds_entry, _ in iterate_with_ds_data(ds_data, text_data.items())]
+  text_lengths = np.fromiter((len(x.symbols) for x in text_data.items()),
+                             dtype=np.int64, count=len(text_data))
+  stats = get_grouped_stats(text_lengths, speakers, "(#)", signature, n_bins)
+  return stats
 
-def log_stats(ds_data: DsDataList, text_data: TextDataList):
-  stats: List[str, int, float, float, float] = []
-  text_lengths = [len(x.symbols) for x in text_data.items()]
-  stats.append((
-    "Overall",
-    len(text_lengths),
-    min(text_lengths),
-    max(text_lengths),
-    mean(text_lengths),
-    sum(text_lengths),
-  ))
-
-  speakers_text_lengths: Dict[Speaker, List[float]] = {}
-  for ds_entry, text_entry in zip(ds_data.items(), text_data.items()):
-    if ds_entry.speaker_name not in speakers_text_lengths:
-      speakers_text_lengths[ds_entry.speaker_name] = []
-    speakers_text_lengths[ds_entry.speaker_name].append(len(text_entry.symbols))
-
-  for speaker, speaker_text_lengths in speakers_text_lengths.items():
-    stats.append((
-      speaker,
-      len(speaker_text_lengths),
-      min(speaker_text_lengths),
-      max(speaker_text_lengths),
-      mean(speaker_text_lengths),
-      sum(speaker_text_lengths),
-    ))
-
-  stats.sort(key=lambda x: (x[-1]), reverse=True)
-  stats_csv = pd.DataFrame(stats, columns=[
-    "Speaker",
-    "# Entries",
-    "# Min",
-    "# Max",
-    "# Avg",
-    "# Total",
-  ])
 
+def log_stats(stats: Stats):
   logger = getLogger(__name__)
   with pd.option_context(
     'display.max_rows', None,
@@ -101,7 +173,8 @@ def log_stats(ds_data: DsDataList, text_data: TextDataList):
     'display.width', None,
     'display.precision', 0,
   ):
-    logger.info(stats_csv)
+    logger.info(stats.overview)
+    logger.info(stats.histogram[["From", "To", OVERALL_NAME]])
 
 
 def preprocess(data: DsDataList) -> TextDataList:
@@ -164,7 +237,7 @@ def convert_entry_to_ipa(entry: TextData, consider_annotations: Optional[bool],
   return text_entry
 
 
-def convert_to_ipa(data: TextDataList, consider_annotations: Optional[bool], mode: Optional[EngToIPAMode], n_jobs: int) -> TextDataList:
+def convert_to_ipa(data: TextDataList, consider_annotations: Optional[bool], mode: Optional[EngToIPAMode], n_jobs: int, cache: Optional[LookupCache] = None) -> TextDataList:
   if len(data) == 0:
     return data
   # first_entry = data.items()[0]
@@ -173,7 +246,8 @@ def convert_to_ipa(data: TextDataList, consider_annotations: Optional[bool], mod
   #                  mode=mode, cache=cache)
   # with ThreadPoolExecutor(max_workers=n_jobs) as ex:
   #   result = TextDataList(tqdm(ex.map(method, data.items()), total=len(data)))
-  cache = get_empty_cache()
+  if cache is None:
+    cache = get_empty_cache()
   result = TextDataList(
     convert_entry_to_ipa(entry, consider_annotations, mode, cache)
     for entry in data.items_tqdm()
@@ -181,45 +255,44 @@ def convert_to_ipa(data: TextDataList, consider_annotations: Optional[bool], mod
   return result
 
 
-def map_to_ipa(data: TextDataList) -> TextDataList:
-  result = TextDataList()
-
-  for entry in data.items(True):
-    new_symbols = symbols_map_arpa_to_ipa(
-      arpa_symbols=entry.symbols,
-      ignore=set(),
-      replace_unknown=False,
-      replace_unknown_with=None,
-    )
+def _map_arpa_symbols_to_ipa(symbols: Symbols, _: Language) -> Symbols:
+  return symbols_map_arpa_to_ipa(
+    arpa_symbols=symbols,
+    ignore=set(),
+    replace_unknown=False,
+    replace_unknown_with=None,
+  )
 
-    text_entry = TextData(
-      entry_id=entry.entry_id,
-      symbols=new_symbols,
-      symbols_format=entry.symbols_format,
-      symbols_language=entry.symbols_language,
-    )
 
-    result.append(text_entry)
-  return result
+def map_to_ipa(data: TextDataList) -> TextDataList:
+  return map_symbols_in_batch(data.items(), _map_arpa_symbols_to_ipa)
+
+
+def _change_ipa_symbols(symbols: Symbols, language: Language, ignore_tones: bool, ignore_arcs: bool, ignore_stress: bool, break_n_thongs: bool, build_n_thongs: bool) -> Symbols:
+  return change_ipa_method(
+    symbols=symbols,
+    ignore_tones=ignore_tones,
+    ignore_arcs=ignore_arcs,
+    ignore_stress=ignore_stress,
+    break_n_thongs=break_n_thongs,
+    build_n_thongs=build_n_thongs,
+    language=language,
+  )
 
 
 def change_ipa(data: TextDataList, ignore_tones: bool, ignore_arcs: bool, ignore_stress: bool, break_n_thongs: bool, build_n_thongs: bool) -> TextDataList:
-  result = TextDataList()
+  method = partial(_change_ipa_symbols, ignore_tones=ignore_tones, ignore_arcs=ignore_arcs, ignore_stress=ignore_stress,
+                   break_n_thongs=break_n_thongs, build_n_thongs=build_n_thongs)
+  if not build_n_thongs:
+    # the tones, arcs and stress are removed and the n-thongs are broken within each symbol
+    return map_symbols_in_batch(data.items(), method)
 
+  # building n-thongs merges neighbouring symbols, therefore the entries are changed one by one
+  result = TextDataList()
   for entry in data.items(True):
-    new_symbols = change_ipa_method(
-      symbols=entry.symbols,
-      ignore_tones=ignore_tones,
-      ignore_arcs=ignore_arcs,
-      ignore_stress=ignore_stress,
-      break_n_thongs=break_n_thongs,
-      build_n_thongs=build_n_thongs,
-      language=entry.symbols_language,
-    )
-
     text_entry = TextData(
       entry_id=entry.entry_id,
-      symbols=new_symbols,
+      symbols=method(entry.symbols, entry.symbols_language),
       symbols_format=entry.symbols_format,
       symbols_language=entry.symbols_language,
     )
@@ -0,0 +1,274 @@
+"""
+input: wav data, optionally its mel data and text data
+output: content hashes and signal checks of every wav (or its read error), shape checks of every mel and of every text, duplicated or corrupt entries are reported to be excluded
+"""
+import struct
+import zlib
+from concurrent.futures.thread import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from general_utils import GenericList
+from speech_dataset_preprocessing.core.mel import (MelData, MelDataList,
+                                                   load_mel_array)
+from speech_dataset_preprocessing.core.pcm import (get_full_scale,
+                                                   get_zero_level)
+from speech_dataset_preprocessing.core.text import TextData
+from speech_dataset_preprocessing.core.wav import (WavData, WavDataList,
+                                                   read_entry_wav)
+from tqdm import tqdm
+
+DEFAULT_MAX_CLIPPING_RATE = 0.001
+DEFAULT_MAX_DC_OFFSET = 0.1
+
+REPORT_COLUMNS = ["Id", "Hash", "# Samples", "Sampling rate",
+                  "NaN", "Clipping rate", "DC offset", "Duplicate of", "Read error", "Issues"]
+MEL_REPORT_COLUMNS = ["Id", "# Frames", "# Mel-channels", "NaN", "Issues"]
+TEXT_REPORT_COLUMNS = ["Id", "# Symbols", "# Blank symbols", "Issues"]
+
+
+@dataclass()
+class WavValidation:
+  entry_id: int
+  # crc32 over the raw PCM bytes, i.e. without the wav header
+  content_hash: int
+  n_samples: int
+  sampling_rate: int
+  has_nan: bool
+  clipping_rate: float
+  dc_offset: float
+  duplicate_of: Optional[int] = None
+  # the message of the exception if the file couldn't be read, the other fields are empty then
+  read_error: Optional[str] = None
+
+  @property
+  def content_key(self) -> Tuple[int, int, int]:
+    # the length and rate are part of the key to make crc32 collisions unlikely
+    return self.content_hash, self.n_samples, self.sampling_rate
+
+
+class WavValidationList(GenericList[WavValidation]):
+  pass
+
+
+@dataclass()
+class MelValidation:
+  entry_id: int
+  n_frames: int
+  n_channels: int
+  # the count of channels which is recorded in the mel data
+  expected_n_channels: int
+  has_nan: bool
+
+
+class MelValidationList(GenericList[MelValidation]):
+  pass
+
+
+@dataclass()
+class TextValidation:
+  entry_id: int
+  n_symbols: int
+  # symbols which consist of whitespace only, e.g. spaces between words
+  n_blank_symbols: int
+
+
+class TextValidationList(GenericList[TextValidation]):
+  pass
+
+
+@dataclass()
+class ValidationThresholds:
+  max_clipping_rate: float = DEFAULT_MAX_CLIPPING_RATE
+  max_dc_offset: float = DEFAULT_MAX_DC_OFFSET
+
+
+def get_issues(validation: WavValidation, thresholds: ValidationThresholds) -> List[str]:
+  if validation.read_error is not None:
+    return ["unreadable"]
+  issues = []
+  if validation.n_samples == 0:
+    issues.append("empty")
+  if validation.has_nan:
+    issues.append("nan")
+  if validation.clipping_rate > thresholds.max_clipping_rate:
+    issues.append("clipping")
+  if abs(validation.dc_offset) > thresholds.max_dc_offset:
+    issues.append("dc offset")
+  if validation.duplicate_of is not None:
+    issues.append("duplicate")
+  return issues
+
+
+def get_mel_issues(validation: MelValidation) -> List[str]:
+  issues = []
+  if validation.n_frames == 0:
+    issues.append("empty")
+  if validation.n_channels != validation.expected_n_channels:
+    issues.append("channels")
+  if validation.has_nan:
+    issues.append("nan")
+  return issues
+
+
+def get_text_issues(validation: TextValidation) -> List[str]:
+  issues = []
+  if validation.n_symbols == validation.n_blank_symbols:
+    issues.append("empty")
+  return issues
+
+
+def validate_wav(entry_id: int, wav: np.ndarray, sampling_rate: int) -> WavValidation:
+  content_hash = zlib.crc32(np.ascontiguousarray(wav).data)
+  n_samples = wav.shape[0]
+  if wav.size == 0:
+    return WavValidation(entry_id, content_hash, n_samples, sampling_rate,
+                         has_nan=False, clipping_rate=0.0, dc_offset=0.0)
+
+  if np.issubdtype(wav.dtype, np.integer):
+    info = np.iinfo(wav.dtype)
+    has_nan = False
+    clipped_count = np.count_nonzero(wav == info.max) + np.count_nonzero(wav == info.min)
+    total = np.sum(wav, dtype=np.float64)
+  else:
+    finite = np.nan_to_num(wav, nan=0.0)
+    has_nan = bool(np.isnan(wav).any())
+    clipped_count = np.count_nonzero(np.abs(finite) >= 1.0)
+    total = np.sum(finite, dtype=np.float64)
+  clipping_rate = clipped_count / wav.size
+  dc_offset = (float(total / wav.size) - get_zero_level(wav.dtype)) / get_full_scale(wav.dtype)
+
+  return WavValidation(entry_id, content_hash, n_samples, sampling_rate,
+                       has_nan=has_nan, clipping_rate=clipping_rate, dc_offset=dc_offset)
+
+
+def get_unreadable_validation(entry_id: int, error: Exception) -> WavValidation:
+  return WavValidation(entry_id, content_hash=0, n_samples=0, sampling_rate=0, has_nan=False,
+                       clipping_rate=0.0, dc_offset=0.0, read_error=f"{type(error).__name__}: {error}")
+
+
+def validate_entry(entry: WavData, wav_dir: Path) -> WavValidation:
+  # the file is read once and all checks run on the same (memory-mapped) samples
+  # corrupt files are reported instead of aborting the validation, e.g. a truncated header raises struct.error
+  try:
+    sampling_rate, wav = read_entry_wav(entry, wav_dir)
+    return validate_wav(entry.entry_id, wav, sampling_rate)
+  except (OSError, EOFError, ValueError, struct.error) as error:
+    return get_unreadable_validation(entry.entry_id, error)
+
+
+def validate_mel_entry(entry: MelData, mel_dir: Path) -> MelValidation:
+  # the mel is stored as (channels, frames)
+  mel = load_mel_array(mel_dir / entry.mel_relative_path, entry.mel_encoding)
+  n_channels, n_frames = mel.shape
+  has_nan = bool(not np.isfinite(mel).all())
+  return MelValidation(entry.entry_id, n_frames, n_channels, entry.mel_n_channels, has_nan)
+
+
+def validate_text_entry(entry: TextData) -> TextValidation:
+  n_blank_symbols = sum(1 for symbol in entry.symbols if symbol.strip() == "")
+  return TextValidation(entry.entry_id, len(entry.symbols), n_blank_symbols)
+
+
+def mark_duplicates(data: WavValidationList) -> None:
+  # the first occurrence of a content is kept
+  first_occurrences: Dict[Tuple[int, int, int], int] = {}
+  for validation in data.items():
+    key = validation.content_key
+    if validation.n_samples == 0:
+      continue
+    if key in first_occurrences:
+      validation.duplicate_of = first_occurrences[key]
+    else:
+      first_occurrences[key] = validation.entry_id
+
+
+def validate(data: WavDataList, wav_dir: Path, n_jobs: int) -> WavValidationList:
+  method = partial(validate_entry, wav_dir=wav_dir)
+  with ThreadPoolExecutor(max_workers=n_jobs) as ex:
+    result = WavValidationList(tqdm(ex.map(method, data.items()), total=len(data)))
+  mark_duplicates(result)
+  return result
+
+
+def validate_mels(data: MelDataList, mel_dir: Path, n_jobs: int) -> MelValidationList:
+  method = partial(validate_mel_entry, mel_dir=mel_dir)
+  with ThreadPoolExecutor(max_workers=n_jobs) as ex:
+    result = MelValidationList(tqdm(ex.map(method, data.items()), total=len(data)))
+  return result
+
+
+def validate_texts(data: Iterable[TextData]) -> TextValidationList:
+  result = TextValidationList(validate_text_entry(entry) for entry in data)
+  return result
+
+
+def get_excluded_entry_ids(data: WavValidationList, thresholds: ValidationThresholds) -> Set[int]:
+  result = {
+    validation.entry_id for validation in data.items()
+    if len(get_issues(validation, thresholds)) > 0
+  }
+  return result
+
+
+def get_report_df(data: WavValidationList, thresholds: ValidationThresholds) -> pd.DataFrame:
+  rows = [
+    (
+      validation.entry_id,
+      f"{validation.content_hash:08x}",
+      validation.n_samples,
+      validation.sampling_rate,
+      validation.has_nan,
+      validation.clipping_rate,
+      validation.dc_offset,
+      "" if validation.duplicate_of is None else validation.duplicate_of,
+      "" if validation.read_error is None else validation.read_error,
+      ", ".join(get_issues(validation, thresholds)),
+    )
+    for validation in data.items()
+  ]
+  result = pd.DataFrame(rows, columns=REPORT_COLUMNS)
+  return result
+
+
+def get_excluded_mel_entry_ids(data: MelValidationList) -> Set[int]:
+  result = {validation.entry_id for validation in data.items() if len(get_mel_issues(validation)) > 0}
+  return result
+
+
+def get_mel_report_df(data: MelValidationList) -> pd.DataFrame:
+  rows = [
+    (
+      validation.entry_id,
+      validation.n_frames,
+      validation.n_channels,
+      validation.has_nan,
+      ", ".join(get_mel_issues(validation)),
+    )
+    for validation in data.items()
+  ]
+  result = pd.DataFrame(rows, columns=MEL_REPORT_COLUMNS)
+  return result
+
+
+def get_excluded_text_entry_ids(data: TextValidationList) -> Set[int]:
+  result = {validation.entry_id for validation in data.items() if len(get_text_issues(validation)) > 0}
+  return result
+
+
+def get_text_report_df(data: TextValidationList) -> pd.DataFrame:
+  rows = [
+    (
+      validation.entry_id,
+      validation.n_symbols,
+      validation.n_blank_symbols,
+      ", ".join(get_text_issues(validation)),
+    )
+    for validation in data.items()
+  ]
+  result = pd.DataFrame(rows, columns=TEXT_REPORT_COLUMNS)
+  return result
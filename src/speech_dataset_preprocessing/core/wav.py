@@ -2,26 +2,49 @@
 calculate wav duration and sampling rate
 """
 
+import os
 from concurrent.futures.thread import ThreadPoolExecutor
 from dataclasses import dataclass
 from functools import partial
 from logging import getLogger
 from multiprocessing import cpu_count
 from pathlib import Path
-from typing import Dict, List
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
-from audio_utils import (get_duration_s, normalize_file, remove_silence_file,
-                         stereo_to_mono_file, upsample_file)
+from audio_utils import get_duration_s, upsample_file
 from audio_utils.mel import TacotronSTFT, TSTFTHParams
 from general_utils import GenericList, get_chunk_name
-from numpy.core.fromnumeric import mean
 from scipy.io.wavfile import read, write
-from speech_dataset_preprocessing.core.ds import DsDataList
+from speech_dataset_preprocessing.core.ds import (DsData, DsDataList,
+                                                  get_entries_count,
+                                                  iterate_with_ds_data)
+from speech_dataset_preprocessing.core.packed import (DEFAULT_SHARD_SAMPLES,
+                                                      PackedWavWriter,
+                                                      WavShardReference,
+                                                      read_packed_wav)
+from speech_dataset_preprocessing.core.pcm import (from_float, get_max_level,
+                                                   to_float)
+from speech_dataset_preprocessing.core.pipelined import (PipelineConfig,
+                                                         log_queue_metrics,
+                                                         run_pipelined)
+from speech_dataset_preprocessing.core.resample import (ResampleMode,
+                                                        get_resample_filter,
+                                                        resample_wav, to_dtype)
+from speech_dataset_preprocessing.core.stats import (DEFAULT_HISTOGRAM_BINS,
+                                                     OVERALL_NAME, Stats,
+                                                     StatsSignature,
+                                                     get_grouped_stats)
 from speech_dataset_preprocessing.globals import DEFAULT_PRE_CHUNK_SIZE
-from text_utils.types import Speaker
 from tqdm import tqdm
 
+# count of samples which are converted at once when memory-mapped wavs are processed
+DEFAULT_BLOCK_SIZE = 2 ** 20
+DEFAULT_BLOCK_CHUNKS = 4096
+
 
 @dataclass()
 class WavData:
@@ -29,6 +52,13 @@ class WavData:
   wav_relative_path: Path
   wav_duration: float
   wav_sampling_rate: int
+  # is None for data which was created before the count was recorded
+  wav_n_samples: Optional[int] = None
+  # are set for segments: the entry of the recording which was split and the start of the segment in it
+  source_entry_id: Optional[int] = None
+  source_start_s: Optional[float] = None
+  # is set for entries of a packed store, the relative path is the one of the shard then
+  wav_shard: Optional[WavShardReference] = None
   #size: float
   #is_stereo: bool
 
@@ -41,48 +71,26 @@ class WavDataList(GenericList[WavData]):
     raise Exception(f"Entry {entry_id} not found.")
 
 
-def log_stats(ds_data: DsDataList, wav_data: WavDataList):
+def get_stats(ds_data: DsDataList, wav_data: WavDataList, signature: StatsSignature, n_bins: int = DEFAULT_HISTOGRAM_BINS) -> Stats:
+  # the wav data can be a filtered subset of the ds data
+  speakers = [ds_entry.speaker_name for ds_entry, _ in iterate_with_ds_data(ds_data, wav_data.items())]
+  durations = np.fromiter((x.wav_duration for x in wav_data.items()),
+                          dtype=np.float64, count=len(wav_data))
+  stats = get_grouped_stats(durations, speakers, "(s)", signature, n_bins)
+  total_s = stats.overview["Total (s)"]
+  stats.overview["Total (min)"] = total_s / 60
+  stats.overview["Total (h)"] = total_s / 3600
+  stats.overview.drop(columns="Total (s)", inplace=True)
+  sampling_rates = np.unique(np.fromiter(
+    (x.wav_sampling_rate for x in wav_data.items()), dtype=np.int64, count=len(wav_data)))
+  stats.info["Sampling rate"] = ", ".join(str(x) for x in sampling_rates)
+  return stats
+
+
+def log_stats(stats: Stats):
   logger = getLogger(__name__)
-  if len(wav_data) > 0:
-    logger.info(f"Sampling rate: {wav_data.items()[0].wav_sampling_rate}")
-  stats: List[str, int, float, float, float, int] = []
-
-  durations = [x.wav_duration for x in wav_data.items()]
-  stats.append((
-    "Overall",
-    len(wav_data),
-    min(durations),
-    max(durations),
-    mean(durations),
-    sum(durations) / 60,
-    sum(durations) / 3600,
-  ))
-  speaker_durations: Dict[Speaker, List[float]] = {}
-  for ds_entry, wav_entry in zip(ds_data.items(), wav_data.items()):
-    if ds_entry.speaker_name not in speaker_durations:
-      speaker_durations[ds_entry.speaker_name] = []
-    speaker_durations[ds_entry.speaker_name].append(wav_entry.wav_duration)
-  for speaker_name, speaker_durations in speaker_durations.items():
-    stats.append((
-      speaker_name,
-      len(speaker_durations),
-      min(speaker_durations),
-      max(speaker_durations),
-      mean(speaker_durations),
-      sum(speaker_durations) / 60,
-      sum(speaker_durations) / 3600,
-    ))
-
-  stats.sort(key=lambda x: (x[-2]), reverse=True)
-  stats_csv = pd.DataFrame(stats, columns=[
-    "Speaker",
-    "# Entries",
-    "Min (s)",
-    "Max (s)",
-    "Avg (s)",
-    "Total (min)",
-    "Total (h)",
-  ])
+  for name, value in stats.info.items():
+    logger.info(f"{name}: {value}")
 
   with pd.option_context(
     'display.max_rows', None,
@@ -90,146 +98,412 @@ def log_stats(ds_data: DsDataList, wav_data: WavDataList):
     'display.width', None,
     'display.precision', 4,
   ):
-    print(stats_csv)
+    print(stats.overview)
+    print(stats.histogram[["From", "To", OVERALL_NAME]])
 
 
-def preprocess_entry(entry: WavData, dest_dir: Path, entries_count: int) -> WavData:
-  sampling_rate, wav = read(entry.wav_absolute_path)
-  duration = get_duration_s(wav, sampling_rate)
-  chunk_dir_name = get_chunk_name(
-    i=entry.entry_id,
-    chunksize=DEFAULT_PRE_CHUNK_SIZE,
-    maximum=entries_count - 1
-  )
+def read_wav_mmap(wav_path: Path) -> Tuple[int, np.ndarray]:
+  # the samples are memory-mapped, i.e. only the accessed parts are read and they are not copied into memory owned by python
+  # scipy can't map e.g. 24 bit wavs, these are read completely
+  try:
+    return read(wav_path, mmap=True)
+  except ValueError:
+    return read(wav_path)
 
-  absolute_chunk_dir = dest_dir / chunk_dir_name
-  absolute_chunk_dir.mkdir(parents=True, exist_ok=True)
-  relative_dest_wav_path = Path(chunk_dir_name) / f"{entry.entry_id}.wav"
-  absolute_dest_wav_path = dest_dir / relative_dest_wav_path
-  write(absolute_dest_wav_path, sampling_rate, wav)
 
-  wav_data = WavData(entry.entry_id, relative_dest_wav_path, duration, sampling_rate)
-  return wav_data
+def prefetch_file(path: Path) -> None:
+  # the os starts to read the file into its cache in the background
+  if hasattr(os, "posix_fadvise"):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+      os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+      os.close(fd)
+
+
+def read_entry_wav(entry: WavData, wav_dir: Path) -> Tuple[int, np.ndarray]:
+  # the samples are memory-mapped in both cases
+  absolute_wav_path = wav_dir / entry.wav_relative_path
+  if entry.wav_shard is None:
+    return read_wav_mmap(absolute_wav_path)
+  assert entry.wav_n_samples is not None
+  return entry.wav_sampling_rate, read_packed_wav(absolute_wav_path, entry.wav_shard, entry.wav_n_samples)
 
 
-def preprocess(data: DsDataList, dest_dir: Path, n_jobs: int) -> WavDataList:
+class FileWavWriter():
+  def __init__(self, dest_dir: Path, entries_count: int) -> None:
+    self.dest_dir = dest_dir
+    self.entries_count = entries_count
+
+  def get_relative_path(self, entry_id: int) -> Path:
+    return get_relative_dest_wav_path(entry_id, self.dest_dir, self.entries_count)
+
+  def write(self, entry_id: int, sampling_rate: int, wav: np.ndarray) -> Tuple[Path, Optional[WavShardReference]]:
+    relative_dest_wav_path = self.get_relative_path(entry_id)
+    write(self.dest_dir / relative_dest_wav_path, sampling_rate, wav)
+    return relative_dest_wav_path, None
+
+  def close(self) -> None:
+    pass
+
+  def __enter__(self) -> "FileWavWriter":
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
+
+
+WavWriter = Union[FileWavWriter, PackedWavWriter]
+
+
+def get_wav_writer(dest_dir: Path, entries_count: int, packed_dtype: Optional[str], shard_samples: int = DEFAULT_SHARD_SAMPLES) -> WavWriter:
+  # without a dtype every entry is written to its own wav file
   assert dest_dir.is_dir()
-  mt_method = partial(
-    preprocess_entry,
-    dest_dir=dest_dir,
-    entries_count=len(data),
-  )
+  if packed_dtype is None:
+    return FileWavWriter(dest_dir, entries_count)
+  return PackedWavWriter(dest_dir, np.dtype(packed_dtype), shard_samples)
 
-  with ThreadPoolExecutor(max_workers=n_jobs) as ex:
-    result = WavDataList(tqdm(ex.map(mt_method, data.items()), total=len(data)))
 
-  return result
+def get_n_samples(wav_path: Path) -> int:
+  # only the header is parsed, the samples are not read
+  _, wav = read_wav_mmap(wav_path)
+  return wav.shape[0]
+
+
+def read_ds_wav(entry: DsData) -> Tuple[int, np.ndarray]:
+  prefetch_file(entry.wav_absolute_path)
+  return read_wav_mmap(entry.wav_absolute_path)
+
+
+def write_preprocessed_wav(entry: DsData, wav_read: Tuple[int, np.ndarray], writer: WavWriter) -> WavData:
+  # the mapped samples are written to the destination without copying them completely into memory
+  sampling_rate, wav = wav_read
+  duration = wav.shape[0] / sampling_rate
+  relative_dest_wav_path, shard = writer.write(entry.entry_id, sampling_rate, wav)
+
+  wav_data = WavData(entry.entry_id, relative_dest_wav_path,
+                     duration, sampling_rate, wav.shape[0], wav_shard=shard)
+  return wav_data
+
+
+def preprocess_entry(entry: DsData, writer: WavWriter) -> WavData:
+  wav_read = read_ds_wav(entry)
+  return write_preprocessed_wav(entry, wav_read, writer)
 
 
-def resample_entry(entry: WavData, orig_dir: Path, dest_dir: Path, new_rate: int, entries_count: int) -> WavData:
+def preprocess(data: DsDataList, dest_dir: Path, n_jobs: int, pipeline_config: Optional[PipelineConfig] = None, packed_dtype: Optional[str] = None) -> WavDataList:
+  # there is nothing to compute, the pipeline only overlaps the reading of the next wavs with the writing
   assert dest_dir.is_dir()
+  if pipeline_config is None:
+    pipeline_config = PipelineConfig(compute_jobs=n_jobs)
+
+  with get_wav_writer(dest_dir, get_entries_count(data.items()), packed_dtype) as writer:
+    result, metrics = run_pipelined(
+      data.items(),
+      read=read_ds_wav,
+      compute=None,
+      write=partial(write_preprocessed_wav, writer=writer),
+      config=pipeline_config,
+      total=len(data),
+    )
+  log_queue_metrics(metrics)
+
+  return WavDataList(result)
+
+
+def get_relative_dest_wav_path(entry_id: int, dest_dir: Path, entries_count: int) -> Path:
   chunk_dir_name = get_chunk_name(
-    i=entry.entry_id,
+    i=entry_id,
     chunksize=DEFAULT_PRE_CHUNK_SIZE,
     maximum=entries_count - 1
   )
   absolute_chunk_dir = dest_dir / chunk_dir_name
   absolute_chunk_dir.mkdir(parents=True, exist_ok=True)
-  relative_dest_wav_path = Path(chunk_dir_name) / f"{entry.entry_id}.wav"
-  absolute_dest_wav_path = dest_dir / relative_dest_wav_path
+  relative_dest_wav_path = Path(chunk_dir_name) / f"{entry_id}.wav"
+  return relative_dest_wav_path
+
+
+def upsample_entry(entry: WavData, orig_dir: Path, writer: FileWavWriter, new_rate: int) -> WavData:
+  # audio_utils works on files, the entries of packed stores are written to files before, see benchmark_resample
+  assert entry.wav_shard is None
+  relative_dest_wav_path = writer.get_relative_path(entry.entry_id)
+  absolute_dest_wav_path = writer.dest_dir / relative_dest_wav_path
 
   # TODO assert not is_overamp
   absolute_orig_wav_path = orig_dir / entry.wav_relative_path
   upsample_file(absolute_orig_wav_path, absolute_dest_wav_path, new_rate)
-  wav_data = WavData(entry.entry_id, relative_dest_wav_path, entry.wav_duration, new_rate)
+  n_samples = get_n_samples(absolute_dest_wav_path)
+  wav_data = WavData(entry.entry_id, relative_dest_wav_path,
+                     entry.wav_duration, new_rate, n_samples,
+                     entry.source_entry_id, entry.source_start_s)
+  return wav_data
+
+
+def resample_entry(entry: WavData, orig_dir: Path, writer: WavWriter, new_rate: int, mode: ResampleMode) -> WavData:
+  sampling_rate, wav = read_entry_wav(entry, orig_dir)
+  new_wav = resample_wav(wav, sampling_rate, new_rate, mode)
+  relative_dest_wav_path, shard = writer.write(entry.entry_id, new_rate, new_wav)
+
+  duration = get_duration_s(new_wav, new_rate)
+  wav_data = WavData(entry.entry_id, relative_dest_wav_path,
+                     duration, new_rate, new_wav.shape[0],
+                     entry.source_entry_id, entry.source_start_s, shard)
   return wav_data
 
 
-def resample(data: WavDataList, orig_dir: Path, dest_dir: Path, new_rate: int, n_jobs: int) -> WavDataList:
+def resample(data: WavDataList, orig_dir: Path, dest_dir: Path, new_rate: int, mode: ResampleMode, n_jobs: int, packed_dtype: Optional[str] = None) -> WavDataList:
   assert dest_dir.is_dir()
+  logger = getLogger(__name__)
+  writer = get_wav_writer(dest_dir, get_entries_count(data.items()), packed_dtype)
   mt_method = partial(
     resample_entry,
     orig_dir=orig_dir,
-    dest_dir=dest_dir,
-    entries_count=len(data),
+    writer=writer,
     new_rate=new_rate,
+    mode=mode,
   )
 
-  with ThreadPoolExecutor(max_workers=n_jobs) as ex:
-    result = WavDataList(tqdm(ex.map(mt_method, data.items()), total=len(data)))
+  # entries are grouped by their sampling rate (e.g. for M-AILABS) so that every filter is designed once
+  indices_by_rate: Dict[int, List[int]] = {}
+  for i, entry in enumerate(data.items()):
+    if entry.wav_sampling_rate not in indices_by_rate:
+      indices_by_rate[entry.wav_sampling_rate] = []
+    indices_by_rate[entry.wav_sampling_rate].append(i)
+
+  result: List[Optional[WavData]] = [None] * len(data)
+  with writer, ThreadPoolExecutor(max_workers=n_jobs) as ex:
+    for orig_rate, indices in indices_by_rate.items():
+      logger.info(f"Resampling {len(indices)} entries from {orig_rate}Hz to {new_rate}Hz...")
+      if orig_rate != new_rate:
+        get_resample_filter(orig_rate, new_rate, mode)
+      entries = [data.items()[i] for i in indices]
+      resampled_entries = ex.map(mt_method, entries)
+      for i, resampled_entry in zip(indices, tqdm(resampled_entries, total=len(indices))):
+        result[i] = resampled_entry
+
+  return WavDataList(result)
+
+
+def write_wav_files(data: WavDataList, orig_dir: Path, dest_dir: Path) -> WavDataList:
+  # the entries of packed stores are written to one wav file each, e.g. for methods which work on files
+  writer = FileWavWriter(dest_dir, get_entries_count(data.items()))
+  result = WavDataList()
+  for entry in data.items():
+    sampling_rate, wav = read_entry_wav(entry, orig_dir)
+    relative_dest_wav_path, _ = writer.write(entry.entry_id, sampling_rate, wav)
+    result.append(WavData(entry.entry_id, relative_dest_wav_path, entry.wav_duration,
+                          sampling_rate, wav.shape[0], entry.source_entry_id, entry.source_start_s))
+  return result
+
 
+def benchmark_resample(data: WavDataList, orig_dir: Path, new_rate: int, mode: ResampleMode) -> pd.DataFrame:
+  # the filters of the engine are designed once per rate pair, therefore this is included in the measurement
+  get_resample_filter.cache_clear()
+
+  durations: List[float] = []
+  with TemporaryDirectory() as files_dir:
+    # the files for the legacy method are written before the measurement
+    legacy_data, legacy_dir = data, orig_dir
+    if any(entry.wav_shard is not None for entry in data.items()):
+      legacy_data, legacy_dir = write_wav_files(data, orig_dir, Path(files_dir)), Path(files_dir)
+    legacy_method = partial(upsample_entry, orig_dir=legacy_dir, new_rate=new_rate)
+    engine_method = partial(resample_entry, orig_dir=orig_dir, new_rate=new_rate, mode=mode)
+    for method, method_data in ((legacy_method, legacy_data), (engine_method, data)):
+      with TemporaryDirectory() as tmp_dir:
+        start = perf_counter()
+        for entry in method_data.items(True):
+          method(entry, writer=FileWavWriter(Path(tmp_dir), get_entries_count(data.items())))
+        durations.append(perf_counter() - start)
+
+  legacy_duration, engine_duration = durations
+  total_audio_s = sum(entry.wav_duration for entry in data.items())
+  result = pd.DataFrame([
+    ("audio_utils.upsample_file", legacy_duration),
+    (f"polyphase ({mode})", engine_duration),
+  ], columns=["Method", "Duration (s)"])
+  result["# Entries"] = len(data)
+  result["Realtime factor"] = total_audio_s / result["Duration (s)"]
+  result["Speedup"] = legacy_duration / result["Duration (s)"]
   return result
 
 
-def stereo_to_mono(data: WavDataList, orig_dir: Path, dest_dir: Path) -> WavDataList:
-  result = WavDataList()
+def stereo_to_mono_wav(wav: np.ndarray) -> np.ndarray:
+  if wav.ndim == 1:
+    return wav
+  return wav.mean(axis=1)
 
-  for values in data.items(True):
-    chunk_dir_name = get_chunk_name(
-      i=values.entry_id,
-      chunksize=DEFAULT_PRE_CHUNK_SIZE,
-      maximum=len(data) - 1
-    )
-    absolute_chunk_dir = dest_dir / chunk_dir_name
-    absolute_chunk_dir.mkdir(parents=True, exist_ok=True)
-    relative_dest_wav_path = Path(chunk_dir_name) / f"{values.entry_id}.wav"
-    absolute_dest_wav_path = dest_dir / relative_dest_wav_path
 
-    # todo assert not is_overamp
-    absolute_orig_wav_path = orig_dir / values.wav_relative_path
-    stereo_to_mono_file(absolute_orig_wav_path, absolute_dest_wav_path)
+def downmix_to_mono(wav: np.ndarray, block_size: int = DEFAULT_BLOCK_SIZE) -> np.ndarray:
+  # the channels are averaged block by block, so that only the mono result is allocated completely
+  if wav.ndim == 1:
+    return wav
+  result = np.empty(wav.shape[0], dtype=wav.dtype)
+  for start in range(0, wav.shape[0], block_size):
+    block = wav[start:start + block_size].mean(axis=1)
+    result[start:start + block_size] = to_dtype(block, wav.dtype)
+  return result
 
-    wav_data = WavData(values.entry_id, relative_dest_wav_path,
-                       values.wav_duration, values.wav_sampling_rate)
-    result.append(wav_data)
 
+def get_chunk_dbfs(wav: np.ndarray, chunk_size: int, block_chunks: int = DEFAULT_BLOCK_CHUNKS) -> np.ndarray:
+  # the energy of all chunks of a block is calculated at once, the last chunk can be shorter
+  # only one block is converted to float at a time, so that memory-mapped wavs are not copied completely
+  assert chunk_size > 0
+  n_samples = wav.shape[0]
+  block_size = chunk_size * block_chunks
+  sums = []
+  for block_start in range(0, n_samples, block_size):
+    block = to_float(wav[block_start:block_start + block_size])
+    if block.ndim > 1:
+      block = block.mean(axis=1)
+    starts = np.arange(0, block.shape[0], chunk_size)
+    sums.append(np.add.reduceat(np.square(block), starts))
+  if len(sums) == 0:
+    return np.zeros(0)
+  lengths = np.full(-(-n_samples // chunk_size), chunk_size)
+  lengths[-1] = n_samples - (len(lengths) - 1) * chunk_size
+  with np.errstate(divide="ignore"):
+    result = 10 * np.log10(np.concatenate(sums) / lengths)
   return result
 
 
-def remove_silence(data: WavDataList, orig_dir: Path, dest_dir: Path, chunk_size: int, threshold_start: float, threshold_end: float, buffer_start_ms: float, buffer_end_ms: float) -> WavDataList:
-  result = WavDataList()
+def get_leading_silence(wav: np.ndarray, chunk_size: int, threshold: float, block_chunks: int = DEFAULT_BLOCK_CHUNKS) -> int:
+  # returns the count of samples before the first chunk with an energy of at least the threshold (dBFS)
+  # the wav is read block by block from the start until such a chunk is found
+  block_size = chunk_size * block_chunks
+  for block_start in range(0, wav.shape[0], block_size):
+    dbfs = get_chunk_dbfs(wav[block_start:block_start + block_size], chunk_size, block_chunks)
+    loud_chunks = np.flatnonzero(dbfs >= threshold)
+    if len(loud_chunks) > 0:
+      return block_start + int(loud_chunks[0]) * chunk_size
+  return wav.shape[0]
+
+
+def get_trimmed_range(wav: np.ndarray, sampling_rate: int, chunk_size: int, threshold_start: float, threshold_end: float, buffer_start_ms: float, buffer_end_ms: float) -> Tuple[int, int]:
+  # the silence at the end is detected on the reversed view of the wav
+  n_samples = wav.shape[0]
+  start = get_leading_silence(wav, chunk_size, threshold_start)
+  start = max(0, start - int(buffer_start_ms / 1000 * sampling_rate))
+  end_silence = get_leading_silence(wav[::-1], chunk_size, threshold_end)
+  end_silence = max(0, end_silence - int(buffer_end_ms / 1000 * sampling_rate))
+  end = max(start, n_samples - end_silence)
+  return start, end
+
+
+def normalize_wav(wav: np.ndarray, full_scale: float) -> np.ndarray:
+  peak = np.max(np.abs(wav)) if wav.size > 0 else 0
+  if peak == 0:
+    return wav
+  return wav * (full_scale / peak)
+
+
+def convert_entry(entry: WavData, orig_dir: Path, writer: WavWriter, to_mono: bool, peak_normalize: bool, new_rate: Optional[int], mode: ResampleMode) -> WavData:
+  sampling_rate, wav = read_entry_wav(entry, orig_dir)
+  # all operations are done on floats in [-1, 1], the result is quantized only once
+  wav_float = to_float(wav)
+  if to_mono:
+    wav_float = stereo_to_mono_wav(wav_float)
+  if new_rate is not None and new_rate != sampling_rate:
+    wav_float = resample_wav(wav_float, sampling_rate, new_rate, mode)
+    sampling_rate = new_rate
+  if peak_normalize:
+    wav_float = normalize_wav(wav_float, get_max_level(wav.dtype))
+  new_wav = from_float(wav_float, wav.dtype)
+  relative_dest_wav_path, shard = writer.write(entry.entry_id, sampling_rate, new_wav)
+
+  duration = get_duration_s(new_wav, sampling_rate)
+  wav_data = WavData(entry.entry_id, relative_dest_wav_path,
+                     duration, sampling_rate, new_wav.shape[0],
+                     entry.source_entry_id, entry.source_start_s, shard)
+  return wav_data
 
-  for values in data.items(True):
-    chunk_dir_name = get_chunk_name(
-      i=values.entry_id,
-      chunksize=DEFAULT_PRE_CHUNK_SIZE,
-      maximum=len(data) - 1
-    )
-    absolute_chunk_dir = dest_dir / chunk_dir_name
-    absolute_chunk_dir.mkdir(parents=True, exist_ok=True)
-    relative_dest_wav_path = Path(chunk_dir_name) / f"{values.entry_id}.wav"
-    absolute_dest_wav_path = dest_dir / relative_dest_wav_path
-
-    absolute_orig_wav_path = orig_dir / values.wav_relative_path
-    new_duration = remove_silence_file(
-      in_path=absolute_orig_wav_path,
-      out_path=absolute_dest_wav_path,
-      chunk_size=chunk_size,
-      threshold_start=threshold_start,
-      threshold_end=threshold_end,
-      buffer_start_ms=buffer_start_ms,
-      buffer_end_ms=buffer_end_ms
-    )
 
-    wav_data = WavData(values.entry_id, relative_dest_wav_path,
-                       new_duration, values.wav_sampling_rate)
-    result.append(wav_data)
+def convert(data: WavDataList, orig_dir: Path, dest_dir: Path, to_mono: bool, peak_normalize: bool, new_rate: Optional[int], mode: ResampleMode, n_jobs: int, packed_dtype: Optional[str] = None) -> WavDataList:
+  assert dest_dir.is_dir()
+  writer = get_wav_writer(dest_dir, get_entries_count(data.items()), packed_dtype)
+  mt_method = partial(
+    convert_entry,
+    orig_dir=orig_dir,
+    writer=writer,
+    to_mono=to_mono,
+    peak_normalize=peak_normalize,
+    new_rate=new_rate,
+    mode=mode,
+  )
+
+  if new_rate is not None:
+    for orig_rate in {entry.wav_sampling_rate for entry in data.items()}:
+      if orig_rate != new_rate:
+        get_resample_filter(orig_rate, new_rate, mode)
+
+  with writer, ThreadPoolExecutor(max_workers=n_jobs) as ex:
+    result = WavDataList(tqdm(ex.map(mt_method, data.items()), total=len(data)))
 
   return result
 
 
-def remove_silence_plot(wav_path: Path, out_path: Path, chunk_size: int, threshold_start: float, threshold_end: float, buffer_start_ms: float, buffer_end_ms: float):
-  remove_silence_file(
-    in_path=wav_path,
-    out_path=out_path,
+def stereo_to_mono_entry(entry: WavData, orig_dir: Path, writer: WavWriter) -> WavData:
+  sampling_rate, wav = read_entry_wav(entry, orig_dir)
+  # todo assert not is_overamp
+  relative_dest_wav_path, shard = writer.write(entry.entry_id, sampling_rate, downmix_to_mono(wav))
+
+  wav_data = WavData(entry.entry_id, relative_dest_wav_path,
+                     entry.wav_duration, entry.wav_sampling_rate, wav.shape[0],
+                     entry.source_entry_id, entry.source_start_s, shard)
+  return wav_data
+
+
+def stereo_to_mono(data: WavDataList, orig_dir: Path, dest_dir: Path, n_jobs: int, packed_dtype: Optional[str] = None) -> WavDataList:
+  writer = get_wav_writer(dest_dir, get_entries_count(data.items()), packed_dtype)
+  mt_method = partial(
+    stereo_to_mono_entry,
+    orig_dir=orig_dir,
+    writer=writer,
+  )
+
+  with writer, ThreadPoolExecutor(max_workers=n_jobs) as ex:
+    result = WavDataList(tqdm(ex.map(mt_method, data.items()), total=len(data)))
+
+  return result
+
+
+def remove_silence_entry(entry: WavData, orig_dir: Path, writer: WavWriter, chunk_size: int, threshold_start: float, threshold_end: float, buffer_start_ms: float, buffer_end_ms: float) -> WavData:
+  sampling_rate, wav = read_entry_wav(entry, orig_dir)
+  start, end = get_trimmed_range(wav, sampling_rate, chunk_size, threshold_start,
+                                 threshold_end, buffer_start_ms, buffer_end_ms)
+  # only the kept range of the mapped samples is written
+  relative_dest_wav_path, shard = writer.write(entry.entry_id, sampling_rate, wav[start:end])
+
+  n_samples = end - start
+  wav_data = WavData(entry.entry_id, relative_dest_wav_path,
+                     n_samples / sampling_rate, sampling_rate, n_samples,
+                     entry.source_entry_id, entry.source_start_s, shard)
+  return wav_data
+
+
+def remove_silence(data: WavDataList, orig_dir: Path, dest_dir: Path, chunk_size: int, threshold_start: float, threshold_end: float, buffer_start_ms: float, buffer_end_ms: float, n_jobs: int, packed_dtype: Optional[str] = None) -> WavDataList:
+  writer = get_wav_writer(dest_dir, get_entries_count(data.items()), packed_dtype)
+  mt_method = partial(
+    remove_silence_entry,
+    orig_dir=orig_dir,
+    writer=writer,
     chunk_size=chunk_size,
     threshold_start=threshold_start,
     threshold_end=threshold_end,
     buffer_start_ms=buffer_start_ms,
-    buffer_end_ms=buffer_end_ms
+    buffer_end_ms=buffer_end_ms,
   )
 
-  sampling_rate, _ = read(wav_path)
+  with writer, ThreadPoolExecutor(max_workers=n_jobs) as ex:
+    result = WavDataList(tqdm(ex.map(mt_method, data.items()), total=len(data)))
+
+  return result
+
+
+def remove_silence_plot(wav_path: Path, out_path: Path, chunk_size: int, threshold_start: float, threshold_end: float, buffer_start_ms: float, buffer_end_ms: float):
+  sampling_rate, wav = read_wav_mmap(wav_path)
+  start, end = get_trimmed_range(wav, sampling_rate, chunk_size, threshold_start,
+                                 threshold_end, buffer_start_ms, buffer_end_ms)
+  write(out_path, sampling_rate, wav[start:end])
 
   hparams = TSTFTHParams()
   hparams.sampling_rate = sampling_rate
@@ -241,25 +515,7 @@ def remove_silence_plot(wav_path: Path, out_path: Path, chunk_size: int, thresho
   return mel_orig, mel_trimmed
 
 
-def normalize(data: WavDataList, orig_dir: Path, dest_dir: Path) -> WavDataList:
-  result = WavDataList()
-
-  for values in data.items(True):
-    chunk_dir_name = get_chunk_name(
-      i=values.entry_id,
-      chunksize=DEFAULT_PRE_CHUNK_SIZE,
-      maximum=len(data) - 1
-    )
-    absolute_chunk_dir = dest_dir / chunk_dir_name
-    absolute_chunk_dir.mkdir(parents=True, exist_ok=True)
-    relative_dest_wav_path = Path(chunk_dir_name) / f"{values.entry_id}.wav"
-    absolute_dest_wav_path = dest_dir / relative_dest_wav_path
-
-    absolute_orig_wav_path = orig_dir / values.wav_relative_path
-    normalize_file(absolute_orig_wav_path, absolute_dest_wav_path)
-
-    wav_data = WavData(values.entry_id, relative_dest_wav_path,
-                       values.wav_duration, values.wav_sampling_rate)
-    result.append(wav_data)
-
-  return result
+def normalize(data: WavDataList, orig_dir: Path, dest_dir: Path, n_jobs: int, packed_dtype: Optional[str] = None) -> WavDataList:
+  # the peak normalization of the fused conversion, i.e. it works on arrays and supports packed stores
+  return convert(data, orig_dir, dest_dir, to_mono=False, peak_normalize=True, new_rate=None,
+                 mode=ResampleMode.QUALITY, n_jobs=n_jobs, packed_dtype=packed_dtype)
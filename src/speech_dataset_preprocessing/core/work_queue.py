@@ -0,0 +1,281 @@
+"""
+input: the count of entries of a stage
+output: the results of batches of entries which were processed by any count of workers, coordinated only by renaming files in a shared directory
+"""
+import json
+import os
+import socket
+import uuid
+from dataclasses import dataclass
+from enum import Enum
+from logging import getLogger
+from pathlib import Path
+from shutil import rmtree
+from threading import Event, Thread
+from time import sleep, time
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+from general_utils import load_obj, save_obj
+from speech_dataset_preprocessing.core.sharding import merge_partial_entries
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_LEASE_S = 600
+DEFAULT_POLL_S = 5
+
+QUEUE_DIR_NAME = "queue"
+
+# a batch moves from pending to leased to done, a rename is atomic also on network file systems
+# the file of a leased or done batch is named "<batch>@<worker>", i.e. only the worker which holds the lease can commit it
+_PENDING_DIR_NAME = "pending"
+_LEASED_DIR_NAME = "leased"
+_DONE_DIR_NAME = "done"
+_RESULTS_DIR_NAME = "results"
+# is written after all batches, i.e. the workers wait for it
+# it contains the id of the run, because the queue directory of a previous run is kept until the coordinator of the next run recreates the stage
+_QUEUE_JSON = "queue.json"
+_results_pkl = "results.pkl"
+
+
+class QueueRole(Enum):
+  # creates the queue, processes batches and merges the results when all batches are done
+  COORDINATOR = 0
+  # processes batches until all are done
+  WORKER = 1
+
+  def __str__(self) -> str:
+    return self.name
+
+
+@dataclass()
+class QueueConfig:
+  role: QueueRole
+  batch_size: int = DEFAULT_BATCH_SIZE
+  # a lease expires if its worker didn't renew it for this duration, e.g. because it died
+  lease_s: float = DEFAULT_LEASE_S
+  poll_s: float = DEFAULT_POLL_S
+  # the coordinator generates an id if it is None, the workers require the id of the coordinator's run
+  run_id: Optional[str] = None
+
+
+@dataclass()
+class Lease:
+  batch_nr: int
+  worker_id: str
+  # the positions of the entries of the batch in the input of the stage
+  positions: List[int]
+
+
+def get_queue_dir(stage_dir: Path) -> Path:
+  return stage_dir / QUEUE_DIR_NAME
+
+
+def get_run_id() -> str:
+  return uuid.uuid4().hex
+
+
+def get_worker_id() -> str:
+  return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _get_batch_name(batch_nr: int, worker_id: Optional[str] = None) -> str:
+  if worker_id is None:
+    return f"{batch_nr}.json"
+  return f"{batch_nr}@{worker_id}.json"
+
+
+def _parse_batch_name(name: str) -> Tuple[int, str]:
+  batch_nr, worker_id = Path(name).stem.split("@", 1)
+  return int(batch_nr), worker_id
+
+
+def _write_json_atomically(path: Path, value: Any) -> None:
+  tmp_path = path.parent / f".{path.name}.{get_worker_id()}.tmp"
+  tmp_path.write_text(json.dumps(value), encoding="utf-8")
+  os.replace(tmp_path, path)
+
+
+class WorkQueue():
+  def __init__(self, queue_dir: Path) -> None:
+    self.queue_dir = queue_dir
+    self.pending_dir = queue_dir / _PENDING_DIR_NAME
+    self.leased_dir = queue_dir / _LEASED_DIR_NAME
+    self.done_dir = queue_dir / _DONE_DIR_NAME
+    self.results_dir = queue_dir / _RESULTS_DIR_NAME
+
+  def create(self, entries_count: int, batch_size: int, run_id: str) -> None:
+    assert batch_size > 0
+    for directory in (self.pending_dir, self.leased_dir, self.done_dir, self.results_dir):
+      directory.mkdir(parents=True, exist_ok=False)
+    batches_count = 0
+    for batch_nr, start in enumerate(range(0, entries_count, batch_size)):
+      positions = list(range(start, min(start + batch_size, entries_count)))
+      _write_json_atomically(self.pending_dir / _get_batch_name(batch_nr), positions)
+      batches_count += 1
+    _write_json_atomically(self.queue_dir / _QUEUE_JSON, {"batches_count": batches_count, "run_id": run_id})
+
+  def get_created_run_id(self) -> Optional[str]:
+    # is None if the queue doesn't exist (yet), e.g. while the coordinator recreates it
+    try:
+      return json.loads((self.queue_dir / _QUEUE_JSON).read_text(encoding="utf-8")).get("run_id")
+    except FileNotFoundError:
+      return None
+
+  def is_created(self, run_id: str) -> bool:
+    return self.get_created_run_id() == run_id
+
+  def get_batches_count(self) -> int:
+    return json.loads((self.queue_dir / _QUEUE_JSON).read_text(encoding="utf-8"))["batches_count"]
+
+  def requeue_expired(self, lease_s: float) -> None:
+    # any worker can return an expired batch, only one of them succeeds with the rename
+    logger = getLogger(__name__)
+    for path in self.leased_dir.glob("*.json"):
+      try:
+        is_expired = path.stat().st_mtime < time() - lease_s
+        if is_expired:
+          batch_nr, worker_id = _parse_batch_name(path.name)
+          os.rename(path, self.pending_dir / _get_batch_name(batch_nr))
+          logger.info(f"The lease of batch {batch_nr} by {worker_id} expired.")
+      except FileNotFoundError:
+        pass
+
+  def lease(self, worker_id: str, lease_s: float) -> Optional[Lease]:
+    self.requeue_expired(lease_s)
+    for path in sorted(self.pending_dir.glob("*.json"), key=lambda x: int(x.stem)):
+      batch_nr = int(path.stem)
+      leased_path = self.leased_dir / _get_batch_name(batch_nr, worker_id)
+      try:
+        os.rename(path, leased_path)
+        # the rename keeps the modification time, therefore it is updated to start the lease
+        os.utime(leased_path)
+        positions = json.loads(leased_path.read_text(encoding="utf-8"))
+      except FileNotFoundError:
+        # another worker was faster or took the batch because of its old modification time
+        continue
+      return Lease(batch_nr, worker_id, positions)
+    return None
+
+  def renew(self, lease: Lease) -> bool:
+    try:
+      os.utime(self.leased_dir / _get_batch_name(lease.batch_nr, lease.worker_id))
+    except FileNotFoundError:
+      return False
+    return True
+
+  def get_result_dir(self, lease: Lease) -> Path:
+    return self.results_dir / Path(_get_batch_name(lease.batch_nr, lease.worker_id)).stem
+
+  def commit(self, lease: Lease, results: List[Any]) -> bool:
+    # returns False if the lease expired and the batch was taken by another worker, the results are discarded then
+    result_dir = self.get_result_dir(lease)
+    # the directory is missing if nothing was written to it yet
+    result_dir.mkdir(parents=True, exist_ok=True)
+    save_obj(results, result_dir / _results_pkl)
+    name = _get_batch_name(lease.batch_nr, lease.worker_id)
+    try:
+      os.rename(self.leased_dir / name, self.done_dir / name)
+    except FileNotFoundError:
+      rmtree(result_dir)
+      return False
+    return True
+
+  def is_finished(self) -> bool:
+    return len(list(self.done_dir.glob("*.json"))) == self.get_batches_count()
+
+  def get_results(self) -> List[Tuple[Path, List[int], List[Any]]]:
+    # per done batch: the directory of its results relative to the queue directory, the positions and the results
+    result = []
+    for path in self.done_dir.glob("*.json"):
+      batch_nr, worker_id = _parse_batch_name(path.name)
+      lease = Lease(batch_nr, worker_id, json.loads(path.read_text(encoding="utf-8")))
+      result_dir = self.get_result_dir(lease)
+      result.append((result_dir.relative_to(self.queue_dir), lease.positions, load_obj(result_dir / _results_pkl)))
+    return result
+
+
+def _renew_until(queue: WorkQueue, lease: Lease, interval_s: float, stop: Event) -> None:
+  while not stop.wait(interval_s):
+    if not queue.renew(lease):
+      return
+
+
+def process_leased_batches(queue: WorkQueue, process_batch: Callable[[List[int], Path], List[Any]], config: QueueConfig, worker_id: str) -> int:
+  # the lease is renewed in the background while the batch is processed, i.e. only dead workers lose their leases
+  # returns the count of committed batches
+  logger = getLogger(__name__)
+  committed_count = 0
+  while True:
+    lease = queue.lease(worker_id, config.lease_s)
+    if lease is None:
+      if queue.is_finished():
+        return committed_count
+      # the remaining batches are leased by other workers, they are taken over if the leases expire
+      sleep(config.poll_s)
+      continue
+
+    logger.info(f"Processing batch {lease.batch_nr} ({len(lease.positions)} entries)...")
+    result_dir = queue.get_result_dir(lease)
+    result_dir.mkdir(parents=True, exist_ok=False)
+    stop = Event()
+    renewer = Thread(target=_renew_until, args=(queue, lease, config.lease_s / 4, stop), daemon=True)
+    renewer.start()
+    try:
+      results = process_batch(lease.positions, result_dir)
+    finally:
+      stop.set()
+      renewer.join()
+    if queue.commit(lease, results):
+      committed_count += 1
+    else:
+      logger.warning(f"The lease of batch {lease.batch_nr} expired, its results were discarded.")
+
+
+def run_queue(stage_dir: Path, entries_count: int, process_batch: Callable[[List[int], Path], List[Any]], config: QueueConfig) -> Optional[List[Tuple[Path, List[int], List[Any]]]]:
+  # the coordinator returns the results of all batches with their directories relative to the stage directory, a worker returns None
+  # process_batch gets the positions of the entries and the directory into which their outputs are written
+  logger = getLogger(__name__)
+  queue = WorkQueue(get_queue_dir(stage_dir))
+  worker_id = get_worker_id()
+  if config.role == QueueRole.COORDINATOR:
+    run_id = get_run_id() if config.run_id is None else config.run_id
+    queue.create(entries_count, config.batch_size, run_id)
+    logger.info(f"Created {queue.get_batches_count()} batches of run {run_id}, start the workers with --queue_run_id {run_id}.")
+  else:
+    assert config.role == QueueRole.WORKER
+    if config.run_id is None:
+      raise ValueError("A worker requires the run id of the coordinator.")
+    # the queue of a previous run can still exist, it is not joined
+    while not queue.is_created(config.run_id):
+      logger.info(f"Waiting for the coordinator of run {config.run_id}...")
+      sleep(config.poll_s)
+
+  committed_count = process_leased_batches(queue, process_batch, config, worker_id)
+  logger.info(f"Committed {committed_count} batches.")
+  if config.role == QueueRole.WORKER:
+    return None
+  result = [
+    (Path(QUEUE_DIR_NAME) / relative_result_dir, positions, results)
+    for relative_result_dir, positions, results in queue.get_results()
+  ]
+  return result
+
+
+def get_queue_config(role: Optional[QueueRole], batch_size: int, lease_s: float, run_id: Optional[str] = None) -> Optional[QueueConfig]:
+  if role is None:
+    return None
+  return QueueConfig(role, batch_size, lease_s, run_id=run_id)
+
+
+def is_queue_worker(config: Optional[QueueConfig]) -> bool:
+  return config is not None and config.role == QueueRole.WORKER
+
+
+def run_queued_stage(stage_dir: Path, entries: List[Any], process_entries: Callable[[List[Any], Path], Iterable[Any]], config: QueueConfig, path_attribute: Optional[str]) -> Optional[List[Any]]:
+  # the coordinator returns the results of all entries in the order of the input, a worker returns None
+  def process_batch(positions: List[int], result_dir: Path) -> List[Any]:
+    return list(process_entries([entries[position] for position in positions], result_dir))
+
+  results = run_queue(stage_dir, len(entries), process_batch, config)
+  if results is None:
+    return None
+  return merge_partial_entries(results, path_attribute)
@@ -2,5 +2,7 @@ DEFAULT_CSV_SEPERATOR = "\t"
 
 DEFAULT_PRE_CHUNK_SIZE = 500
 
+DEFAULT_FINAL_CHUNK_SIZE = 10000
+
 # end of string
 # EOS = '~'
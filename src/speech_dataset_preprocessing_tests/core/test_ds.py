@@ -0,0 +1,75 @@
+from pathlib import Path
+
+import pytest
+from speech_dataset_preprocessing.core.ds import (DsData, DsDataList,
+                                                  get_speaker_examples,
+                                                  iterate_with_ds_data)
+from speech_dataset_preprocessing.core.wav import WavData
+from text_utils.gender import Gender
+from text_utils.language import Language
+from text_utils.symbol_format import SymbolFormat
+
+
+def _get_ds_data(*entry_ids: int) -> DsDataList:
+  return DsDataList(_get_ds_entry(entry_id, "Speaker 1") for entry_id in entry_ids)
+
+
+def _get_ds_entry(entry_id: int, speaker_name: str) -> DsData:
+  return DsData(entry_id, str(entry_id), ("a",), SymbolFormat.GRAPHEMES, Language.ENG,
+                speaker_name, Gender.FEMALE, Path(f"{entry_id}.wav"))
+
+
+def _get_wav_data(entry_id: int) -> WavData:
+  return WavData(entry_id, Path(f"{entry_id}.wav"), 1.0, 22050)
+
+
+def test_iterate_with_ds_data__subset():
+  ds_data = _get_ds_data(0, 1, 2, 3)
+  entries = [_get_wav_data(1), _get_wav_data(3)]
+
+  result = list(iterate_with_ds_data(ds_data, entries))
+
+  assert [(ds_entry.entry_id, entry.entry_id) for ds_entry, entry in result] == [(1, 1), (3, 3)]
+
+
+def test_iterate_with_ds_data__no_entries():
+  result = list(iterate_with_ds_data(_get_ds_data(0, 1), []))
+
+  assert result == []
+
+
+def test_iterate_with_ds_data__extra_entry__raises():
+  ds_data = _get_ds_data(0, 1)
+  entries = [_get_wav_data(0), _get_wav_data(5)]
+
+  with pytest.raises(ValueError):
+    list(iterate_with_ds_data(ds_data, entries))
+
+
+def test_iterate_with_ds_data__other_order__raises():
+  ds_data = _get_ds_data(0, 1, 2)
+  entries = [_get_wav_data(2), _get_wav_data(0)]
+
+  with pytest.raises(ValueError):
+    list(iterate_with_ds_data(ds_data, entries))
+
+
+def test_iterate_with_ds_data__segments__raises():
+  # the segment ids 0 and 1 would match other ds entries
+  ds_data = _get_ds_data(0, 1)
+  entries = [
+    WavData(0, Path("0.wav"), 1.0, 22050, source_entry_id=1, source_start_s=0.0),
+    WavData(1, Path("1.wav"), 1.0, 22050, source_entry_id=1, source_start_s=1.0),
+  ]
+
+  with pytest.raises(ValueError, match="segment"):
+    list(iterate_with_ds_data(ds_data, entries))
+
+
+def test_get_speaker_examples__streamed_entries__one_per_speaker():
+  entries = [_get_ds_entry(entry_id, f"Speaker {entry_id % 2}") for entry_id in range(6)]
+
+  result = get_speaker_examples(iter(entries), seed=1)
+
+  assert sorted(entry.speaker_name for entry in result.items()) == ["Speaker 0", "Speaker 1"]
+  assert result.items() == get_speaker_examples(entries, seed=1).items()
@@ -0,0 +1,46 @@
+from pathlib import Path
+
+import numpy as np
+from speech_dataset_preprocessing.core.export import (export,
+                                                      load_exported_data)
+from speech_dataset_preprocessing.core.final import FinalDsEntry
+from speech_dataset_preprocessing.core.mel import MelEncoding
+from text_utils import Language, SymbolFormat
+
+
+def _get_entry(entry_id: int, speaker: str, symbols, n_frames: int, mel_dir: Path) -> FinalDsEntry:
+  # the mel of an entry contains its id, so that it can be recognized in the shards
+  mel_path = mel_dir / f"{entry_id}.npy"
+  np.save(mel_path, np.full((2, n_frames), entry_id, dtype=np.float32))
+  return FinalDsEntry(entry_id, str(entry_id), speaker, None, Language.ENG, symbols,
+                      SymbolFormat.GRAPHEMES, symbols, SymbolFormat.GRAPHEMES,
+                      Path(), Path(), 1.0, 22050, mel_path, 2, MelEncoding.NPY_FLOAT32,
+                      mel_n_frames=n_frames)
+
+
+def test_export__round_trip(tmp_path: Path):
+  entries = [
+    _get_entry(3, "b", ("c", "a", "t"), 4, tmp_path),
+    _get_entry(7, "a", (), 1, tmp_path),
+    _get_entry(9, "b", ("a", "a"), 3, tmp_path),
+  ]
+  export_dir = tmp_path / "export"
+  export_dir.mkdir()
+
+  export(lambda: iter(entries), export_dir, np.float16, shard_frames=5)
+  result = load_exported_data(export_dir)
+
+  assert len(result) == 3
+  assert result.symbols == ["a", "c", "t"]
+  assert result.speakers == ["a", "b"]
+  assert result.entry_ids.tolist() == [3, 7, 9]
+  assert result.speaker_ids.tolist() == [1, 0, 1]
+  assert result.symbol_offsets.tolist() == [0, 3, 3, 5]
+  assert len(result.mel_shards) == 2
+  for i, entry in enumerate(entries):
+    assert [result.symbols[symbol_id] for symbol_id in result.get_symbol_ids(i)] == list(entry.symbols)
+    mel = result.get_mel(i)
+    assert mel.dtype == np.float16
+    assert mel.tolist() == entry.load_mel().tolist()
+  assert result.lengths.tolist() == [[3, 4], [0, 1], [2, 3]]
+  assert result.length_order.tolist() == [1, 2, 0]
@@ -0,0 +1,42 @@
+from pathlib import Path
+
+import numpy as np
+from speech_dataset_preprocessing.core.features import (
+    F0Config, estimate_f0, get_features_array, get_features_relative_path)
+
+
+def _get_harmonic_wav(f0: float, sampling_rate: int) -> np.ndarray:
+  times = np.arange(sampling_rate) / sampling_rate
+  wav = 0.5 * np.sin(2 * np.pi * f0 * times) + 0.25 * np.sin(2 * np.pi * 2 * f0 * times + 1)
+  return (wav * 32767).astype(np.int16)
+
+
+def test_estimate_f0__harmonic_wav__returns_f0_per_frame():
+  wav = _get_harmonic_wav(220.0, 22050)
+
+  result = estimate_f0(wav, 22050, hop_length=256, frame_length=1024,
+                       config=F0Config(), block_frames=20)
+
+  assert result.shape == (22050 // 256 + 1,)
+  np.testing.assert_allclose(np.median(result), 220.0, rtol=1e-2)
+
+
+def test_estimate_f0__silence__is_unvoiced():
+  wav = np.zeros(22050, dtype=np.int16)
+
+  result = estimate_f0(wav, 22050, hop_length=256, frame_length=1024, config=F0Config())
+
+  assert np.all(result == 0)
+
+
+def test_get_features_array__stacks_energy_and_f0():
+  result = get_features_array(np.ones(5), np.zeros(5))
+
+  assert result.shape == (2, 5)
+  assert result.dtype == np.float32
+
+
+def test_get_features_relative_path__next_to_mel():
+  result = get_features_relative_path(Path("0-99") / "12.npy")
+
+  assert result == Path("0-99") / "12_features.npy"
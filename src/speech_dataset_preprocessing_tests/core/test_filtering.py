@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import pytest
+from speech_dataset_preprocessing.core.filtering import (EntryFilter,
+                                                         filter_mel_data,
+                                                         get_referencing_path)
+from speech_dataset_preprocessing.core.mel import MelData, MelDataList
+from text_utils import Language
+
+
+def test_entry_filter_keep__no_predicates__keeps_all():
+  entry_filter = EntryFilter()
+
+  result = entry_filter.keep(0, "a", Language.ENG, None, None)
+
+  assert result
+
+
+def test_entry_filter_keep__speakers_and_languages():
+  entry_filter = EntryFilter(speakers={"a"}, languages={Language.ENG})
+
+  assert entry_filter.keep(0, "a", Language.ENG, None, None)
+  assert not entry_filter.keep(0, "b", Language.ENG, None, None)
+  assert not entry_filter.keep(0, "a", Language.GER, None, None)
+
+
+def test_entry_filter_keep__lengths_are_inclusive():
+  entry_filter = EntryFilter(min_duration_s=1.0, max_duration_s=2.0, min_symbols=2, max_symbols=3)
+
+  assert entry_filter.keep(0, "a", Language.ENG, 1.0, 2)
+  assert entry_filter.keep(0, "a", Language.ENG, 2.0, 3)
+  assert not entry_filter.keep(0, "a", Language.ENG, 0.9, 2)
+  assert not entry_filter.keep(0, "a", Language.ENG, 2.1, 2)
+  assert not entry_filter.keep(0, "a", Language.ENG, 1.5, 1)
+  assert not entry_filter.keep(0, "a", Language.ENG, 1.5, 4)
+
+
+def test_entry_filter_keep__excluded_entry_ids():
+  entry_filter = EntryFilter(excluded_entry_ids={1})
+
+  assert entry_filter.keep(0, "a", Language.ENG, None, None)
+  assert not entry_filter.keep(1, "a", Language.ENG, None, None)
+
+
+def test_entry_filter_keep__missing_duration__raises_error():
+  entry_filter = EntryFilter(min_duration_s=1.0)
+
+  with pytest.raises(ValueError):
+    entry_filter.keep(0, "a", Language.ENG, None, 2)
+
+
+def test_get_referencing_path():
+  result = get_referencing_path(Path("/ds/wav/orig"), Path("0-9/0.wav"), Path("/ds/wav/dest"))
+
+  assert result == Path("../orig/0-9/0.wav")
+
+
+def test_filter_mel_data__keeps_features():
+  data = MelDataList([
+    MelData(0, Path("0.npy"), 80, mel_n_frames=10, has_features=True),
+    MelData(1, Path("1.npy"), 80, mel_n_frames=10, has_features=True),
+  ])
+
+  result = filter_mel_data(data, {1}, Path("orig"), Path("dest"))
+
+  assert [x.entry_id for x in result.items()] == [1]
+  assert result.items()[0].has_features
+  assert result.items()[0].mel_relative_path == Path("../orig/1.npy")
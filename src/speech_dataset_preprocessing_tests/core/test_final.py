@@ -1,7 +1,14 @@
 from pathlib import Path
 
+import pytest
 from speech_dataset_preprocessing.core.ds import DsData, DsDataList
-from speech_dataset_preprocessing.core.final import get_final_ds_from_data
+from speech_dataset_preprocessing.core.final import (FinalDsEntry,
+                                                     combine_final_entries,
+                                                     filter_by_lengths,
+                                                     get_final_ds_from_data,
+                                                     get_length_buckets,
+                                                     iterate_final_ds_chunks,
+                                                     iterate_final_ds_entries)
 from speech_dataset_preprocessing.core.mel import MelData, MelDataList
 from speech_dataset_preprocessing.core.text import TextData, TextDataList
 from speech_dataset_preprocessing.core.wav import WavData, WavDataList
@@ -34,12 +41,14 @@ def test_get_final_ds_from_data():
     wav_duration=7.5,
     wav_relative_path=Path("test2.wav"),
     wav_sampling_rate=22050,
+    wav_n_samples=165375,
   )
 
   mel_data = MelData(
     entry_id=ds_data.entry_id,
     mel_n_channels=80,
     mel_relative_path=Path("test2.pt"),
+    mel_n_frames=646,
   )
 
   result = get_final_ds_from_data(
@@ -67,3 +76,138 @@ def test_get_final_ds_from_data():
   assert result_first_entry.wav_original_absolute_path == Path("test.wav")
   assert result_first_entry.mel_absolute_path == Path("meldir/test2.pt")
   assert result_first_entry.mel_n_channels == 80
+  assert result_first_entry.wav_n_samples == 165375
+  assert result_first_entry.mel_n_frames == 646
+
+
+def _get_stages(entry_ids, text_ids, wav_ids, mel_ids):
+  ds_data = [
+    DsData(entry_id, str(entry_id), ("a",), SymbolFormat.GRAPHEMES, Language.ENG,
+           "Speaker 1", Gender.FEMALE, Path(f"{entry_id}.wav"))
+    for entry_id in entry_ids
+  ]
+  text_data = [TextData(entry_id, ("b",), Language.ENG, SymbolFormat.GRAPHEMES) for entry_id in text_ids]
+  wav_data = [WavData(entry_id, Path(f"{entry_id}.wav"), 1.0, 22050) for entry_id in wav_ids]
+  mel_data = [MelData(entry_id, Path(f"{entry_id}.pt"), 80) for entry_id in mel_ids]
+  return ds_data, text_data, wav_data, mel_data
+
+
+def test_iterate_final_ds_entries__only_entries_of_all_stages():
+  ds_data, text_data, wav_data, mel_data = _get_stages(
+    range(6), text_ids=[0, 1, 2, 4, 5], wav_ids=[0, 2, 3, 4], mel_ids=[0, 2, 4, 5])
+
+  result = list(iterate_final_ds_entries(ds_data, text_data, wav_data, mel_data,
+                                         Path("wavdir"), Path("meldir")))
+
+  assert [x.entry_id for x in result] == [0, 2, 4]
+  assert result[1].wav_absolute_path == Path("wavdir/2.wav")
+  assert result[1].mel_absolute_path == Path("meldir/2.pt")
+  assert result[1].symbols == ("b",)
+
+
+def test_iterate_final_ds_entries__streams_iterators():
+  ds_data, text_data, wav_data, mel_data = _get_stages(range(3), range(3), range(3), range(3))
+
+  result = list(iterate_final_ds_entries(iter(ds_data), iter(text_data), iter(wav_data),
+                                         iter(mel_data), Path(), Path()))
+
+  assert [x.entry_id for x in result] == [0, 1, 2]
+
+
+@pytest.mark.parametrize("text_ids, wav_ids, mel_ids", [
+  ([0, 1, 7], [0, 1], [0, 1]),
+  ([0, 1], [0, 1, 7], [0, 1]),
+  ([0, 1], [0, 1], [0, 7]),
+  ([1, 0], [0, 1], [0, 1]),
+])
+def test_iterate_final_ds_entries__extra_or_unordered_entry__raises(text_ids, wav_ids, mel_ids):
+  stages = _get_stages([0, 1], text_ids, wav_ids, mel_ids)
+
+  with pytest.raises(ValueError):
+    list(iterate_final_ds_entries(*stages, Path(), Path()))
+
+
+def test_iterate_final_ds_entries__segments__raises():
+  ds_data, text_data, wav_data, mel_data = _get_stages([0, 1], [0, 1], [0, 1], [0, 1])
+  for entry in mel_data:
+    entry.source_entry_id = 0
+
+  with pytest.raises(ValueError, match="segment"):
+    list(iterate_final_ds_entries(ds_data, text_data, wav_data, mel_data, Path(), Path()))
+
+
+def test_iterate_final_ds_chunks():
+  entries = range(5)
+
+  result = list(iterate_final_ds_chunks(entries, chunk_size=2))
+
+  assert len(result) == 3
+  assert list(result[0].items()) == [0, 1]
+  assert list(result[1].items()) == [2, 3]
+  assert list(result[2].items()) == [4]
+
+
+def test_iterate_final_ds_chunks_empty():
+  result = list(iterate_final_ds_chunks([], chunk_size=2))
+
+  assert len(result) == 0
+
+
+def _get_entry(entry_id: int, n_symbols: int, n_frames: int) -> FinalDsEntry:
+  return FinalDsEntry(
+    entry_id=entry_id,
+    basename=str(entry_id),
+    speaker_gender=Gender.FEMALE,
+    speaker_name="Speaker 1",
+    symbols_language=Language.ENG,
+    symbols_original=("a",) * n_symbols,
+    symbols_original_format=SymbolFormat.GRAPHEMES,
+    symbols=("a",) * n_symbols,
+    symbols_format=SymbolFormat.GRAPHEMES,
+    wav_original_absolute_path=Path(f"{entry_id}.wav"),
+    wav_absolute_path=Path(f"{entry_id}.wav"),
+    wav_duration=1.0,
+    wav_sampling_rate=22050,
+    mel_absolute_path=Path(f"{entry_id}.pt"),
+    mel_n_channels=80,
+    mel_n_frames=n_frames,
+  )
+
+
+def test_filter_by_lengths():
+  entries = [_get_entry(0, 5, 100), _get_entry(1, 10, 200), _get_entry(2, 20, 300)]
+
+  result = list(filter_by_lengths(entries, min_frames=150, max_symbols=15))
+
+  assert [x.entry_id for x in result] == [1]
+
+
+def test_get_length_buckets():
+  entries = [_get_entry(0, 5, 100), _get_entry(1, 10, 200), _get_entry(2, 20, 300)]
+
+  result = get_length_buckets(entries, boundaries=[150, 300])
+
+  assert result == {0: [0], 1: [1], 2: [2]}
+
+
+def test_combine_final_entries():
+  sources = [
+    ("ds1", [_get_entry(0, 5, 100), _get_entry(1, 5, 100)]),
+    ("ds2", [_get_entry(0, 5, 100)]),
+  ]
+
+  result = list(combine_final_entries(sources, prefix_speakers=True))
+
+  assert [x[0] for x in result] == ["ds1", "ds1", "ds2"]
+  assert [x[1].entry_id for x in result] == [0, 1, 0]
+  assert [x[2].entry_id for x in result] == [0, 1, 2]
+  assert [x[2].speaker_name for x in result] == ["ds1,Speaker 1", "ds1,Speaker 1", "ds2,Speaker 1"]
+  assert result[2][2].mel_absolute_path == Path("0.pt")
+
+
+def test_combine_final_entries__keep_speaker_names():
+  sources = [("ds1", [_get_entry(0, 5, 100)]), ("ds2", [_get_entry(0, 5, 100)])]
+
+  result = list(combine_final_entries(sources, prefix_speakers=False))
+
+  assert [x[2].speaker_name for x in result] == ["Speaker 1", "Speaker 1"]
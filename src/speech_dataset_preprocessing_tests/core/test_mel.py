@@ -0,0 +1,97 @@
+from logging import getLogger
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+from audio_utils.mel import TacotronSTFT, TSTFTHParams
+from general_utils import overwrite_custom_hparams
+from scipy.io.wavfile import write
+from speech_dataset_preprocessing.core.mel import (ProcessConfig,
+                                                   get_mel_and_energy_from_wav,
+                                                   get_mel_tensor_from_wav,
+                                                   get_mel_tensor_in_blocks,
+                                                   get_process_config_candidates,
+                                                   pcm_to_float32)
+
+
+def _get_small_mel_parser() -> TacotronSTFT:
+  # small hparams, so that the tests are fast
+  hparams = overwrite_custom_hparams(TSTFTHParams(), {
+    "sampling_rate": 8000,
+    "filter_length": 256,
+    "win_length": 256,
+    "hop_length": 64,
+    "n_mel_channels": 20,
+    "mel_fmax": 4000,
+  })
+  return TacotronSTFT(hparams, logger=getLogger())
+
+
+def test_get_process_config_candidates():
+  result = get_process_config_candidates(6)
+
+  assert result == [ProcessConfig(6, 1), ProcessConfig(3, 2), ProcessConfig(1, 4)]
+
+
+def test_pcm_to_float32__int16():
+  wav = np.array([-32768, 0, 16384], dtype=np.int16)
+
+  result = pcm_to_float32(wav)
+
+  assert result.dtype == np.float32
+  assert list(result) == [-1.0, 0.0, 0.5]
+
+
+@pytest.mark.parametrize("dtype", [np.int16, np.float32])
+def test_get_mel_tensor_from_wav__equals_mel_of_file(tmp_path: Path, dtype):
+  # the mel of the (memory-mapped) samples is the one which audio_utils computes for the file
+  mel_parser = _get_small_mel_parser()
+  wav = np.random.default_rng(0).integers(-32768, 32767, size=4000, dtype=np.int16)
+  if dtype == np.float32:
+    wav = pcm_to_float32(wav)
+  wav_path = tmp_path / "test.wav"
+  write(wav_path, 8000, wav)
+  expected = mel_parser.get_mel_tensor_from_file(wav_path)
+
+  result = get_mel_tensor_from_wav(wav, mel_parser)
+
+  assert result.shape == expected.shape
+  assert torch.allclose(result, expected, atol=1e-4)
+
+
+def test_get_mel_tensor_in_blocks__equals_whole_wav():
+  mel_parser = _get_small_mel_parser()
+  wav = np.random.default_rng(0).integers(-32768, 32767, size=4000, dtype=np.int16)
+  expected = get_mel_tensor_from_wav(wav, mel_parser)
+
+  for block_frames in (1, 5, 16, 100):
+    result = get_mel_tensor_in_blocks(wav, mel_parser, hop_length=64,
+                                      filter_length=256, block_frames=block_frames)
+
+    assert result.shape == expected.shape
+    assert torch.allclose(result, expected, atol=1e-4)
+
+
+def test_get_mel_and_energy_from_wav__mel_equals_mel_spectrogram():
+  mel_parser = _get_small_mel_parser()
+  wav = np.random.default_rng(0).integers(-32768, 32767, size=4000, dtype=np.int16)
+
+  result = get_mel_and_energy_from_wav(wav, mel_parser)
+
+  expected = get_mel_tensor_from_wav(wav, mel_parser)
+  assert result.shape == (expected.shape[0] + 1, expected.shape[1])
+  assert torch.allclose(result[:-1], expected, atol=1e-5)
+
+
+def test_get_mel_and_energy_from_wav__energy_is_norm_of_stft_magnitudes():
+  # the magnitudes of the centered STFT with the periodic hann window of the parser
+  mel_parser = _get_small_mel_parser()
+  wav = np.random.default_rng(0).integers(-32768, 32767, size=4000, dtype=np.int16)
+  magnitudes = torch.stft(torch.from_numpy(pcm_to_float32(wav)), n_fft=256, hop_length=64,
+                          win_length=256, window=torch.hann_window(256, periodic=True),
+                          center=True, pad_mode="reflect", return_complex=True).abs()
+
+  result = get_mel_and_energy_from_wav(wav, mel_parser)
+
+  assert torch.allclose(result[-1], torch.norm(magnitudes, dim=0), rtol=1e-4)
@@ -0,0 +1,71 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from speech_dataset_preprocessing.core.ds import get_ds_entry_id
+from speech_dataset_preprocessing.core.mel import MelData
+from speech_dataset_preprocessing.core.mel_stats import (
+    MelStatsAccumulator, SpeakerMelStats, get_mean_and_std, get_mel_stats,
+    merge_speaker_mel_stats)
+
+
+def test_get_mean_and_std__equals_numpy():
+  mel = np.random.default_rng(0).normal(-5, 2, size=(4, 100)).astype(np.float32)
+
+  mean, std = get_mean_and_std(get_mel_stats(mel))
+
+  np.testing.assert_allclose(mean, mel.mean(axis=1, dtype=np.float64), rtol=1e-6)
+  np.testing.assert_allclose(std, mel.std(axis=1, dtype=np.float64), rtol=1e-5)
+
+
+def test_mel_stats_accumulator__overall_and_per_speaker():
+  rng = np.random.default_rng(1)
+  mels = [rng.normal(size=(3, n_frames)) for n_frames in (5, 7, 11)]
+  accumulator = MelStatsAccumulator({0: "a", 1: "b", 2: "a"})
+
+  for entry_id, mel in enumerate(mels):
+    accumulator.add(entry_id, mel)
+  result = accumulator.get_stats()
+
+  overall_mean, overall_std = get_mean_and_std(result.overall)
+  all_frames = np.concatenate(mels, axis=1)
+  np.testing.assert_allclose(overall_mean, all_frames.mean(axis=1))
+  np.testing.assert_allclose(overall_std, all_frames.std(axis=1))
+  assert result.speakers["a"].n_frames == 16
+  np.testing.assert_allclose(get_mean_and_std(result.speakers["b"])[0], mels[1].mean(axis=1))
+
+
+def test_merge_speaker_mel_stats__equals_one_pass():
+  rng = np.random.default_rng(2)
+  mels = [rng.normal(size=(2, 10)) for _ in range(4)]
+  speakers = {0: "a", 1: "b", 2: "a", 3: "b"}
+  one_pass = MelStatsAccumulator(speakers)
+  shards = [MelStatsAccumulator(speakers), MelStatsAccumulator(speakers)]
+  for entry_id, mel in enumerate(mels):
+    one_pass.add(entry_id, mel)
+    shards[entry_id % 2].add(entry_id, mel)
+
+  result = merge_speaker_mel_stats([shard.get_stats() for shard in shards] + [SpeakerMelStats()])
+
+  expected = one_pass.get_stats()
+  assert result.overall.n_frames == expected.overall.n_frames
+  np.testing.assert_allclose(result.overall.sums, expected.overall.sums)
+  np.testing.assert_allclose(result.speakers["b"].squared_sums, expected.speakers["b"].squared_sums)
+
+
+def test_mel_stats_accumulator__unknown_entry__raises():
+  accumulator = MelStatsAccumulator({0: "a"})
+
+  with pytest.raises(ValueError):
+    accumulator.add(5, np.zeros((4, 2), dtype=np.float32))
+
+
+def test_get_ds_entry_id__segment__is_split_entry():
+  # the mels of segments are accumulated for the speaker of the split entry
+  segment = MelData(0, Path("0.npy"), 4, source_entry_id=7)
+  accumulator = MelStatsAccumulator({0: "a", 7: "b"})
+
+  accumulator.add(get_ds_entry_id(segment), np.zeros((4, 2), dtype=np.float32))
+
+  assert list(accumulator.get_stats().speakers.keys()) == ["b"]
+  assert get_ds_entry_id(MelData(0, Path("0.npy"), 4)) == 0
@@ -0,0 +1,37 @@
+from pathlib import Path
+
+import numpy as np
+from speech_dataset_preprocessing.core.packed import (PackedWavWriter,
+                                                      read_packed_wav,
+                                                      to_packed_dtype)
+
+
+def test_to_packed_dtype__int16_to_float32_and_back():
+  wav = np.array([0, 16384, -32768, 32767], dtype=np.int16)
+
+  wav_float = to_packed_dtype(wav, np.dtype("float32"))
+  result = to_packed_dtype(wav_float, np.dtype("int16"))
+
+  assert wav_float.dtype == np.float32
+  assert wav_float.tolist() == [0.0, 0.5, -1.0, 32767 / 32768]
+  assert result.tolist() == wav.tolist()
+
+
+def test_packed_wav_writer__entries_are_read_back(tmp_path: Path):
+  wavs = [
+    np.arange(5, dtype=np.int16),
+    np.zeros(0, dtype=np.int16),
+    np.arange(6, dtype=np.int16).reshape(3, 2),
+    np.arange(4, dtype=np.int16),
+  ]
+
+  with PackedWavWriter(tmp_path, np.dtype("int16"), shard_samples=10) as writer:
+    written = [writer.write(i, 16000, wav) for i, wav in enumerate(wavs)]
+
+  for wav, (relative_shard_path, shard) in zip(wavs, written):
+    result = read_packed_wav(tmp_path / relative_shard_path, shard, wav.shape[0])
+    assert result.shape == wav.shape
+    assert result.tolist() == wav.tolist()
+  # the last entry starts a new shard because the first one contains 11 samples
+  assert [str(path) for path, _ in written] == ["wavs_0.pcm"] * 3 + ["wavs_1.pcm"]
+  assert [shard.offset for _, shard in written] == [0, 5, 5, 0]
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from speech_dataset_preprocessing.core.pcm import (from_float, get_full_scale,
+                                                   get_max_level,
+                                                   get_zero_level, to_float)
+
+
+@pytest.mark.parametrize("dtype, full_scale, zero_level", [
+  (np.int16, 32768.0, 0.0),
+  (np.int32, 2147483648.0, 0.0),
+  (np.uint8, 128.0, 128.0),
+  (np.float32, 1.0, 0.0),
+])
+def test_get_full_scale_and_zero_level(dtype, full_scale, zero_level):
+  assert get_full_scale(np.dtype(dtype)) == full_scale
+  assert get_zero_level(np.dtype(dtype)) == zero_level
+
+
+@pytest.mark.parametrize("wav, expected", [
+  (np.array([-32768, 0, 16384], dtype=np.int16), [-1.0, 0.0, 0.5]),
+  (np.array([-2147483648, 0, 1073741824], dtype=np.int32), [-1.0, 0.0, 0.5]),
+  (np.array([0, 128, 192], dtype=np.uint8), [-1.0, 0.0, 0.5]),
+  (np.array([-1.0, 0.0, 0.5], dtype=np.float32), [-1.0, 0.0, 0.5]),
+])
+def test_to_float(wav, expected):
+  result = to_float(wav)
+
+  assert result.dtype == np.float64
+  assert result.tolist() == expected
+
+
+@pytest.mark.parametrize("dtype", [np.int16, np.int32, np.uint8, np.float32])
+def test_from_float__round_trip(dtype):
+  wav_float = np.array([-1.0, -0.25, 0.0, 0.5, get_max_level(np.dtype(dtype))])
+
+  result = from_float(wav_float, np.dtype(dtype))
+
+  assert result.dtype == dtype
+  assert to_float(result).tolist() == wav_float.tolist()
+
+
+def test_from_float__clips_to_range():
+  result = from_float(np.array([-2.0, 2.0]), np.dtype(np.uint8))
+
+  assert result.tolist() == [0, 255]
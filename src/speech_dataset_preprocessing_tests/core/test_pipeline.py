@@ -0,0 +1,101 @@
+from threading import Barrier
+
+import pytest
+from speech_dataset_preprocessing.core.pipeline import (get_dependencies,
+                                                        get_execution_order,
+                                                        get_stage_signature,
+                                                        get_stages, run_stages)
+
+
+def _get_spec():
+  return {
+    "args": {"ds_name": "ljs"},
+    "stages": [
+      {"command": "preprocess-ljs", "args": {"path": "/data/ljs"}},
+      {"command": "preprocess-wavs", "args": {"wav_name": "22050"}},
+      {"command": "preprocess-text", "args": {"text_name": "en"}},
+      {"command": "text-normalize", "args": {"orig_text_name": "en", "dest_text_name": "en_norm"}},
+      {"command": "preprocess-mels", "args": {"wav_name": "22050"}},
+      {"command": "merge", "args": {"text_name": "en_norm", "audio_name": "22050", "final_name": "final"}},
+    ],
+  }
+
+
+def test_get_dependencies():
+  stages = get_stages(_get_spec())
+
+  result = get_dependencies(stages)
+
+  assert result == {
+    "preprocess-ljs": set(),
+    "preprocess-wavs": {"preprocess-ljs"},
+    "preprocess-text": {"preprocess-ljs"},
+    "text-normalize": {"preprocess-ljs", "preprocess-text"},
+    "preprocess-mels": {"preprocess-ljs", "preprocess-wavs"},
+    "merge": {"preprocess-ljs", "text-normalize", "preprocess-wavs", "preprocess-mels"},
+  }
+
+
+def test_get_stages__duplicate_name__raises_error():
+  spec = _get_spec()
+  spec["stages"].append({"command": "preprocess-text", "args": {"text_name": "other"}})
+
+  with pytest.raises(ValueError):
+    get_stages(spec)
+
+
+def test_get_dependencies__same_output__raises_error():
+  spec = _get_spec()
+  spec["stages"].append({"name": "other", "command": "preprocess-text", "args": {"text_name": "en"}})
+
+  with pytest.raises(ValueError):
+    get_dependencies(get_stages(spec))
+
+
+def test_get_execution_order__cycle__raises_error():
+  with pytest.raises(ValueError):
+    get_execution_order({"a": {"b"}, "b": {"a"}})
+
+
+def test_get_stage_signature__depends_on_args_and_inputs():
+  stage = get_stages(_get_spec())[1]
+  changed = get_stages(_get_spec())[1]
+  changed.args["io_jobs"] = 4
+
+  result = get_stage_signature(stage, ["x"])
+
+  assert result == get_stage_signature(stage, ["x"])
+  assert result != get_stage_signature(stage, ["y"])
+  assert result != get_stage_signature(changed, ["x"])
+
+
+def test_run_stages__runs_branches_concurrently():
+  stages = get_stages(_get_spec())
+  # both branches need to wait for each other, i.e. they can't run one after another
+  barrier = Barrier(2, timeout=10)
+
+  def run_stage(stage, _):
+    if stage.name in ("preprocess-wavs", "preprocess-text"):
+      barrier.wait()
+    return True
+
+  result = run_stages(stages, get_dependencies(stages), run_stage, n_jobs=2)
+
+  assert result[0] == "preprocess-ljs"
+  assert result[-1] == "merge"
+  assert len(result) == 6
+
+
+def test_run_stages__executed_dependency_is_passed():
+  stages = get_stages(_get_spec())
+  received = {}
+
+  def run_stage(stage, dependency_executed):
+    received[stage.name] = dependency_executed
+    return stage.name == "preprocess-text"
+
+  result = run_stages(stages, get_dependencies(stages), run_stage, n_jobs=2)
+
+  assert result == ["preprocess-text"]
+  assert received["text-normalize"]
+  assert not received["preprocess-mels"]
@@ -0,0 +1,54 @@
+import pytest
+from speech_dataset_preprocessing.core.pipelined import (COMPUTE_QUEUE,
+                                                         READ_QUEUE,
+                                                         WRITE_QUEUE,
+                                                         PipelineConfig,
+                                                         run_pipelined)
+
+
+def test_run_pipelined__keeps_order():
+  config = PipelineConfig(compute_jobs=2, read_jobs=3, write_jobs=2,
+                          read_queue_size=4, write_queue_size=2)
+
+  result, metrics = run_pipelined(
+    range(50),
+    read=lambda x: x * 2,
+    compute=lambda x, read: read + 1,
+    write=lambda x, computed: (x, computed),
+    config=config,
+    total=50,
+  )
+
+  assert result == [(x, x * 2 + 1) for x in range(50)]
+  assert set(metrics.keys()) == {READ_QUEUE, COMPUTE_QUEUE, WRITE_QUEUE}
+  assert all(0 <= x.mean_occupancy <= 1 for x in metrics.values())
+
+
+def test_run_pipelined__empty():
+  result, _ = run_pipelined([], lambda x: x, lambda x, y: y, lambda x, y: y, PipelineConfig(1))
+
+  assert result == []
+
+
+def test_run_pipelined__error_is_raised():
+  def compute(x, read):
+    raise ValueError()
+
+  with pytest.raises(ValueError):
+    run_pipelined(range(5), lambda x: x, compute, lambda x, y: y, PipelineConfig(1))
+
+
+def test_run_pipelined__without_compute__writes_reads():
+  config = PipelineConfig(compute_jobs=1, read_jobs=3, write_jobs=2,
+                          read_queue_size=4, write_queue_size=2)
+
+  result, metrics = run_pipelined(
+    range(20),
+    read=lambda x: x * 2,
+    compute=None,
+    write=lambda x, read: (x, read),
+    config=config,
+  )
+
+  assert result == [(x, x * 2) for x in range(20)]
+  assert set(metrics.keys()) == {READ_QUEUE, WRITE_QUEUE}
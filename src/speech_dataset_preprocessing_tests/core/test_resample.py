@@ -0,0 +1,31 @@
+import numpy as np
+from speech_dataset_preprocessing.core.resample import (ResampleMode,
+                                                        get_resample_filter,
+                                                        resample_wav)
+
+
+def test_get_resample_filter_is_cached():
+  first = get_resample_filter(44100, 22050, ResampleMode.SPEED)
+  second = get_resample_filter(44100, 22050, ResampleMode.SPEED)
+
+  assert first is second
+  assert first[0] == 1
+  assert first[1] == 2
+
+
+def test_resample_wav_keeps_dtype_and_rate_ratio():
+  wav = (np.sin(np.arange(16000) / 10) * 10000).astype(np.int16)
+
+  result = resample_wav(wav, 16000, 22050, ResampleMode.QUALITY)
+
+  assert result.dtype == np.int16
+  assert len(result) == 22050
+
+
+def test_resample_wav_stereo():
+  wav = np.zeros((4800, 2), dtype=np.float32)
+
+  result = resample_wav(wav, 48000, 16000, ResampleMode.SPEED)
+
+  assert result.dtype == np.float32
+  assert result.shape == (1600, 2)
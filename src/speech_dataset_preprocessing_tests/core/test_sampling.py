@@ -0,0 +1,47 @@
+from collections import Counter
+
+from speech_dataset_preprocessing.core.sampling import (sample_per_group,
+                                                        sample_random,
+                                                        sample_weighted)
+
+
+def test_sample_random__same_seed__same_samples_in_order():
+  result = sample_random(iter(range(1000)), k=10, seed=1)
+
+  assert result == sample_random(range(1000), k=10, seed=1)
+  assert result != sample_random(range(1000), k=10, seed=2)
+  assert result == sorted(result)
+  assert len(set(result)) == 10
+
+
+def test_sample_random__less_entries_than_k__returns_all():
+  result = sample_random(range(3), k=10)
+
+  assert result == [0, 1, 2]
+
+
+def test_sample_random__is_uniform():
+  counts = Counter()
+  for seed in range(2000):
+    counts.update(sample_random(range(10), k=2, seed=seed))
+
+  assert all(300 < count < 500 for count in counts.values())
+
+
+def test_sample_per_group__k_samples_per_group():
+  entries = [("a", 0), ("b", 1), ("a", 2), ("a", 3), ("c", 4), ("a", 5)]
+
+  result = sample_per_group(entries, lambda entry: entry[0], k=2, seed=3)
+
+  assert Counter(group for group, _ in result) == {"a": 2, "b": 1, "c": 1}
+  assert result == sorted(result, key=lambda entry: entry[1])
+
+
+def test_sample_weighted__prefers_heavy_and_skips_zero_weights():
+  weights = {0: 0.0, 1: 1.0, 2: 100.0}
+  counts = Counter()
+  for seed in range(200):
+    counts.update(sample_weighted(range(3), weights.get, k=1, seed=seed))
+
+  assert counts[0] == 0
+  assert counts[2] > 180
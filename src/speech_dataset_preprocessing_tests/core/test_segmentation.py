@@ -0,0 +1,25 @@
+import numpy as np
+from speech_dataset_preprocessing.core.segmentation import (SegmentationParams,
+                                                            get_segments,
+                                                            get_silences)
+
+
+def test_get_silences():
+  silent = np.array([True, False, True, True, False, True, True, True])
+
+  result = get_silences(silent, min_chunks=2)
+
+  assert result.tolist() == [[2, 4], [5, 8]]
+
+
+def test_get_segments__cuts_in_silences_and_respects_max_length():
+  sampling_rate = 100
+  # 1s speech, 0.5s silence, 1s speech, 0.5s silence, 3s speech
+  silent = np.array([False] * 10 + [True] * 5 + [False] * 10 + [True] * 5 + [False] * 30)
+  dbfs = np.where(silent, -80.0, -10.0)
+  params = SegmentationParams(chunk_size=10, threshold=-40, min_silence_ms=300,
+                              min_length_s=0.5, max_length_s=2)
+
+  result = get_segments(dbfs, 10, len(silent) * 10, sampling_rate, params)
+
+  assert result == [(0, 120), (120, 270), (270, 470), (470, 600)]
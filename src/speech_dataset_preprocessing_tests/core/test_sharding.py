@@ -0,0 +1,63 @@
+from dataclasses import dataclass
+from pathlib import Path
+
+import pytest
+from speech_dataset_preprocessing.core.sharding import (get_shard_assignments,
+                                                        get_shard_positions,
+                                                        is_sharded,
+                                                        merge_partial_entries)
+
+
+@dataclass()
+class _Entry:
+  entry_id: int
+  relative_path: Path
+
+
+def test_get_shard_assignments__balances_lengths():
+  lengths = [10, 1, 1, 1, 4, 3, 2, 8]
+
+  result = get_shard_assignments(lengths, num_shards=2)
+
+  totals = [sum(length for length, shard in zip(lengths, result) if shard == i) for i in range(2)]
+  assert sorted(totals) == [15, 15]
+
+
+def test_get_shard_positions__cover_all_entries_once():
+  lengths = [3.5, 1, 7, 1, 1, 2, 0, 4, 4]
+
+  result = [get_shard_positions(lengths, i, num_shards=3) for i in range(3)]
+
+  assert sorted(position for positions in result for position in positions) == list(range(9))
+  assert all(positions == sorted(positions) for positions in result)
+
+
+def test_is_sharded():
+  assert not is_sharded(None, None)
+  assert is_sharded(1, 2)
+  with pytest.raises(ValueError):
+    is_sharded(2, 2)
+  with pytest.raises(ValueError):
+    is_sharded(None, 2)
+
+
+def test_merge_partial_entries__restores_order_and_prefixes_paths():
+  partials = [
+    (Path("partial/0"), [1], [_Entry(5, Path("0/5.wav"))]),
+    (Path("partial/1"), [0, 2], [_Entry(3, Path("0/3.wav")), _Entry(8, Path("0/8.wav"))]),
+  ]
+
+  result = merge_partial_entries(partials, "relative_path")
+
+  assert [entry.entry_id for entry in result] == [3, 5, 8]
+  assert result[1].relative_path == Path("partial/0/0/5.wav")
+
+
+def test_merge_partial_entries__missing_position__raises():
+  partials = [
+    (Path("partial/0"), [0], [_Entry(3, Path("3.wav"))]),
+    (Path("partial/1"), [2], [_Entry(8, Path("8.wav"))]),
+  ]
+
+  with pytest.raises(ValueError):
+    merge_partial_entries(partials, "relative_path")
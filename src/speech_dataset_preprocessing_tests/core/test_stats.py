@@ -0,0 +1,31 @@
+import numpy as np
+from speech_dataset_preprocessing.core.stats import (OVERALL_NAME,
+                                                     get_histogram_df,
+                                                     get_overview_df)
+
+
+def test_get_overview_df():
+  values = np.array([1.0, 2.0, 3.0, 4.0, 10.0, 0.5])
+  speakers = ["a", "b", "a", "c", "b", "a"]
+
+  result = get_overview_df(values, speakers, "(s)")
+
+  assert list(result["Speaker"]) == [OVERALL_NAME, "b", "a", "c"]
+  assert list(result["# Entries"]) == [6, 2, 3, 1]
+  assert list(result["Min (s)"]) == [0.5, 2.0, 0.5, 4.0]
+  assert list(result["Max (s)"]) == [10.0, 10.0, 3.0, 4.0]
+  assert list(result["Total (s)"]) == [20.5, 12.0, 4.5, 4.0]
+  assert list(result["P50 (s)"]) == [2.5, 6.0, 1.0, 4.0]
+
+
+def test_get_histogram_df():
+  values = np.array([0.0, 1.0, 2.0, 4.0])
+  speakers = ["a", "b", "a", "b"]
+
+  result = get_histogram_df(values, speakers, n_bins=2)
+
+  assert list(result["From"]) == [0.0, 2.0]
+  assert list(result["To"]) == [2.0, 4.0]
+  assert list(result[OVERALL_NAME]) == [2, 2]
+  assert list(result["a"]) == [1, 1]
+  assert list(result["b"]) == [1, 1]
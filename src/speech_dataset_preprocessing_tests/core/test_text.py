@@ -0,0 +1,117 @@
+import pytest
+from speech_dataset_preprocessing.core.text import (TextData, TextDataList,
+                                                    change_ipa,
+                                                    map_symbols_in_batch,
+                                                    map_to_ipa)
+from text_utils import Language, SymbolFormat
+from text_utils import change_ipa as change_ipa_method
+from text_utils.pronunciation.ARPAToIPAMapper import symbols_map_arpa_to_ipa
+
+IPA_SYMBOLS = [
+  ("ð", "ə", " ", "k", "ˈæ", "t", " ", "s", "ˈɪ", "t", "s", "."),
+  ("ˈh", "aʊ", " ", "ˌaɪ", "d", "ˈi", "ə", "z", "?"),
+  ("t͡ʃ", "ˈɝ", "t͡ʃ", " ", "d͡ʒ", "ˈʌ", "d͡ʒ"),
+  ("m", "a˥˩", " ", "ʂ", "ʐ̩˧˥"),
+  (),
+]
+
+ARPA_SYMBOLS = [
+  ("HH", "AH0", "L", "OW1", " ", "W", "ER1", "L", "D", "!"),
+  ("DH", "AH0", " ", "K", "AE1", "T"),
+  ("B", "AY1", "T", "S"),
+]
+
+
+def _get_entry(entry_id: int, symbols, language: Language = Language.ENG) -> TextData:
+  return TextData(entry_id, symbols, language, SymbolFormat.GRAPHEMES)
+
+
+def test_map_symbols_in_batch__equals_per_entry_map():
+  def symbol_map(symbols, _):
+    # removes "-", duplicates "a" and upper-cases the rest
+    symbol = symbols[0]
+    if symbol == "-":
+      return ()
+    if symbol == "a":
+      return (symbol, symbol)
+    return (symbol.upper(),)
+
+  entries = [
+    _get_entry(0, ("a", "b", "-", "c")),
+    _get_entry(1, ()),
+    _get_entry(2, ("-", "-")),
+    _get_entry(3, ("c", "a")),
+  ]
+
+  result = map_symbols_in_batch(entries, symbol_map)
+
+  assert [entry.symbols for entry in result.items()] == [
+    ("a", "a", "B", "C"), (), (), ("C", "a", "a")]
+  assert [entry.entry_id for entry in result.items()] == [0, 1, 2, 3]
+
+
+def test_map_symbols_in_batch__map_per_language():
+  entries = [
+    _get_entry(0, ("a",), Language.ENG),
+    _get_entry(1, ("a",), Language.GER),
+  ]
+
+  result = map_symbols_in_batch(entries, lambda symbols, language: (repr(language),))
+
+  assert result.items()[0].symbols != result.items()[1].symbols
+
+
+def test_map_symbols_in_batch__map_is_called_once_per_symbol():
+  calls = []
+
+  def symbol_map(symbols, _):
+    calls.append(symbols)
+    return symbols
+
+  entries = [_get_entry(entry_id, ("a", "b", "a")) for entry_id in range(100)]
+
+  map_symbols_in_batch(entries, symbol_map)
+
+  assert sorted(calls) == [("a",), ("b",)]
+
+
+@pytest.mark.parametrize("ignore_tones, ignore_arcs, ignore_stress, break_n_thongs", [
+  (False, False, False, False),
+  (True, False, False, False),
+  (False, True, False, False),
+  (False, False, True, False),
+  (False, False, False, True),
+  (True, True, True, True),
+])
+def test_change_ipa__equals_per_entry_change_ipa(ignore_tones: bool, ignore_arcs: bool, ignore_stress: bool, break_n_thongs: bool):
+  # the batch path maps every distinct symbol once, it needs to return the symbols of the per-entry method
+  data = TextDataList(
+    TextData(entry_id, symbols, Language.ENG, SymbolFormat.PHONEMES_IPA)
+    for entry_id, symbols in enumerate(IPA_SYMBOLS)
+  )
+
+  result = change_ipa(data, ignore_tones, ignore_arcs, ignore_stress, break_n_thongs, build_n_thongs=False)
+
+  expected = [
+    change_ipa_method(symbols=symbols, ignore_tones=ignore_tones, ignore_arcs=ignore_arcs,
+                      ignore_stress=ignore_stress, break_n_thongs=break_n_thongs,
+                      build_n_thongs=False, language=Language.ENG)
+    for symbols in IPA_SYMBOLS
+  ]
+  assert [tuple(entry.symbols) for entry in result.items()] == [tuple(symbols) for symbols in expected]
+
+
+def test_map_to_ipa__equals_per_entry_arpa_mapping():
+  data = TextDataList(
+    TextData(entry_id, symbols, Language.ENG, SymbolFormat.PHONEMES_ARPA)
+    for entry_id, symbols in enumerate(ARPA_SYMBOLS)
+  )
+
+  result = map_to_ipa(data)
+
+  expected = [
+    symbols_map_arpa_to_ipa(arpa_symbols=symbols, ignore=set(),
+                            replace_unknown=False, replace_unknown_with=None)
+    for symbols in ARPA_SYMBOLS
+  ]
+  assert [tuple(entry.symbols) for entry in result.items()] == [tuple(symbols) for symbols in expected]
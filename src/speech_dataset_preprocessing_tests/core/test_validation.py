@@ -0,0 +1,143 @@
+from pathlib import Path
+
+import numpy as np
+from scipy.io.wavfile import write
+from speech_dataset_preprocessing.core.mel import MelData, MelEncoding
+from speech_dataset_preprocessing.core.text import TextData
+from speech_dataset_preprocessing.core.validation import (
+    MelValidation, MelValidationList, ValidationThresholds, WavValidationList,
+    get_excluded_entry_ids, get_excluded_mel_entry_ids,
+    get_excluded_text_entry_ids, get_issues, get_mel_issues, get_text_issues,
+    mark_duplicates, validate, validate_mel_entry, validate_text_entry,
+    validate_texts, validate_wav)
+from speech_dataset_preprocessing.core.wav import WavData, WavDataList
+from text_utils.language import Language
+from text_utils.symbol_format import SymbolFormat
+
+
+def test_validate_wav__int16():
+  wav = np.array([32767, -32768, 100, 100], dtype=np.int16)
+
+  result = validate_wav(0, wav, 22050)
+
+  assert result.n_samples == 4
+  assert not result.has_nan
+  assert result.clipping_rate == 0.5
+  assert abs(result.dc_offset - (199 / 4) / 32768) < 1e-12
+
+
+def test_validate_wav__uint8__offset_is_relative_to_centre():
+  wav = np.array([128, 160, 128, 96], dtype=np.uint8)
+
+  result = validate_wav(0, wav, 22050)
+
+  assert result.dc_offset == 0.0
+  assert result.clipping_rate == 0.0
+
+
+def test_validate_wav__float_with_nan():
+  wav = np.array([0.5, np.nan, 0.5, 1.0], dtype=np.float32)
+
+  result = validate_wav(0, wav, 22050)
+
+  assert result.has_nan
+  assert result.clipping_rate == 0.25
+
+
+def test_validate_wav__empty():
+  wav = np.zeros(0, dtype=np.int16)
+
+  result = validate_wav(0, wav, 22050)
+
+  assert get_issues(result, ValidationThresholds()) == ["empty"]
+
+
+def test_mark_duplicates__same_pcm__marks_later_entries():
+  wav = np.array([1, 2, 3], dtype=np.int16)
+  other = np.array([1, 2, 4], dtype=np.int16)
+  data = WavValidationList([
+    validate_wav(0, wav, 22050),
+    validate_wav(1, other, 22050),
+    validate_wav(2, wav.copy(), 22050),
+  ])
+
+  mark_duplicates(data)
+  result = get_excluded_entry_ids(data, ValidationThresholds())
+
+  assert [x.duplicate_of for x in data.items()] == [None, None, 0]
+  assert result == {2}
+
+
+def test_validate__truncated_file__is_reported_as_unreadable(tmp_path: Path):
+  write(tmp_path / "0.wav", 22050, np.array([1, 2, 3], dtype=np.int16))
+  write(tmp_path / "1.wav", 22050, np.array([1, 2, 3], dtype=np.int16))
+  # the header is cut within the riff chunk
+  (tmp_path / "1.wav").write_bytes((tmp_path / "1.wav").read_bytes()[:6])
+  data = WavDataList([
+    WavData(0, Path("0.wav"), 3 / 22050, 22050),
+    WavData(1, Path("1.wav"), 3 / 22050, 22050),
+  ])
+
+  result = validate(data, tmp_path, n_jobs=1)
+  excluded = get_excluded_entry_ids(result, ValidationThresholds())
+  valid, truncated = result.items()
+
+  assert valid.read_error is None
+  assert valid.n_samples == 3
+  assert truncated.read_error is not None
+  assert get_issues(truncated, ValidationThresholds()) == ["unreadable"]
+  assert excluded == {1}
+
+
+def _validate_mel(tmp_path: Path, mel: np.ndarray, n_channels: int):
+  np.save(tmp_path / "0.npy", mel)
+  entry = MelData(0, Path("0.npy"), n_channels, MelEncoding.NPY_FLOAT32, mel.shape[1])
+  return validate_mel_entry(entry, tmp_path)
+
+
+def test_validate_mel_entry__valid(tmp_path: Path):
+  result = _validate_mel(tmp_path, np.zeros((80, 10), dtype=np.float32), 80)
+
+  assert result.n_frames == 10
+  assert result.n_channels == 80
+  assert get_mel_issues(result) == []
+
+
+def test_validate_mel_entry__nan_and_other_channels(tmp_path: Path):
+  mel = np.zeros((40, 10), dtype=np.float32)
+  mel[3, 5] = np.inf
+
+  result = _validate_mel(tmp_path, mel, 80)
+
+  assert get_mel_issues(result) == ["channels", "nan"]
+
+
+def test_get_excluded_mel_entry_ids():
+  data = MelValidationList([
+    MelValidation(0, n_frames=10, n_channels=80, expected_n_channels=80, has_nan=False),
+    MelValidation(1, n_frames=0, n_channels=80, expected_n_channels=80, has_nan=False),
+  ])
+
+  result = get_excluded_mel_entry_ids(data)
+
+  assert result == {1}
+
+
+def test_validate_texts__blank_symbols_only__is_empty():
+  data = [
+    TextData(0, ("a", " ", "b"), Language.ENG, SymbolFormat.GRAPHEMES),
+    TextData(1, (" ", " "), Language.ENG, SymbolFormat.GRAPHEMES),
+    TextData(2, (), Language.ENG, SymbolFormat.GRAPHEMES),
+  ]
+
+  result = validate_texts(data)
+
+  assert [get_text_issues(x) for x in result.items()] == [[], ["empty"], ["empty"]]
+  assert get_excluded_text_entry_ids(result) == {1, 2}
+
+
+def test_validate_text_entry__counts_blank_symbols():
+  result = validate_text_entry(TextData(0, ("a", " ", "b"), Language.ENG, SymbolFormat.GRAPHEMES))
+
+  assert result.n_symbols == 3
+  assert result.n_blank_symbols == 1
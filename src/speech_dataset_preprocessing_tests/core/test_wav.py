@@ -1,3 +1,103 @@
 from pathlib import Path
 
-from speech_dataset_preprocessing.core.wav import WavData
+import numpy as np
+import pytest
+from scipy.io.wavfile import read, write
+from speech_dataset_preprocessing.core.packed import PackedWavWriter
+from speech_dataset_preprocessing.core.pcm import (get_full_scale,
+                                                   get_max_level, to_float)
+from speech_dataset_preprocessing.core.resample import ResampleMode
+from speech_dataset_preprocessing.core.wav import (FileWavWriter, WavData,
+                                                   WavDataList, convert_entry,
+                                                   downmix_to_mono,
+                                                   get_chunk_dbfs,
+                                                   get_trimmed_range,
+                                                   normalize, read_entry_wav)
+
+
+def test_get_chunk_dbfs__blocks_equal_whole_wav():
+  wav = np.random.default_rng(0).integers(-1000, 1000, size=1005, dtype=np.int16)
+
+  result = get_chunk_dbfs(wav, chunk_size=10, block_chunks=3)
+
+  assert len(result) == 101
+  assert np.allclose(result, get_chunk_dbfs(wav, chunk_size=10, block_chunks=1000))
+
+
+def test_get_chunk_dbfs__full_scale_is_zero_and_silence_is_minus_inf():
+  wav = np.array([-32768, -32768, 0, 0], dtype=np.int16)
+
+  result = get_chunk_dbfs(wav, chunk_size=2)
+
+  assert result[0] == 0
+  assert result[1] == -np.inf
+
+
+def test_get_trimmed_range():
+  wav = np.array([0] * 20 + [10000] * 30 + [0] * 25, dtype=np.int16)
+
+  result = get_trimmed_range(wav, sampling_rate=1000, chunk_size=10, threshold_start=-40,
+                             threshold_end=-40, buffer_start_ms=10, buffer_end_ms=0)
+
+  assert result == (10, 55)
+
+
+def test_get_trimmed_range__silence_only__is_empty():
+  wav = np.zeros(100, dtype=np.int16)
+
+  start, end = get_trimmed_range(wav, 1000, 10, -40, -40, 0, 0)
+
+  assert start == end
+
+
+def test_downmix_to_mono():
+  wav = np.array([[1, 3], [-2, -4], [5, 6]], dtype=np.int16)
+
+  result = downmix_to_mono(wav, block_size=2)
+
+  assert result.dtype == np.int16
+  assert result.tolist() == [2, -3, 6]
+
+
+@pytest.mark.parametrize("wav", [
+  np.array([0, 8192, -16384], dtype=np.int16),
+  np.array([0, 2 ** 29, -2 ** 30], dtype=np.int32),
+  np.array([128, 160, 64], dtype=np.uint8),
+  np.array([0.0, 0.125, -0.25], dtype=np.float32),
+])
+def test_convert_entry__peak_normalize(tmp_path: Path, wav: np.ndarray):
+  # unsigned samples are normalized around their centre, the peak is scaled to the largest value without clipping
+  write(tmp_path / "orig.wav", 1000, wav)
+  entry = WavData(0, Path("orig.wav"), 0.003, 1000, 3)
+  dest_dir = tmp_path / "dest"
+  dest_dir.mkdir()
+
+  result = convert_entry(entry, tmp_path, FileWavWriter(dest_dir, 1), to_mono=False,
+                         peak_normalize=True, new_rate=None, mode=ResampleMode.QUALITY)
+
+  _, new_wav = read(dest_dir / result.wav_relative_path)
+  assert new_wav.dtype == wav.dtype
+  assert new_wav[0] == wav[0]
+  assert to_float(new_wav)[2] == -get_max_level(wav.dtype)
+  np.testing.assert_allclose(to_float(new_wav)[1], 0.5, atol=1 / get_full_scale(wav.dtype))
+
+
+def test_normalize__packed_entries__are_written_packed(tmp_path: Path):
+  wavs = [np.array([0, 8192, -16384], dtype=np.int16), np.array([100, -50], dtype=np.int16)]
+  orig_dir = tmp_path / "orig"
+  orig_dir.mkdir()
+  with PackedWavWriter(orig_dir, np.dtype("int16"), shard_samples=10) as writer:
+    written = [writer.write(i, 1000, wav) for i, wav in enumerate(wavs)]
+  data = WavDataList([
+    WavData(i, relative_path, wav.shape[0] / 1000, 1000, wav.shape[0], wav_shard=shard)
+    for i, (wav, (relative_path, shard)) in enumerate(zip(wavs, written))
+  ])
+  dest_dir = tmp_path / "dest"
+  dest_dir.mkdir()
+
+  result = normalize(data, orig_dir, dest_dir, n_jobs=1, packed_dtype="int16")
+
+  for entry in result.items():
+    assert entry.wav_shard is not None
+    _, new_wav = read_entry_wav(entry, dest_dir)
+    assert np.max(np.abs(to_float(new_wav))) == get_max_level(np.dtype("int16"))
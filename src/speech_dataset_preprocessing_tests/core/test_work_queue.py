@@ -0,0 +1,87 @@
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from time import time
+
+import pytest
+from speech_dataset_preprocessing.core.work_queue import (QueueConfig,
+                                                          QueueRole, WorkQueue,
+                                                          run_queue,
+                                                          run_queued_stage)
+
+
+@dataclass()
+class _Entry:
+  entry_id: int
+  relative_path: Path
+
+
+def test_lease__returns_each_batch_once(tmp_path: Path):
+  queue = WorkQueue(tmp_path / "queue")
+  queue.create(entries_count=5, batch_size=2, run_id="run")
+
+  leases = [queue.lease("a", lease_s=60), queue.lease("b", lease_s=60), queue.lease("a", lease_s=60)]
+
+  assert queue.get_batches_count() == 3
+  assert [lease.positions for lease in leases] == [[0, 1], [2, 3], [4]]
+  assert queue.lease("b", lease_s=60) is None
+
+
+def test_lease__expired_lease_is_taken_over(tmp_path: Path):
+  queue = WorkQueue(tmp_path / "queue")
+  queue.create(entries_count=2, batch_size=2, run_id="run")
+  lease = queue.lease("a", lease_s=60)
+  leased_path = next(queue.leased_dir.iterdir())
+  os.utime(leased_path, (time() - 120, time() - 120))
+
+  result = queue.lease("b", lease_s=60)
+
+  assert result.positions == lease.positions
+  assert result.worker_id == "b"
+  assert not queue.renew(lease)
+  assert not queue.commit(lease, ["late"])
+  assert queue.commit(result, ["on time"])
+  assert queue.is_finished()
+  assert [results for _, _, results in queue.get_results()] == [["on time"]]
+
+
+def test_run_queued_stage__merges_in_input_order(tmp_path: Path):
+  entries = [_Entry(i, Path(f"{i}.wav")) for i in range(5)]
+  config = QueueConfig(QueueRole.COORDINATOR, batch_size=2, lease_s=60, poll_s=0)
+
+  def process_entries(batch, result_dir: Path):
+    for entry in batch:
+      (result_dir / entry.relative_path).write_text(str(entry.entry_id))
+    return batch
+
+  result = run_queued_stage(tmp_path, entries, process_entries, config, "relative_path")
+
+  assert [entry.entry_id for entry in result] == [0, 1, 2, 3, 4]
+  assert all((tmp_path / entry.relative_path).read_text() == str(entry.entry_id) for entry in result)
+
+
+def test_is_created__queue_of_other_run__is_not_joined(tmp_path: Path):
+  queue = WorkQueue(tmp_path / "queue")
+  queue.create(entries_count=2, batch_size=2, run_id="previous")
+
+  assert queue.is_created("previous")
+  assert not queue.is_created("next")
+  assert not WorkQueue(tmp_path / "missing").is_created("next")
+
+
+def test_run_queue__worker_without_run_id__raises(tmp_path: Path):
+  config = QueueConfig(QueueRole.WORKER, batch_size=2, lease_s=60, poll_s=0)
+
+  with pytest.raises(ValueError):
+    run_queue(tmp_path, 2, lambda positions, result_dir: positions, config)
+
+
+def test_run_queue__worker_of_coordinator_run__processes_nothing_after_finish(tmp_path: Path):
+  coordinator_config = QueueConfig(QueueRole.COORDINATOR, batch_size=2, lease_s=60, poll_s=0, run_id="run")
+  worker_config = QueueConfig(QueueRole.WORKER, batch_size=2, lease_s=60, poll_s=0, run_id="run")
+
+  coordinator_result = run_queue(tmp_path, 3, lambda positions, result_dir: positions, coordinator_config)
+  worker_result = run_queue(tmp_path, 3, lambda positions, result_dir: positions, worker_config)
+
+  assert sorted(positions for _, positions, _ in coordinator_result) == [[0, 1], [2]]
+  assert worker_result is None